@@ -0,0 +1,115 @@
+import cv2
+import os
+import time
+import queue
+import threading
+
+# ==========================================================
+# [ 背景存檔執行緒 ]
+# 擷取迴圈只負責把影像丟進有上限的佇列，JPEG 編碼與寫檔交給背景執行緒。
+# cv2.imencode 執行時會釋放 GIL，所以多開幾條執行緒就能真正並行編碼。
+# 佇列滿時 submit() 會等待 (不丟圖)，等待時間記錄在 backpressure 指標裡。
+# ==========================================================
+_STOP = object()
+
+class AsyncImageWriter:
+    def __init__(self, max_queue=16, workers=2, jpeg_quality=95):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.jpeg_quality = jpeg_quality
+        self.lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,
+            "written": 0,
+            "failed": 0,
+            "max_depth": 0,
+            "blocked_count": 0,
+            "blocked_sec": 0.0,
+            "write_sec": 0.0,
+        }
+        self.threads = [threading.Thread(target=self._worker, name=f"img-writer-{i}", daemon=True)
+                        for i in range(max(1, workers))]
+        for t in self.threads:
+            t.start()
+        self.closed = False
+
+    def submit(self, path, img):
+        """排入一張待存影像；佇列滿時阻塞直到有空位"""
+        item = (path, img)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            t0 = time.perf_counter()
+            self.queue.put(item)
+            with self.lock:
+                self.stats["blocked_count"] += 1
+                self.stats["blocked_sec"] += time.perf_counter() - t0
+        with self.lock:
+            self.stats["submitted"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], self.queue.qsize())
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                self.queue.task_done()
+                break
+            path, img = item
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                ok = self._write(path, img)
+            except Exception as e:
+                # 任何例外都不能讓執行緒結束，否則 task_done() 不會執行，flush() 會永遠卡住
+                print(f"[錯誤] 存檔失敗 {path}: {e}")
+            finally:
+                elapsed = time.perf_counter() - t0
+                with self.lock:
+                    self.stats["written" if ok else "failed"] += 1
+                    self.stats["write_sec"] += elapsed
+                self.queue.task_done()
+
+    def _write(self, path, img):
+        # 空影像 (例如切割框落在盤子影像之外) 無法編碼，直接略過
+        if img is None or img.size == 0:
+            print(f"[警告] 略過空影像: {path}")
+            return False
+        # 先寫暫存檔再改名，避免同時執行的切割程式讀到寫一半的 JPEG
+        try:
+            ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                return False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(buf.tobytes())
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            print(f"[錯誤] 存檔失敗 {path}: {e}")
+            return False
+
+    def flush(self):
+        """等待目前佇列內的影像全部寫完 (執行緒繼續運作)"""
+        self.queue.join()
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def summary(self):
+        with self.lock:
+            st = dict(self.stats)
+        done = st["written"] + st["failed"]
+        avg_ms = (st["write_sec"] / done * 1000) if done else 0.0
+        return (f"佇列 {self.depth()}/{self.queue.maxsize} (最高 {st['max_depth']}) | "
+                f"已寫 {st['written']}/{st['submitted']} 失敗 {st['failed']} | "
+                f"平均 {avg_ms:.1f} ms/張 | 等待 {st['blocked_count']} 次 {st['blocked_sec']:.2f}s")
+
+    def close(self):
+        """等待佇列內所有影像寫完後結束執行緒 (按 q 或收到 SIGTERM 時呼叫)"""
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for t in self.threads:
+            t.join()
@@ -5,19 +5,45 @@ import os
 import time
 import json
 import sys
+import signal
+import argparse
 from datetime import datetime
 
+from async_writer import AsyncImageWriter
+import dish_warp
+import crop_engine
+import frame_catalog
+
 # ==========================================================
 # [ 腳本路徑與設定讀取 ]
 # ==========================================================
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_EVERY = 50  # 每累積幾張整盤影像就等背景存檔寫完，記入影像型錄 (見 frame_catalog.py)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：五盤全自動縮時監測系統")
+    parser.add_argument("config", nargs="?", default=None,
+                        help="實驗設定檔 (預設: configs/exp_default_16x11.json)")
+    parser.add_argument("--low-power", action="store_true",
+                        help="省電模式：預覽降頻降解析度，只在擷取時才做全解析度偵測與校正")
+    parser.add_argument("--direct-crop", choices=["seed", "grid"], default=None,
+                        help="擷取時直接依 config_{dish}.json (seed) 或 configs/grid_{dish}.json (grid) 切割")
+    parser.add_argument("--storage", choices=crop_engine.STORAGE_CHOICES, default="jpg",
+                        help="直接切割的儲存格式：jpg / archive / both")
+    parser.add_argument("--online-detect", choices=["seed", "grid"], default=None,
+                        help="擷取時即時判定發芽 (seed) 或出苗 (grid)，座標來源同 --direct-crop")
+    parser.add_argument("--no-dish-jpeg", action="store_true",
+                        help="搭配 --direct-crop：不再另存整盤 JPEG")
+    return parser.parse_args()
+
+ARGS = parse_args()
 
 def load_config():
     # 預設設定檔路徑
     default_config = os.path.join(SCRIPT_DIR, "configs", "exp_default_16x11.json")
     
     # 檢查是否有命令列參數指定設定檔
-    config_path = sys.argv[1] if len(sys.argv) > 1 else default_config
+    config_path = ARGS.config or default_config
     
     if not os.path.isabs(config_path):
         config_path = os.path.join(SCRIPT_DIR, config_path)
@@ -49,6 +75,150 @@ def print_ui_instructions():
     print("║  's' 鍵 : 立即手動執行存檔 {' ':<31} ║")
     print("╚" + "═"*58 + "╝\n")
 
+def _handle_sigterm(signum, frame):
+    # systemd / kill 送出的 SIGTERM 比照 Ctrl+C 處理，讓 finally 區塊把佇列寫完
+    raise KeyboardInterrupt
+
+def detect_and_warp(frame, detector, warp_cache, display_frame=None):
+    """
+    偵測 ArUco 標記並對每個盤子做透視校正 (M 由 warp_cache 沿用或重算)。
+    Marker 被遮住時改用快取的 M，狀態記為 CACHE。
+    回傳 (ready_to_save, status_list)；有傳入 display_frame 時順便畫上框線。
+    """
+    # 4.13.0 新式偵測語法
+    corners, ids, rejected = detector.detectMarkers(frame)
+    
+    ready_to_save = {}
+    status_list = []
+
+    # 建立標記中心索引
+    marker_centers = dish_warp.marker_centers_from(corners, ids)
+
+    # 畫出偵測點 (方便除錯)
+    if display_frame is not None and ids is not None:
+        aruco.drawDetectedMarkers(display_frame, corners, ids)
+
+    # 所有盤子以預先建好的查表合併成一次 remap
+    warped_all = warp_cache.warp_all(frame, marker_centers)
+
+    for name, cfg in CONFIG["dishes"].items():
+        color = cfg['color']
+        warped, state, entry = warped_all[name]
+
+        if warped is not None:
+            # 繪製主畫面框線 (沿用快取時畫細線)
+            if display_frame is not None:
+                src_pts = entry["src"]
+                pts_display = src_pts.astype(np.int32).reshape((-1, 1, 2))
+                cv2.polylines(display_frame, [pts_display], True, color, 3 if state == "OK" else 1)
+                cv2.putText(display_frame, f"{name} {state}", (int(src_pts[0][0]), int(src_pts[0][1]-15)), 
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+            ready_to_save[name] = warped
+            status_list.append(f"{name}:{state}")
+        else:
+            status_list.append(f"{name}:LOSS" if ids is not None else f"{name}:NO_MARK")
+
+    return ready_to_save, status_list
+
+def capture_with_retry(cap, detector, warp_cache, burst):
+    """
+    省電模式的擷取：先丟掉緩衝區裡的舊影格，再做全解析度偵測與校正。
+    若有盤子缺 Marker，連續重抓最多 burst 張，合併各張中成功的盤子；
+    重抓後仍缺 Marker 的盤子才使用快取 M 校正的結果。
+    """
+    for _ in range(CONFIG.get("low_power_flush_frames", 2)):
+        cap.grab()
+
+    ready_to_save = {}
+    cached = {}
+    ok_attempt = {}
+    last_state = {}
+    frame = None
+    for attempt in range(max(1, burst)):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        ready, status_list = detect_and_warp(frame, detector, warp_cache)
+        for item in status_list:
+            name, state = item.split(":")
+            last_state[name] = state
+            if state == "OK" and name not in ready_to_save:
+                ready_to_save[name] = ready[name]
+                ok_attempt[name] = attempt
+            elif state == "CACHE":
+                cached[name] = ready[name]
+        if len(ready_to_save) == len(CONFIG["dishes"]):
+            break
+
+    status_list = []
+    for name in CONFIG["dishes"]:
+        if name in ok_attempt:
+            status_list.append(f"{name}:OK" if ok_attempt[name] == 0 else f"{name}:OK(retry{ok_attempt[name]})")
+        elif name in cached:
+            ready_to_save[name] = cached[name]
+            status_list.append(f"{name}:CACHE")
+        else:
+            status_list.append(f"{name}:{last_state.get(name, 'LOSS')}")
+    return frame, ready_to_save, status_list
+
+def load_dish_regions(mode):
+    """
+    依已存的種子座標 (seed: config_{dish}.json) 或網格設定 (grid: configs/grid_{dish}.json)
+    回傳 {dish: (設定檔內容, [(區域名稱, 切割框)])}，直接切割與即時判定共用。
+    """
+    project_root = os.path.dirname(SCRIPT_DIR)
+    dish_labels = list(CONFIG["dishes"])
+    dish_regions = {}
+
+    if mode == "seed":
+        import master_seed_processor as processor
+    else:
+        import grid_cell_processor as processor
+
+    for dish_label, config in processor.load_saved_configs(project_root, dish_labels).items():
+        if mode == "seed":
+            centers = processor.resolve_seed_centers(dish_label, config, project_root)
+            if not centers:
+                continue
+            regions = processor.seed_regions(centers, config["crop_size"])
+        else:
+            W = CONFIG["dishes"][dish_label].get("width", CONFIG["dish_width"])
+            H = CONFIG["dishes"][dish_label].get("height", CONFIG["dish_height"])
+            if config.get("image_size") and tuple(config["image_size"]) != (W, H):
+                print(f"[跳過] {dish_label}: 網格設定的影像尺寸 {config['image_size']} 與盤子輸出尺寸 {W}x{H} 不同。")
+                continue
+            params = dict(processor.CONFIG)
+            params.update(config)
+            final_cells = processor.compute_grid_cells(W, H, params)
+            if len(final_cells) != params["cols"] * params["rows"]:
+                print(f"[跳過] {dish_label}: 設定檔的 Margin/Gap 無法算出有效網格。")
+                continue
+            regions = processor.cell_regions(final_cells)
+        dish_regions[dish_label] = (config, regions)
+    return dish_regions
+
+def build_live_croppers(dish_regions, storage, writer, output_dir):
+    """每盤建立 LiveCropper，切割圖存到 output_folder 旁的 time_series_crops/<dish>/，與批次切割相同"""
+    crops_dir = os.path.join(os.path.dirname(output_dir), "time_series_crops")
+    croppers = {}
+    for dish_label, (config, regions) in dish_regions.items():
+        croppers[dish_label] = crop_engine.LiveCropper(
+            dish_label, regions, config, os.path.join(crops_dir, dish_label), storage, writer,
+            checkpoint_every=CONFIG.get("direct_crop_checkpoint", 10))
+        print(f"[系統] {dish_label}: 擷取時直接切割 {len(regions)} 個區域 -> {crops_dir}")
+    return croppers
+
+def build_online_trackers(mode, dish_regions, output_dir):
+    """每盤建立即時判定狀態 (seed: 發芽 / grid: 出苗)，事件記錄於 analysis_results/online_events.csv"""
+    import online_detector
+
+    tracker_cls = online_detector.GerminationTracker if mode == "seed" else online_detector.EmergenceTracker
+    trackers = {dish_label: tracker_cls(dish_label, regions) for dish_label, (_, regions) in dish_regions.items()}
+    event_log = online_detector.EventLog(os.path.join(os.path.dirname(output_dir), "analysis_results"))
+    event_log.restore(trackers)
+    print(f"[系統] 即時{'發芽' if mode == 'seed' else '出苗'}判定: {list(trackers)} -> {event_log.path}")
+    return trackers, event_log
+
 def run_auto_monitor():
     # --- 1. 初始化資料夾 ---
     script_path = os.path.abspath(__file__)
@@ -66,69 +236,136 @@ def run_auto_monitor():
     parameters = aruco.DetectorParameters()
     detector = aruco.ArucoDetector(aruco_dict, parameters)
 
-    W, H = CONFIG["dish_width"], CONFIG["dish_height"]
-    dst_pts = np.array([[0,0], [W-1,0], [W-1,H-1], [0,H-1]], dtype=np.float32)
+    # 每盤的 Homography 快取：Marker 穩定時沿用，漂移時重算，被遮住時備援
+    warp_cache = dish_warp.HomographyCache(CONFIG)
 
     last_capture_time = 0
+    capture_count = 0
     interval_sec = CONFIG["interval_minutes"] * 60
+
+    # 背景存檔：JPEG 編碼與寫檔不再卡住 cap.read() 與 ArUco 偵測
+    writer = AsyncImageWriter(max_queue=CONFIG.get("writer_queue", 16),
+                              workers=CONFIG.get("writer_threads", 2))
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+    # 整盤影像寫完後增量記入影像型錄，切割與產生器不必再掃描整個目錄
+    dish_recorder = frame_catalog.DirectoryRecorder(frame_catalog.for_image_dir(output_dir), output_dir)
     
     print_ui_instructions()
 
+    # 省電模式：平時只 grab 保持串流，依 preview_fps 偶爾解碼一張縮小預覽；
+    # 到了擷取時間才做全解析度的偵測與校正
+    low_power = ARGS.low_power or CONFIG.get("low_power", False)
+    preview_interval = 1.0 / max(0.1, CONFIG.get("low_power_preview_fps", 1))
+    preview_size = tuple(CONFIG.get("low_power_preview_size", [640, 480]))
+    retry_burst = CONFIG.get("low_power_retry_burst", 5)
+    last_preview_time = 0
+    if low_power:
+        # 緩衝區只留 1 張，擷取時拿到的才是最新影格
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        print(f"[系統] 省電模式：預覽 {1.0/preview_interval:.1f} fps @ {preview_size[0]}x{preview_size[1]}，"
+              f"缺 Marker 時最多重抓 {retry_burst} 張")
+
+    # 擷取時直接切割：校正後的影像不必先存成盤子 JPEG 再讀回來切
+    regions_by_mode = {}
+    for mode in {ARGS.direct_crop, ARGS.online_detect} - {None}:
+        regions_by_mode[mode] = load_dish_regions(mode)
+    croppers = {}
+    if ARGS.direct_crop:
+        croppers = build_live_croppers(regions_by_mode[ARGS.direct_crop], ARGS.storage, writer, output_dir)
+    save_dish_jpeg = not (ARGS.no_dish_jpeg and croppers)
+
+    # 即時判定：每次擷取只更新每顆種子 / 每個穴孔的一小份滾動狀態
+    trackers, event_log = {}, None
+    if ARGS.online_detect:
+        trackers, event_log = build_online_trackers(ARGS.online_detect, regions_by_mode[ARGS.online_detect], output_dir)
+
+    def save_ready(ready_to_save):
+        ts = time.strftime("%Y%m%d_%H%M%S")
+        for name, img in ready_to_save.items():
+            # 沒有切割設定的盤子仍保留整盤 JPEG
+            if save_dish_jpeg or name not in croppers:
+                writer.submit(os.path.join(output_dir, f"{ts}_{name}.jpg"), img)
+                dish_recorder.add(ts, f"{ts}_{name}.jpg", dish=name)
+            if name in croppers:
+                croppers[name].crop(ts, img)
+            if name in trackers:
+                events = trackers[name].update(ts, img)
+                event_log.write(ts, name, events)
+                for series_name, event, value in events:
+                    print(f"[事件] {name} {series_name}: {event} @ {value}")
+        if len(dish_recorder.pending) >= CATALOG_EVERY:
+            writer.flush()
+            dish_recorder.commit()
+
     try:
         while True:
+            current_time = time.time()
+            elapsed = current_time - last_capture_time
+
+            if low_power:
+                manual = False
+                if elapsed < interval_sec:
+                    if not cap.grab():
+                        print("[錯誤] 無法讀取相機，請檢查 V4K 硬體連線")
+                        break
+                    if current_time - last_preview_time >= preview_interval:
+                        ret, frame = cap.retrieve()
+                        if ret:
+                            preview = cv2.resize(frame, preview_size, interpolation=cv2.INTER_NEAREST)
+                            countdown = int(max(0, interval_sec - elapsed))
+                            cv2.putText(preview, f"[LOW POWER] Next Save: {countdown}s", (15, 30),
+                                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+                            cv2.imshow('Auto Monitor System (v4.13.0)', preview)
+                        last_preview_time = current_time
+
+                    key = cv2.waitKey(100) & 0xFF
+                    if key == ord('q'):
+                        break
+                    elif key != ord('s'):
+                        continue
+                    manual = True
+
+                frame, ready_to_save, status_list = capture_with_retry(cap, detector, warp_cache, retry_burst)
+                if frame is None:
+                    print("[錯誤] 無法讀取相機，請檢查 V4K 硬體連線")
+                    break
+                if ready_to_save:
+                    save_ready(ready_to_save)
+                    label = "手動存檔" if manual else "自動存檔"
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] {label} | {' | '.join(status_list)} | 佇列 {writer.depth()}")
+                else:
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 擷取失敗，稍後重試 | {' | '.join(status_list)}")
+                    # Marker 被擋住時不要每個迴圈都全解析度重試，隔幾秒再試
+                    if not manual:
+                        last_capture_time = current_time - interval_sec + CONFIG.get("low_power_retry_delay", 10)
+                if not manual and ready_to_save:
+                    last_capture_time = current_time
+                    capture_count += 1
+                    if capture_count % 60 == 0:
+                        print(f"[系統] 存檔統計: {writer.summary()}")
+                        print(f"[系統] 校正統計: {warp_cache.summary()}")
+                continue
+
             ret, frame = cap.read()
             if not ret:
                 print("[錯誤] 無法讀取相機，請檢查 V4K 硬體連線")
                 break
 
-            current_time = time.time()
             display_frame = frame.copy()
-            
-            # 4.13.0 新式偵測語法
-            corners, ids, rejected = detector.detectMarkers(frame)
-            
-            ready_to_save = {}
-            status_list = []
-
-            if ids is not None:
-                # 建立標記中心索引
-                marker_centers = {int(mid[0]): np.mean(c[0], axis=0) for c, mid in zip(corners, ids)}
-                
-                # 畫出偵測點 (方便除錯)
-                aruco.drawDetectedMarkers(display_frame, corners, ids)
-
-                for name, cfg in CONFIG["dishes"].items():
-                    target_ids = cfg['ids']
-                    color = cfg['color']
-                    
-                    if all(tid in marker_centers for tid in target_ids):
-                        src_pts = np.array([marker_centers[tid] for tid in target_ids], dtype=np.float32)
-                        
-                        # 繪製主畫面框線
-                        pts_display = src_pts.astype(np.int32).reshape((-1, 1, 2))
-                        cv2.polylines(display_frame, [pts_display], True, color, 3)
-                        cv2.putText(display_frame, f"{name} OK", (int(src_pts[0][0]), int(src_pts[0][1]-15)), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-                        
-                        # 透視校正
-                        M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-                        ready_to_save[name] = cv2.warpPerspective(frame, M, (W, H))
-                        status_list.append(f"{name}:OK")
-                    else:
-                        status_list.append(f"{name}:LOSS")
-            else:
-                for name in CONFIG["dishes"]: status_list.append(f"{name}:NO_MARK")
+            ready_to_save, status_list = detect_and_warp(frame, detector, warp_cache, display_frame)
 
             # 定時抓圖邏輯
-            elapsed = current_time - last_capture_time
             if elapsed >= interval_sec:
                 if ready_to_save:
-                    ts = time.strftime("%Y%m%d_%H%M%S")
-                    for name, img in ready_to_save.items():
-                        cv2.imwrite(os.path.join(output_dir, f"{ts}_{name}.jpg"), img)
+                    save_ready(ready_to_save)
                     
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 自動存檔 | {' | '.join(status_list)}")
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 自動存檔 | {' | '.join(status_list)} | 佇列 {writer.depth()}")
                     last_capture_time = current_time
+                    capture_count += 1
+                    # 定期輸出存檔佇列指標，寫入速度跟不上時可以及早發現
+                    if capture_count % 60 == 0:
+                        print(f"[系統] 存檔統計: {writer.summary()}")
+                        print(f"[系統] 校正統計: {warp_cache.summary()}")
 
             # 顯示預覽
             preview = cv2.resize(display_frame, (1024, 768))
@@ -142,14 +379,23 @@ def run_auto_monitor():
                 break
             elif key == ord('s'):
                 if ready_to_save:
-                    ts = time.strftime("%Y%m%d_%H%M%S")
-                    for name, img in ready_to_save.items():
-                        cv2.imwrite(os.path.join(output_dir, f"{ts}_{name}.jpg"), img)
-                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 手動存檔成功")
+                    save_ready(ready_to_save)
+                    print(f"[{datetime.now().strftime('%H:%M:%S')}] 手動存檔已排入佇列")
 
+    except KeyboardInterrupt:
+        print("\n[系統] 收到中止訊號，正在結束監測...")
     finally:
         cap.release()
         cv2.destroyAllWindows()
+        print(f"[系統] 等待背景存檔完成 (尚有 {writer.depth()} 張)...")
+        for cropper in croppers.values():
+            cropper.close()
+        if event_log is not None:
+            event_log.close()
+        writer.close()
+        dish_recorder.commit()
+        print(f"[系統] 存檔統計: {writer.summary()}")
+        print(f"[系統] 校正統計: {warp_cache.summary()}")
 
 if __name__ == "__main__":
     run_auto_monitor()
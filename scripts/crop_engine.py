@@ -0,0 +1,355 @@
+import cv2
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import tile_archive
+import frame_catalog
+
+# ==========================================================
+# [ 共用切割引擎 ]
+# master_seed_processor (種子) 與 grid_cell_processor (穴孔) 共用：
+#   1. 規劃：比對 crop_manifest.json，決定哪些影像 / 哪些區域需要切割
+#   2. 執行：以多行程 (Process Pool) 分散「解碼 -> 切割 -> 編碼」到所有核心
+# 輸出路徑與單行程版本完全相同：time_series_crops/<dish>/<seed|cell>/<timestamp>.jpg
+# 儲存格式 (storage)：
+#   "jpg"     : 每張切割圖一個 JPEG (預設，與舊版相同)
+#   "archive" : 寫入 time_series_crops/<dish>/_tiles/ 封存檔 (見 tile_archive.py)
+#   "both"    : 兩者同時寫入
+# ==========================================================
+MANIFEST_NAME = "crop_manifest.json"
+STORAGE_CHOICES = ["jpg", "archive", "both"]
+CHECKPOINT_EVERY = 200  # 每處理幾張就寫回一次 manifest，中斷後可從此處續跑
+
+def default_workers():
+    return os.cpu_count() or 1
+
+def config_hash(config):
+    """以排序後的 JSON 內容計算設定檔指紋，用來判斷設定檔是否變動"""
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+def load_manifest(output_base):
+    manifest_path = os.path.join(output_base, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        print(f"[警告] 無法讀取 {manifest_path}，將視為全新切割。")
+        return None
+
+def save_manifest(output_base, manifest):
+    # 先寫暫存檔再替換，避免中途斷電留下半個 JSON
+    os.makedirs(output_base, exist_ok=True)
+    manifest_path = os.path.join(output_base, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+def manifest_geometry(manifest):
+    """
+    manifest 記錄的各區域切割框 {名稱: [x1, y1, x2, y2]}。
+    早期版本的 manifest 以 "seeds" 記錄 {名稱: [cx, cy, crop_size]}，讀取時換算成切割框，
+    避免升級後被誤判為座標變動而整盤重切。
+    """
+    if "regions" in manifest:
+        return manifest["regions"]
+    return {name: list(seed_box(*geo)) for name, geo in manifest.get("seeds", {}).items()}
+
+def storage_kinds(storage):
+    return {"jpg", "archive"} if storage == "both" else {storage}
+
+def seed_box(cx, cy, crop_size):
+    """
+    種子中心 -> 切割框 (x1, y1, x2, y2)。框可能超出影像邊界：
+    JPEG 輸出沿用原本 img[max(0,cy-s):cy+s, max(0,cx-s):cx+s] 的截邊切法，封存檔則補黑成固定尺寸。
+    """
+    s = int(crop_size)
+    return (int(cx) - s, int(cy) - s, int(cx) + s, int(cy) + s)
+
+def list_dish_frames(input_dir, dish_label, start_timestamp):
+    """回傳該 Dish 在基準時間之後的 [(timestamp, 影像路徑)]，以及該 Dish 的總張數 (查詢影像型錄，見 frame_catalog.py)"""
+    catalog = frame_catalog.for_image_dir(input_dir)
+    frames = catalog.dish_images(input_dir, dish_label, start=start_timestamp)
+    return frames, catalog.count_dish_images(input_dir, dish_label)
+
+def region_recorders(output_base, dish_label, regions):
+    """每個區域 (種子 / 穴孔) 目錄一個型錄寫入端，JPEG 切割圖寫完後記入影像型錄"""
+    catalog = frame_catalog.for_dish_dir(output_base)
+    return {name: frame_catalog.DirectoryRecorder(catalog, os.path.join(output_base, name), dish_label, name)
+            for name, _ in regions}
+
+# ==========================================================
+# [ 規劃：增量 / 局部重切 ]
+# ==========================================================
+def plan_crop_jobs(dish_label, frames, regions, config, output_base, storage="jpg"):
+    """
+    regions: [(子目錄名稱, (x1, y1, x2, y2)), ...]
+    透過 manifest 記錄已處理的時間點與設定指紋：
+      - 設定未變：只切新進影像
+      - 設定變動：新影像全切，舊影像只重切幾何有變的區域
+    """
+    kinds = storage_kinds(storage)
+    new_hash = config_hash(config)
+    new_geometry = {name: list(box) for name, box in regions}
+    manifest = load_manifest(output_base)
+
+    archive = None
+    if "archive" in kinds:
+        x1, y1, x2, y2 = regions[0][1]
+        archive = tile_archive.TileArchive.open_for_regions(
+            os.path.join(output_base, tile_archive.ARCHIVE_DIRNAME), [name for name, _ in regions], y2 - y1, x2 - x1)
+
+    if manifest is None:
+        processed = set()
+        old_hash, old_geometry = new_hash, new_geometry
+        changed = []
+    else:
+        processed = set(manifest.get("processed", []))
+        old_hash = manifest.get("config_hash")
+        old_geometry = manifest_geometry(manifest)
+        if old_hash == new_hash:
+            changed = []
+        else:
+            changed = [name for name, box in new_geometry.items() if old_geometry.get(name) != box]
+        # 換了儲存格式時，已處理清單只對兩種格式都有的部分有效
+        if "jpg" in kinds and "jpg" not in storage_kinds(manifest.get("storage", "jpg")):
+            processed = set()
+    if archive is not None:
+        processed &= set(archive.timestamps())
+
+    changed_regions = [(name, box) for name, box in regions if name in changed]
+    selected = []
+    for timestamp, img_path in frames:
+        if timestamp not in processed:
+            selected.append((timestamp, img_path, list(regions)))
+        elif changed_regions:
+            selected.append((timestamp, img_path, changed_regions))
+
+    recorders = region_recorders(output_base, dish_label, regions) if "jpg" in kinds else {}
+    rows = archive.reserve_rows([job[0] for job in selected]) if archive is not None else {}
+    location = archive.write_location() if archive is not None else None
+    jobs = [(timestamp, img_path, output_base, job_regions, "jpg" in kinds, location, rows.get(timestamp))
+            for timestamp, img_path, job_regions in selected]
+
+    # 區域變少時 (例如重新鎖定後種子數減少)，多出來的舊目錄 / 封存檔槽位不會再更新。
+    # 切割圖可能是唯一的副本 (--direct-crop --no-dish-jpeg)，因此只提示、不自動刪除
+    leftover = [name for name in tile_archive.list_series(output_base) if name not in new_geometry]
+    if leftover:
+        print(f"[警告] {dish_label}: 目前設定沒有 {', '.join(leftover)}，這些舊的切割結果不會再更新，"
+              f"確認不需要後可手動刪除 {output_base} 底下對應的目錄 (封存檔中的槽位會保留)。")
+
+    n_new = sum(1 for ts, _ in frames if ts not in processed)
+    print(f"[系統] {dish_label} 設定指紋: {new_hash} | 新影像: {n_new} 張 | "
+          f"需重切區域: {len(changed_regions)} 個 x {len(jobs) - n_new} 張")
+
+    return {
+        "dish": dish_label,
+        "output_base": output_base,
+        "storage": storage,
+        "archive": archive,
+        "recorders": recorders,
+        "jobs": jobs,
+        "n_regions": len(regions),
+        "processed": processed,
+        "new_hash": new_hash,
+        "new_geometry": new_geometry,
+        # 幾何有變時，中途存檔仍記錄舊幾何，確保中斷後會把尚未重切的區域補完
+        "checkpoint_hash": old_hash if changed else new_hash,
+        "checkpoint_geometry": old_geometry if changed else new_geometry,
+    }
+
+def _manifest_from_plan(plan, final):
+    return {
+        "config_hash": plan["new_hash"] if final else plan["checkpoint_hash"],
+        "regions": plan["new_geometry"] if final else plan["checkpoint_geometry"],
+        "processed": sorted(plan["processed"]),
+        "storage": plan["storage"],
+    }
+
+def _checkpoint(plan, final):
+    # 先把封存檔索引與影像型錄落盤，再更新 manifest，順序不能顛倒
+    if plan["archive"] is not None:
+        plan["archive"].flush()
+        if final:
+            plan["archive"].close()
+    for recorder in plan["recorders"].values():
+        recorder.commit()
+    save_manifest(plan["output_base"], _manifest_from_plan(plan, final))
+
+# ==========================================================
+# [ 執行：多行程切割 ]
+# ==========================================================
+def _init_worker():
+    # 每個行程只用單執行緒，避免 OpenCV 內部執行緒與行程數互搶核心
+    cv2.setNumThreads(1)
+
+def crop_frame(job):
+    """解碼一張 Dish 影像並寫出所有區域的切割圖，回傳 (timestamp, 是否成功)"""
+    timestamp, img_path, output_base, regions, write_jpg, archive_location, row = job
+    batch_img = cv2.imread(img_path)
+    if batch_img is None:
+        return timestamp, False
+    if write_jpg:
+        for name, (x1, y1, x2, y2) in regions:
+            region_dir = os.path.join(output_base, name)
+            os.makedirs(region_dir, exist_ok=True)
+            crop = batch_img[max(0, y1):y2, max(0, x1):x2]
+            cv2.imwrite(os.path.join(region_dir, f"{timestamp}.jpg"), crop)
+    if archive_location is not None:
+        tiles = {name: tile_archive.extract_tile(batch_img, box) for name, box in regions}
+        tile_archive.write_tiles(archive_location, row, tiles)
+    return timestamp, True
+
+def run_crop_plans(plans, workers=None):
+    """
+    將多個 Dish 的切割工作合併後分散到各核心執行。
+    工作依 (時間, Dish) 排序並依序回報，輸出內容與執行順序無關。
+    """
+    workers = workers or default_workers()
+    tasks = []
+    for plan in plans:
+        for job in plan["jobs"]:
+            tasks.append((job[0], plan["dish"], plan, job))
+    tasks.sort(key=lambda t: (t[0], t[1]))
+
+    if not tasks:
+        print("[系統] 沒有需要處理的影像，所有切割皆為最新狀態。")
+    else:
+        print(f"[系統] 共 {len(tasks)} 張影像待切割，使用 {workers} 個行程。")
+
+    job_list = [t[3] for t in tasks]
+    if workers <= 1 or len(job_list) <= 1:
+        results = map(crop_frame, job_list)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        chunksize = max(1, min(32, len(job_list) // (workers * 8)))
+        results = executor.map(crop_frame, job_list, chunksize=chunksize)
+
+    done_per_plan = {}
+    try:
+        for (timestamp, dish, plan, job), (_, ok) in zip(tasks, results):
+            img_name = os.path.basename(job[1])
+            if not ok:
+                print(f"  ! 無法讀取: {img_name}")
+                continue
+            if plan["archive"] is not None:
+                plan["archive"].commit(timestamp, job[6])
+            for name, _ in job[3]:
+                if name in plan["recorders"]:
+                    plan["recorders"][name].add(timestamp, f"{timestamp}.jpg")
+            if len(job[3]) == plan["n_regions"]:
+                plan["processed"].add(timestamp)
+            print(f"  > 處理完畢: {img_name}")
+
+            done_per_plan[dish] = done_per_plan.get(dish, 0) + 1
+            if done_per_plan[dish] % CHECKPOINT_EVERY == 0:
+                _checkpoint(plan, final=False)
+    except BaseException:
+        # 中斷 (Ctrl+C) 時仍保留已完成的進度，下次執行從這裡續跑
+        for plan in plans:
+            _checkpoint(plan, final=False)
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    for plan in plans:
+        _checkpoint(plan, final=True)
+
+# ==========================================================
+# [ 擷取時直接切割 (auto_timelapse_monitor --direct-crop) ]
+# 校正後的盤子影像還在記憶體中就直接切出種子 / 穴孔，省去
+# 「盤子 JPEG 編碼 -> 解碼 -> 切割」這一輪。輸出路徑與批次切割相同，
+# 並把時間點記入 crop_manifest.json，之後跑 --headless 不會重切。
+# ==========================================================
+class LiveCropper:
+    def __init__(self, dish_label, regions, config, output_base, storage="jpg", writer=None, checkpoint_every=10):
+        """
+        writer: AsyncImageWriter，JPEG 切割圖交給背景執行緒編碼；None 時直接 cv2.imwrite
+        """
+        self.dish = dish_label
+        self.regions = list(regions)
+        self.output_base = output_base
+        self.storage = storage
+        self.kinds = storage_kinds(storage)
+        self.writer = writer
+        self.checkpoint_every = checkpoint_every
+        self.new_hash = config_hash(config)
+        self.geometry = {name: list(box) for name, box in self.regions}
+        self.pending = 0
+        self.recorders = region_recorders(output_base, dish_label, self.regions) if "jpg" in self.kinds else {}
+
+        self.archive = None
+        if "archive" in self.kinds:
+            x1, y1, x2, y2 = self.regions[0][1]
+            self.archive = tile_archive.TileArchive.open_for_regions(
+                os.path.join(output_base, tile_archive.ARCHIVE_DIRNAME), [name for name, _ in self.regions], y2 - y1, x2 - x1)
+            self.location = self.archive.write_location()
+
+        # 既有 manifest 的設定或儲存格式不同時，只寫切割圖、不更新 manifest，
+        # 交給下一次批次切割依新設定補齊
+        manifest = load_manifest(output_base)
+        self.track = True
+        self.processed = set()
+        if manifest is not None:
+            if manifest.get("config_hash") != self.new_hash or manifest.get("storage", "jpg") != storage:
+                self.track = False
+                print(f"[警告] {dish_label}: crop_manifest.json 的設定或儲存格式與目前不同，"
+                      f"直接切割的結果不會記入 manifest，請之後再跑一次 --headless 批次切割。")
+            else:
+                self.processed = set(manifest.get("processed", []))
+
+    def crop(self, timestamp, dish_img):
+        """切割一張校正後的盤子影像 (BGR ndarray)"""
+        if "jpg" in self.kinds:
+            for name, (x1, y1, x2, y2) in self.regions:
+                path = os.path.join(self.output_base, name, f"{timestamp}.jpg")
+                crop = dish_img[max(0, y1):y2, max(0, x1):x2]
+                if crop.size == 0:
+                    # 切割框整個落在盤子影像之外 (盤子輸出尺寸與座標設定不符)
+                    print(f"[警告] {name} 的切割框 {(x1, y1, x2, y2)} 不在盤子影像內，略過。")
+                    continue
+                if self.writer is not None:
+                    self.writer.submit(path, crop)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    cv2.imwrite(path, crop)
+                self.recorders[name].add(timestamp, f"{timestamp}.jpg")
+        if self.archive is not None:
+            row = self.archive.reserve_rows([timestamp])[timestamp]
+            tiles = {name: tile_archive.extract_tile(dish_img, box) for name, box in self.regions}
+            tile_archive.write_tiles(self.location, row, tiles)
+            self.archive.commit(timestamp, row)
+
+        self.processed.add(timestamp)
+        self.pending += 1
+        if self.pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        # JPEG 要確實寫完才能記入 manifest，否則中斷後會有記錄了卻不存在的切割圖
+        if self.writer is not None and "jpg" in self.kinds:
+            self.writer.flush()
+        if self.archive is not None:
+            self.archive.flush()
+        for recorder in self.recorders.values():
+            recorder.commit()
+        if self.track:
+            save_manifest(self.output_base, {
+                "config_hash": self.new_hash,
+                "regions": self.geometry,
+                "processed": sorted(self.processed),
+                "storage": self.storage,
+            })
+        self.pending = 0
+
+    def close(self):
+        self.checkpoint()
+        if self.archive is not None:
+            self.archive.close()
@@ -1,7 +1,13 @@
 import os
-import glob
+import argparse
 from PIL import Image, ImageDraw, ImageFont
 import math
+import functools
+import numpy as np
+
+import tile_archive
+import montage_engine
+import tile_pyramid
 
 # ==========================================================
 # [ 設定參數 ]
@@ -9,6 +15,12 @@ import math
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INPUT_BASE_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp2_soil_tray", "time_series_crops")
 OUTPUT_BASE_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp2_soil_tray", "daily_montages")
+# 預覽模式 (--preview)：每格縮成約一半，JPEG 只需解出 1/2 尺寸 (見 tile_archive.load_thumbnail)
+PREVIEW_OUTPUT_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp2_soil_tray", "daily_montages_preview")
+# --pyramid：圖磚金字塔與瀏覽器
+PYRAMID_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp2_soil_tray", "pyramids")
+CELL_SIZE = 189          # 維持切割原始大小 (約 189x189) 以利看清細節
+PREVIEW_CELL_SIZE = 94
 
 # 字型路徑 (Linux 常見路徑)
 FONT_PATHS = [
@@ -17,42 +29,72 @@ FONT_PATHS = [
     "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf"
 ]
 
+@functools.lru_cache(maxsize=None)
 def get_font(size):
     for path in FONT_PATHS:
         if os.path.exists(path):
             return ImageFont.truetype(path, size)
     return ImageFont.load_default()
 
-def create_half_daily_cell_montage(dish, cell_name, date, am_pm, image_list):
+# ==========================================================
+# [ 版面 ]
+# 10分鐘一格，12小時一張：一列 12 格 (2 小時)，共 6 列 = 72 個位置
+# ==========================================================
+COLS, ROWS = 12, 6
+SLOT_INTERVAL = 10 # 分鐘
+PADDING_X, PADDING_Y = 6, 8
+TEXT_HEIGHT = 14
+HEADER_HEIGHT = 80
+MARGIN_X, MARGIN_Y = 30, 30
+BG_COLOR = (15, 15, 15)
+
+def slot_origin(i, cell_size):
+    """第 i 格影像的左上角座標"""
+    r, c = divmod(i, COLS)
+    return (MARGIN_X + c * (cell_size + PADDING_X),
+            MARGIN_Y + HEADER_HEIGHT + r * (cell_size + PADDING_Y + TEXT_HEIGHT))
+
+@functools.lru_cache(maxsize=None)
+def layout_template(am_pm, cell_size):
+    """
+    上午 / 下午各一張共用底圖：背景與 72 個固定的時間標籤 (HH:MM)。
+    每個行程只畫一次，之後每張大圖從 copy() 開始，只補上標題與影像。
+    """
+    canvas_w = COLS * (cell_size + PADDING_X) + MARGIN_X * 2
+    canvas_h = ROWS * (cell_size + PADDING_Y + TEXT_HEIGHT) + MARGIN_Y * 2 + HEADER_HEIGHT
+    canvas = Image.new('RGB', (canvas_w, canvas_h), BG_COLOR)
+    draw = ImageDraw.Draw(canvas)
+    font_cell = get_font(12)
+    offset_hours = 0 if am_pm == "AM" else 12
+    for i in range(COLS * ROWS):
+        x, y = slot_origin(i, cell_size)
+        # 計算此位置代表的時間
+        target_total_min = i * SLOT_INTERVAL
+        formatted_time = f"{target_total_min // 60 + offset_hours:02d}:{target_total_min % 60:02d}"
+        draw.text((x + cell_size // 2 - 14, y + cell_size + 2), formatted_time, font=font_cell, fill=(100, 100, 100))
+    return canvas
+
+def montage_path(dish, cell_name, date, am_pm, preview=False):
+    output_dir = PREVIEW_OUTPUT_DIR if preview else OUTPUT_BASE_DIR
+    return os.path.join(output_dir, dish, cell_name, f"{date}_{am_pm}_montage.jpg")
+
+def create_half_daily_cell_montage(dish, cell_name, date, am_pm, image_list, preview=False, backend="pil"):
     """
     為特定的 Dish、Cell 和 日期(上午/下午) 建立縮時大圖 (10分鐘一格，12小時一張，一列6格，共12列)
+    image_list: [(timestamp, ref)]，ref 為 JPEG 路徑或封存檔位置 (見 tile_archive.py)
+    preview   : 以 PREVIEW_CELL_SIZE 產生預覽圖，輸出到 PREVIEW_OUTPUT_DIR
+    backend   : "pil" 逐格貼上 / "numpy" 整批寫入 (見 montage_engine.py)，輸出相同
     """
-    slot_interval = 10
-    cols = 12
-    rows = 6
-    # 共有 72 個位置 (12小時)
-    
-    cell_w, cell_h = 189, 189 # 維持切割原始大小 (約 189x189) 以利看清細節
-    padding_x, padding_y = 6, 8
-    text_height = 14
-    header_height = 80
-    margin_x, margin_y = 30, 30
-    
-    cw = cell_w + padding_x
-    ch = cell_h + padding_y + text_height
-    
-    canvas_w = cols * cw + margin_x * 2
-    canvas_h = rows * ch + margin_y * 2 + header_height
+    cell_size = PREVIEW_CELL_SIZE if preview else CELL_SIZE
     
     # 將影像放入對應的 Time-Slot
-    slots = [None] * (cols * rows)
+    slots = [None] * (COLS * ROWS)
     offset_hours = 0 if am_pm == "AM" else 12
     has_image = False
     
-    for img_path in image_list:
-        filename = os.path.basename(img_path)
+    for timestamp, img_path in image_list:
         try:
-            time_part = filename.split('_')[1]
+            time_part = timestamp.split('_')[1]
             h = int(time_part[0:2])
             m = int(time_part[2:4])
             
@@ -61,7 +103,7 @@ def create_half_daily_cell_montage(dish, cell_name, date, am_pm, image_list):
             if am_pm == "PM" and h < 12: continue
             
             total_minutes = (h - offset_hours) * 60 + m
-            slot_idx = total_minutes // slot_interval
+            slot_idx = total_minutes // SLOT_INTERVAL
             
             if 0 <= slot_idx < len(slots):
                 if slots[slot_idx] is None:
@@ -73,62 +115,45 @@ def create_half_daily_cell_montage(dish, cell_name, date, am_pm, image_list):
     if not has_image:
         return # 如果這個半天沒有任何照片，就不產生空圖
 
-    # 建立畫布
-    bg_color = (15, 15, 15)
-    canvas = Image.new('RGB', (canvas_w, canvas_h), bg_color)
+    # 由共用底圖開始 (背景與時間標籤已畫好)
+    canvas = layout_template(am_pm, cell_size).copy()
     draw = ImageDraw.Draw(canvas)
     
-    # 讀取字型
-    font_header = get_font(30)
-    font_cell = get_font(12)
-    
     # 繪製標題
     header_text_main = f"Soil Emergence | Date: {date} ({am_pm})"
-    header_text_sub = f"Location: {dish} - {cell_name} | Interval: {slot_interval} min grid"
+    header_text_sub = f"Location: {dish} - {cell_name} | Interval: {SLOT_INTERVAL} min grid"
     
-    draw.text((margin_x, margin_y), header_text_main, font=font_header, fill=(255, 255, 255))
-    draw.text((margin_x, margin_y + 40), header_text_sub, font=get_font(20), fill=(250, 180, 50))
+    draw.text((MARGIN_X, MARGIN_Y), header_text_main, font=get_font(30), fill=(255, 255, 255))
+    draw.text((MARGIN_X, MARGIN_Y + 40), header_text_sub, font=get_font(20), fill=(250, 180, 50))
     
-    # 按順序繪製 72 個位置
-    for i in range(cols * rows):
-        r = i // cols
-        c = i % cols
-        
-        x = margin_x + c * cw
-        y = margin_y + header_height + r * ch
-        
-        # 計算此位置代表的時間
-        target_total_min = i * slot_interval
-        th = (target_total_min // 60) + offset_hours
-        tm = target_total_min % 60
-        formatted_time = f"{th:02d}:{tm:02d}"
-        
-        img_path = slots[i]
-        
-        if img_path:
-            try:
-                with Image.open(img_path) as img:
-                    img_resized = img.resize((cell_w, cell_h), Image.Resampling.LANCZOS)
-                    canvas.paste(img_resized, (x, y))
-            except:
-                pass
-        else:
-            # 沒圖的位置畫一個淡灰色框框示意
-            draw.rectangle([x, y, x + cell_w, y + cell_h], outline=(40, 40, 40), width=1)
-            
-        # 繪製時間文字
-        text_x = x + cell_w // 2 - 14
-        text_y = y + cell_h + 2
-        draw.text((text_x, text_y), formatted_time, font=font_cell, fill=(100, 100, 100))
+    # 貼上影像；沒圖的位置畫一個淡灰色框框示意
+    if backend == "numpy":
+        filled = [i for i, ref in enumerate(slots) if ref]
+        empty = [i for i, ref in enumerate(slots) if not ref]
+        arr = np.array(canvas)
+        grid = montage_engine.grid_view(arr, slot_origin(0, cell_size), ROWS, COLS,
+                                        (cell_size + PADDING_X, cell_size + PADDING_Y + TEXT_HEIGHT))
+        montage_engine.paste_tiles(grid, filled, [slots[i] for i in filled], (cell_size, cell_size))
+        montage_engine.draw_frames(grid, empty, (cell_size, cell_size), (40, 40, 40))
+        canvas = Image.fromarray(arr)
+    else:
+        for i, img_path in enumerate(slots):
+            x, y = slot_origin(i, cell_size)
+            if img_path:
+                try:
+                    canvas.paste(tile_archive.load_thumbnail(img_path, (cell_size, cell_size)), (x, y))
+                except:
+                    pass
+            else:
+                draw.rectangle([x, y, x + cell_size, y + cell_size], outline=(40, 40, 40), width=1)
             
     # 儲存結果
-    output_dir = os.path.join(OUTPUT_BASE_DIR, dish, cell_name)
-    os.makedirs(output_dir, exist_ok=True)
-    save_path = os.path.join(output_dir, f"{date}_{am_pm}_montage.jpg")
+    save_path = montage_path(dish, cell_name, date, am_pm, preview)
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
     canvas.save(save_path, quality=90)
-    print(f"  > 已生成大圖: {save_path}")
+    return save_path
 
-def run_montage_generator():
+def run_montage_generator(workers=None, force=False, preview=False, backend="pil", pyramid=False):
     print("="*60)
     print("      咸豐草實驗：覆土出苗 (Cell) 每日大圖生成器 (12H一圖)")
     print("="*60)
@@ -141,32 +166,68 @@ def run_montage_generator():
     dishes = [d for d in os.listdir(INPUT_BASE_DIR) if os.path.isdir(os.path.join(INPUT_BASE_DIR, d))]
     dishes = sorted(dishes)
     
+    # 先列出所有 (dish, cell, 日期, AM/PM) 工作，輸入沒變的略過，其餘交給多行程渲染
+    jobs, targets = [], []
+    cache = montage_engine.BuildCache(PREVIEW_OUTPUT_DIR if preview else OUTPUT_BASE_DIR)
+    code_sig = montage_engine.code_signature(__file__)
     for dish in dishes:
         dish_path = os.path.join(INPUT_BASE_DIR, dish)
-        cells = sorted([c for c in os.listdir(dish_path) if os.path.isdir(os.path.join(dish_path, c))])
+        cells = tile_archive.list_series(dish_path)
         
         print(f"\n[處理] 正在掃描 {dish} ({len(cells)} 個穴孔)...")
         
         for cell in cells:
-            cell_path = os.path.join(dish_path, cell)
-            jpg_files = sorted(glob.glob(os.path.join(cell_path, "*.jpg")))
+            # 同時支援 JPEG 目錄與封存檔，回傳依時間排序的 (timestamp, ref)
+            frames = tile_archive.list_frames(dish_path, cell)
             
-            if not jpg_files:
+            if not frames:
                 continue
             
             # 根據日期分組 (YYYYMMDD)
             daily_groups = {}
-            for img_path in jpg_files:
-                date_str = os.path.basename(img_path).split('_')[0]
+            for timestamp, ref in frames:
+                date_str = timestamp.split('_')[0]
                 if date_str not in daily_groups:
                     daily_groups[date_str] = []
-                daily_groups[date_str].append(img_path)
+                daily_groups[date_str].append((timestamp, ref))
             
-            # 為每個日期生成 兩張大圖 (AM 與 PM)
+            # 為每個日期生成 兩張大圖 (AM 與 PM)；先依上下午分開，下午新增照片不會讓上午的圖重畫
             for date_str, images in sorted(daily_groups.items()):
-                create_half_daily_cell_montage(dish, cell, date_str, "AM", images)
-                create_half_daily_cell_montage(dish, cell, date_str, "PM", images)
+                halves = {
+                    "AM": [(ts, ref) for ts, ref in images if ts[9:11] < "12"],
+                    "PM": [(ts, ref) for ts, ref in images if ts[9:11] >= "12"],
+                }
+                for am_pm, half_images in halves.items():
+                    if not half_images:
+                        continue
+                    jobs.append((dish, cell, date_str, am_pm, half_images, preview, backend))
+                    targets.append((montage_path(dish, cell, date_str, am_pm, preview),
+                                    montage_engine.input_signature(code_sig, [dish, cell, date_str, am_pm, preview],
+                                                                   half_images)))
+
+    montage_engine.run_jobs(create_half_daily_cell_montage, jobs, workers, cache=cache, targets=targets, force=force)
+
+    if pyramid and preview:
+        print("[警告] 預覽模式不產生圖磚金字塔。")
+    elif pyramid:
+        groups = [(f"daily/{dish}/{cell}/{date_str}_{am_pm}", [path])
+                  for (dish, cell, date_str, am_pm, _, _, _), (path, _) in zip(jobs, targets)]
+        tile_pyramid.build_pyramids(groups, PYRAMID_DIR, workers, force)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：覆土出苗 (Cell) 每日大圖生成器")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="渲染使用的行程數 (預設為 CPU 核心數，1 為單行程)")
+    parser.add_argument("--force", action="store_true", help="忽略建置快取，全部重畫")
+    parser.add_argument("--preview", action="store_true",
+                        help=f"產生每格 {PREVIEW_CELL_SIZE}px 的預覽圖 (較快)，輸出到 daily_montages_preview/")
+    parser.add_argument("--backend", choices=montage_engine.BACKENDS, default="pil",
+                        help="排版方式：pil 逐格貼上 (預設) / numpy 整批寫入，輸出相同")
+    parser.add_argument("--pyramid", action="store_true",
+                        help="另外產生可縮放瀏覽的圖磚金字塔與 viewer.html (見 tile_pyramid.py)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    run_montage_generator()
+    args = parse_args()
+    run_montage_generator(args.workers, args.force, args.preview, args.backend, args.pyramid)
     print("\n[系統] 所有任務處理完畢。")
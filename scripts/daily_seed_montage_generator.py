@@ -1,8 +1,15 @@
 import os
-import glob
+import argparse
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
 import math
+import functools
+import numpy as np
+
+import tile_archive
+import frame_catalog
+import montage_engine
+import tile_pyramid
 
 # ==========================================================
 # [ 設定參數 ]
@@ -10,6 +17,8 @@ import math
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INPUT_BASE_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "time_series_crops")
 OUTPUT_BASE_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "daily_montages")
+# --pyramid：圖磚金字塔與瀏覽器 (與生命週期大圖共用)
+PYRAMID_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "pyramids")
 
 # 字型路徑 (Linux 常見路徑)
 FONT_PATHS = [
@@ -18,43 +27,69 @@ FONT_PATHS = [
     "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf"
 ]
 
+@functools.lru_cache(maxsize=None)
 def get_font(size):
     for path in FONT_PATHS:
         if os.path.exists(path):
             return ImageFont.truetype(path, size)
     return ImageFont.load_default()
 
-def create_daily_montage(dish, seed, date, image_list):
+# ==========================================================
+# [ 版面 ]
+# 定義固定網格 (24 小時 / 10 分鐘 = 144 個位置)
+# 採用 18 欄 x 8 列：每橫列代表 3 小時 (18 * 10 = 180 分鐘)
+# ==========================================================
+COLS, ROWS = 18, 8
+SLOT_INTERVAL = 10 # 分鐘
+CELL_W, CELL_H = 64, 64
+PADDING_X, PADDING_Y = 6, 8
+TEXT_HEIGHT = 16
+HEADER_HEIGHT = 80
+MARGIN_X, MARGIN_Y = 30, 30
+BG_COLOR = (15, 15, 15)
+
+def slot_origin(i):
+    """第 i 格影像的左上角座標"""
+    r, c = divmod(i, COLS)
+    return (MARGIN_X + c * (CELL_W + PADDING_X),
+            MARGIN_Y + HEADER_HEIGHT + r * (CELL_H + PADDING_Y + TEXT_HEIGHT))
+
+@functools.lru_cache(maxsize=None)
+def layout_template():
+    """
+    所有大圖共用的底圖：背景與 144 個固定的時間標籤 (HH:MM)。
+    每個行程只畫一次，之後每張大圖從 copy() 開始，只補上標題與影像。
+    """
+    canvas_w = COLS * (CELL_W + PADDING_X) + MARGIN_X * 2
+    canvas_h = ROWS * (CELL_H + PADDING_Y + TEXT_HEIGHT) + MARGIN_Y * 2 + HEADER_HEIGHT
+    canvas = Image.new('RGB', (canvas_w, canvas_h), BG_COLOR)
+    draw = ImageDraw.Draw(canvas)
+    font_cell = get_font(12)
+    for i in range(COLS * ROWS):
+        x, y = slot_origin(i)
+        # 計算此位置代表的時間
+        target_total_min = i * SLOT_INTERVAL
+        formatted_time = f"{target_total_min // 60:02d}:{target_total_min % 60:02d}"
+        draw.text((x + CELL_W // 2 - 14, y + CELL_H + 2), formatted_time, font=font_cell, fill=(80, 80, 80))
+    return canvas
+
+def montage_path(dish, seed, date):
+    return os.path.join(OUTPUT_BASE_DIR, dish, seed, f"{date}_montage.jpg")
+
+def create_daily_montage(dish, seed, date, image_list, backend="pil"):
     """
     為特定的 Dish、Seed 和 日期 建立縮時大圖 (10分鐘一格，18x8 橫式佈局)
+    image_list: [(timestamp, ref)]，ref 為 JPEG 路徑或封存檔位置 (見 tile_archive.py)
+    backend   : "pil" 逐格貼上 / "numpy" 整批寫入 (見 montage_engine.py)，輸出相同
     """
-    # 定義固定網格 (24 小時 / 10 分鐘 = 144 個位置)
-    # 採用 18 欄 x 8 列：每橫列代表 3 小時 (18 * 10 = 180 分鐘)
-    cols = 18
-    rows = 8
-    slot_interval = 10 # 分鐘
-    
-    cell_w, cell_h = 64, 64
-    padding_x, padding_y = 6, 8
-    text_height = 16
-    header_height = 80
-    margin_x, margin_y = 30, 30
-    
-    cw = cell_w + padding_x
-    ch = cell_h + padding_y + text_height
-    
-    canvas_w = cols * cw + margin_x * 2
-    canvas_h = rows * ch + margin_y * 2 + header_height
-    
     # 將影像放入對應的 Time-Slot
-    slots = [None] * (cols * rows)
+    slots = [None] * (COLS * ROWS)
     
-    for img_path in image_list:
-        filename = os.path.basename(img_path)
+    for timestamp, img_path in image_list:
         try:
-            time_part = filename.split('_')[1]
+            time_part = timestamp.split('_')[1]
             total_minutes = int(time_part[0:2]) * 60 + int(time_part[2:4])
-            slot_idx = total_minutes // slot_interval
+            slot_idx = total_minutes // SLOT_INTERVAL
             
             if 0 <= slot_idx < len(slots):
                 if slots[slot_idx] is None:
@@ -62,62 +97,52 @@ def create_daily_montage(dish, seed, date, image_list):
         except:
             continue
 
-    # 建立畫布
-    bg_color = (15, 15, 15)
-    canvas = Image.new('RGB', (canvas_w, canvas_h), bg_color)
+    # 由共用底圖開始 (背景與時間標籤已畫好)
+    canvas = layout_template().copy()
     draw = ImageDraw.Draw(canvas)
     
-    # 讀取字型
-    font_header = get_font(30)
-    font_cell = get_font(12)
-    
     # 繪製標題
     header_text_main = f"Daily Growth Matrix | Date: {date}"
-    header_text_sub = f"Location: {dish} - {seed} | Interval: {slot_interval} min grid"
+    header_text_sub = f"Location: {dish} - {seed} | Interval: {SLOT_INTERVAL} min grid"
     
-    draw.text((margin_x, margin_y), header_text_main, font=font_header, fill=(255, 255, 255))
-    draw.text((margin_x, margin_y + 40), header_text_sub, font=get_font(20), fill=(250, 180, 50))
+    draw.text((MARGIN_X, MARGIN_Y), header_text_main, font=get_font(30), fill=(255, 255, 255))
+    draw.text((MARGIN_X, MARGIN_Y + 40), header_text_sub, font=get_font(20), fill=(250, 180, 50))
     
-    # 按順序繪製 96 個位置
-    for i in range(cols * rows):
-        r = i // cols
-        c = i % cols
-        
-        x = margin_x + c * cw
-        y = margin_y + header_height + r * ch
-        
-        # 計算此位置代表的時間
-        target_total_min = i * slot_interval
-        th = target_total_min // 60
-        tm = target_total_min % 60
-        formatted_time = f"{th:02d}:{tm:02d}"
-        
-        img_path = slots[i]
-        
-        if img_path:
-            try:
-                with Image.open(img_path) as img:
-                    img_resized = img.resize((cell_w, cell_h), Image.Resampling.LANCZOS)
-                    canvas.paste(img_resized, (x, y))
-            except:
-                pass
-        else:
-            # 沒圖的位置畫一個淡灰色框框示意
-            draw.rectangle([x, y, x + cell_w, y + cell_h], outline=(40, 40, 40), width=1)
-            
-        # 繪製時間文字
-        text_x = x + cell_w // 2 - 14
-        text_y = y + cell_h + 2
-        draw.text((text_x, text_y), formatted_time, font=font_cell, fill=(80, 80, 80))
+    # 貼上影像；沒圖的位置畫一個淡灰色框框示意
+    if backend == "numpy":
+        filled = [i for i, ref in enumerate(slots) if ref]
+        empty = [i for i, ref in enumerate(slots) if not ref]
+        arr = np.array(canvas)
+        grid = montage_engine.grid_view(arr, slot_origin(0), ROWS, COLS,
+                                        (CELL_W + PADDING_X, CELL_H + PADDING_Y + TEXT_HEIGHT))
+        montage_engine.paste_tiles(grid, filled, [slots[i] for i in filled], (CELL_W, CELL_H))
+        montage_engine.draw_frames(grid, empty, (CELL_W, CELL_H), (40, 40, 40))
+        canvas = Image.fromarray(arr)
+    else:
+        for i, img_path in enumerate(slots):
+            x, y = slot_origin(i)
+            if img_path:
+                try:
+                    canvas.paste(tile_archive.load_thumbnail(img_path, (CELL_W, CELL_H)), (x, y))
+                except:
+                    pass
+            else:
+                draw.rectangle([x, y, x + CELL_W, y + CELL_H], outline=(40, 40, 40), width=1)
             
     # 儲存結果
-    output_dir = os.path.join(OUTPUT_BASE_DIR, dish, seed)
-    os.makedirs(output_dir, exist_ok=True)
-    save_path = os.path.join(output_dir, f"{date}_montage.jpg")
+    save_path = montage_path(dish, seed, date)
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
     canvas.save(save_path, quality=90)
-    print(f"  > 已生成大圖: {save_path}")
+    return save_path
 
-def run_montage_generator():
+def run_montage_generator(workers=None, force=False, backend="pil", pyramid=False,
+                          dish_names=None, seed_names=None, start=None, end=None):
+    """
+    dish_names / seed_names: 只處理指定的 Dish / 種子 (None 表示全部)
+    start / end            : 只處理這段時間涵蓋的日期 (YYYYMMDD_HHMMSS)。
+                             每日大圖一定是完整的一天，範圍會擴大到起訖日的 00:00:00 ~ 23:59:59，
+                             避免只含半天照片的大圖覆蓋掉完整的大圖
+    """
     print("="*60)
     print("      咸豐草實驗：種子縮時序列每日大圖生成器")
     print("="*60)
@@ -129,35 +154,72 @@ def run_montage_generator():
     # 取得所有 Dish 資料夾 (Dish_A, Dish_B, Dish_C, Dish_D)
     dishes = [d for d in os.listdir(INPUT_BASE_DIR) if os.path.isdir(os.path.join(INPUT_BASE_DIR, d))]
     dishes = sorted(dishes)
+    day_start = f"{start[:8]}_000000" if start else None
+    day_end = f"{end[:8]}_235959" if end else None
     
+    # 先列出所有 (dish, seed, 日期) 工作，輸入沒變的略過，其餘交給多行程渲染
+    jobs, targets = [], []
+    cache = montage_engine.BuildCache(OUTPUT_BASE_DIR)
+    code_sig = montage_engine.code_signature(__file__)
     for dish in dishes:
-        if dish not in ["Dish_A", "Dish_B", "Dish_C", "Dish_D"]:
+        if dish not in (dish_names or ["Dish_A", "Dish_B", "Dish_C", "Dish_D"]):
             continue
             
         dish_path = os.path.join(INPUT_BASE_DIR, dish)
-        seeds = sorted([s for s in os.listdir(dish_path) if os.path.isdir(os.path.join(dish_path, s))])
+        seeds = tile_archive.list_series(dish_path)
+        if seed_names:
+            seeds = [s for s in seeds if s in seed_names]
         
         print(f"\n[處理] 正在掃描 {dish} ({len(seeds)} 個種子)...")
         
         for seed in seeds:
-            seed_path = os.path.join(dish_path, seed)
-            jpg_files = sorted(glob.glob(os.path.join(seed_path, "*.jpg")))
+            # 同時支援 JPEG 目錄與封存檔，回傳依時間排序的 (timestamp, ref)；
+            # 指定範圍時以索引只取出範圍內的照片，只重新分組這幾天
+            frames = tile_archive.list_frames(dish_path, seed, day_start, day_end)
             
-            if not jpg_files:
+            if not frames:
                 continue
             
             # 根據日期分組 (YYYYMMDD)
             daily_groups = {}
-            for img_path in jpg_files:
-                date_str = os.path.basename(img_path).split('_')[0]
+            for timestamp, ref in frames:
+                date_str = timestamp.split('_')[0]
                 if date_str not in daily_groups:
                     daily_groups[date_str] = []
-                daily_groups[date_str].append(img_path)
+                daily_groups[date_str].append((timestamp, ref))
             
             # 為每個日期生成一張大圖
             for date_str, images in sorted(daily_groups.items()):
-                create_daily_montage(dish, seed, date_str, images)
+                jobs.append((dish, seed, date_str, images, backend))
+                targets.append((montage_path(dish, seed, date_str),
+                                montage_engine.input_signature(code_sig, [dish, seed, date_str], images)))
+
+    montage_engine.run_jobs(create_daily_montage, jobs, workers, cache=cache, targets=targets, force=force)
+
+    if pyramid:
+        groups = [(f"daily/{dish}/{seed}/{date_str}", [path])
+                  for (dish, seed, date_str, _, _), (path, _) in zip(jobs, targets)]
+        tile_pyramid.build_pyramids(groups, PYRAMID_DIR, workers, force)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：種子縮時序列每日大圖生成器")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="渲染使用的行程數 (預設為 CPU 核心數，1 為單行程)")
+    parser.add_argument("--force", action="store_true", help="忽略建置快取，全部重畫")
+    parser.add_argument("--backend", choices=montage_engine.BACKENDS, default="pil",
+                        help="排版方式：pil 逐格貼上 (預設) / numpy 整批寫入，輸出相同")
+    parser.add_argument("--pyramid", action="store_true",
+                        help="另外產生可縮放瀏覽的圖磚金字塔與 viewer.html (見 tile_pyramid.py)")
+    parser.add_argument("--dish", nargs="+", default=None, help="只處理指定的 Dish，例如 Dish_B (預設 Dish_A~D)")
+    parser.add_argument("--seed", nargs="+", default=None, help="只處理指定的種子，例如 seed_07 (預設全部)")
+    parser.add_argument("--start", type=frame_catalog.start_arg, default=None,
+                        help="只處理此時間之後的日期，例如 20260224 或 \"2026-02-24 08:00\" (以整天為單位)")
+    parser.add_argument("--end", type=frame_catalog.end_arg, default=None,
+                        help="只處理此時間之前的日期 (含當天)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    run_montage_generator()
+    args = parse_args()
+    run_montage_generator(args.workers, args.force, args.backend, args.pyramid,
+                          args.dish, args.seed, args.start, args.end)
     print("\n[系統] 所有任務處理完畢。")
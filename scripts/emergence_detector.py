@@ -0,0 +1,205 @@
+import cv2
+import numpy as np
+import pandas as pd
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from numpy.lib.stride_tricks import sliding_window_view
+
+import tile_archive
+import crop_engine
+from germination_detector import read_sheet, write_sheet, merge_results, ts_to_date_time
+
+# ==========================================================
+# [ 覆土出苗自動判定 (Experiment 2: Soil Tray) ]
+# 讀取 time_series_crops/<dish>/cell_XX 序列，以過綠指數 (ExG = 2g - r - b，
+# r/g/b 為色度座標) 整批算出綠色像素遮罩，再數出面積夠大的綠色區塊 = 出土幼苗數。
+# 幼苗數需連續 persist 張維持才算數，第 k 株出苗時間寫入 soil_emergence 分頁的 seed_k，
+# 每穴孔的幼苗數時間序列另存為 analysis_results/emergence_counts_<dish>.csv。
+# 各穴孔序列以多行程平行處理。
+# ==========================================================
+CONFIG = {
+    "exg_threshold": 0.10,  # ExG 門檻 (色度座標，0~2)
+    "min_brightness": 40,   # 太暗的像素不列入 (夜間雜訊)
+    "min_blob_area": 12,    # 幼苗最小面積 (像素)
+    "persist": 3,           # 幼苗數需連續幾張維持
+    "seeds_per_cell": 4,    # 每穴播種數
+    "chunk": 256,           # 每批處理幾張
+}
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+
+# ==========================================================
+# [ 特徵計算 ]
+# ==========================================================
+def green_masks(stack, params):
+    """(n, h, w, 3) BGR uint8 -> 綠色像素遮罩 (n, h, w) bool，整批向量化"""
+    bgr = stack.astype(np.float32)
+    total = bgr.sum(axis=3) + 1e-6
+    b, g, r = bgr[..., 0] / total, bgr[..., 1] / total, bgr[..., 2] / total
+    exg = 2 * g - r - b
+    return (exg > params["exg_threshold"]) & (total / 3 > params["min_brightness"])
+
+def count_blobs(masks, min_area):
+    """每張遮罩中面積 >= min_area 的連通區塊數；完全沒有綠色像素的影像直接記 0"""
+    counts = np.zeros(len(masks), dtype=np.int32)
+    has_green = masks.reshape(len(masks), -1).sum(axis=1) >= min_area
+    for i in np.flatnonzero(has_green):
+        n, _, stats, _ = cv2.connectedComponentsWithStats(masks[i].astype(np.uint8), connectivity=8)
+        counts[i] = int((stats[1:, cv2.CC_STAT_AREA] >= min_area).sum())
+    return counts
+
+def series_counts(refs, params):
+    """分批讀取一整段序列，回傳 (可用的索引, 每張幼苗數, 每張綠色面積)"""
+    tile_shape = (None, None)
+    idx_all, count_all, area_all = [], [], []
+    for start in range(0, len(refs), params["chunk"]):
+        stack, ok = tile_archive.read_stack(refs[start:start + params["chunk"]], *tile_shape)
+        if not ok:
+            continue
+        tile_shape = stack.shape[1:3]
+        masks = green_masks(stack, params)
+        idx_all.append(np.array(ok) + start)
+        count_all.append(count_blobs(masks, params["min_blob_area"]))
+        area_all.append(masks.sum(axis=(1, 2)))
+    if not idx_all:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+    return np.concatenate(idx_all), np.concatenate(count_all), np.concatenate(area_all)
+
+def emergence_indices(counts, params):
+    """
+    回傳第 1..seeds_per_cell 株出苗的影像索引 (沒有出苗為 None)。
+    先取 persist 張的滑動最小值，排除一閃即逝的雜訊，再找第一次達到 k 株的位置。
+    """
+    persist = params["persist"]
+    if len(counts) < persist:
+        return [None] * params["seeds_per_cell"]
+    stable = sliding_window_view(counts, persist).min(axis=1)
+    out = []
+    for k in range(1, params["seeds_per_cell"] + 1):
+        hits = np.flatnonzero(stable >= k)
+        out.append(int(hits[0]) if len(hits) else None)
+    return out
+
+def process_cell(task):
+    """工作行程：處理單一穴孔序列，回傳 (cell 名稱, [(timestamp, 幼苗數, 綠色面積)], [第 k 株出苗時間])"""
+    dish_dir, cell_name, params = task
+    cv2.setNumThreads(1)
+    frames = tile_archive.list_frames(dish_dir, cell_name)
+    if not frames:
+        return cell_name, [], [None] * params["seeds_per_cell"]
+    idx, counts, areas = series_counts([ref for _, ref in frames], params)
+    timeline = [(frames[i][0], int(c), int(a)) for i, c, a in zip(idx, counts, areas)]
+    events = [timeline[e][0] if e is not None else None for e in emergence_indices(counts, params)]
+    return cell_name, timeline, events
+
+# ==========================================================
+# [ 主流程 ]
+# ==========================================================
+def save_counts_csv(output_dir, dish_label, timelines):
+    """每穴孔幼苗數時間序列：timestamp, cell_01, cell_02, ..."""
+    os.makedirs(output_dir, exist_ok=True)
+    series = {cell: pd.Series({ts: c for ts, c, _ in tl}) for cell, tl in timelines.items() if tl}
+    if not series:
+        return None
+    df = pd.DataFrame(series).sort_index()
+    df.index.name = "timestamp"
+    path = os.path.join(output_dir, f"emergence_counts_{dish_label}.csv")
+    df.to_csv(path)
+    return path
+
+def run_emergence_detector(crops_dir=None, dish_labels=None, sheet="soil_emergence", overwrite=False,
+                           dry_run=False, workers=None):
+    exp_dir = os.path.join(PROJECT_ROOT, "temp_data", "exp2_soil_tray")
+    crops_dir = crops_dir or os.path.join(exp_dir, "time_series_crops")
+    xlsx_path = os.path.join(PROJECT_ROOT, "temp_data", "data.xlsx")
+    if not os.path.isdir(crops_dir):
+        print(f"[錯誤] 找不到目錄: {crops_dir}")
+        return
+
+    dish_labels = dish_labels or sorted(d for d in os.listdir(crops_dir)
+                                        if os.path.isdir(os.path.join(crops_dir, d)) and not d.startswith("_"))
+    tasks = []
+    for dish_label in dish_labels:
+        dish_dir = os.path.join(crops_dir, dish_label)
+        for cell_name in tile_archive.list_series(dish_dir):
+            if cell_name.startswith("cell_"):
+                tasks.append((dish_label, (dish_dir, cell_name, CONFIG)))
+    if not tasks:
+        print("[錯誤] 沒有找到任何穴孔序列。")
+        return
+
+    # 先讀既有分頁 (檔案損壞時在啟動行程池之前就失敗)；同一穴孔的處理方式與覆土深度，新列沿用
+    existing = read_sheet(xlsx_path, sheet)
+    cell_info = {}
+    if existing is not None:
+        for _, row in existing.iterrows():
+            cell_info.setdefault((row["dish"], row["cell"]), (row.get("treatment", ""), row.get("soil_depth", "")))
+
+    workers = workers or crop_engine.default_workers()
+    print(f"[系統] 共 {len(tasks)} 個穴孔序列，使用 {workers} 個行程。")
+    if workers <= 1:
+        outputs = map(process_cell, [t for _, t in tasks])
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        outputs = executor.map(process_cell, [t for _, t in tasks])
+
+    results = []
+    timelines = {}
+    try:
+        for (dish_label, _), (cell_name, timeline, events) in zip(tasks, outputs):
+            timelines.setdefault(dish_label, {})[cell_name] = timeline
+            n_emerged = sum(1 for e in events if e is not None)
+            print(f"  > {dish_label} {cell_name}: {len(timeline)} 張 | 出苗 {n_emerged} 株 | 第一株: {events[0] or '-'}")
+            if not timeline:
+                continue
+            treatment, soil_depth = cell_info.get((dish_label, cell_name), ("", ""))
+            start_date, start_time = ts_to_date_time(timeline[0][0])
+            for k, event_ts in enumerate(events, start=1):
+                germ_date, germ_time = ts_to_date_time(event_ts) if event_ts else (None, None)
+                results.append({
+                    "dish": dish_label,
+                    "cell": cell_name,
+                    "seed": f"seed_{k}",
+                    "treatment": treatment,
+                    "soil_depth": soil_depth,
+                    "start_date": start_date,
+                    "start_time": start_time,
+                    "germination_date": germ_date,
+                    "germination_time": germ_time,
+                })
+    finally:
+        if workers > 1:
+            executor.shutdown(cancel_futures=True)
+
+    analysis_dir = os.path.join(exp_dir, "analysis_results")
+    for dish_label, tl in timelines.items():
+        path = save_counts_csv(analysis_dir, dish_label, tl)
+        if path:
+            print(f"[系統] 幼苗數時間序列: {path}")
+
+    n_emerged = sum(1 for r in results if r["germination_date"] is not None)
+    print(f"\n[系統] 共 {len(results)} 個播種位置，判定出苗 {n_emerged} 株")
+    if dry_run:
+        print("[系統] --dry-run：不寫入 data.xlsx")
+        return
+
+    merged, filled = merge_results(existing, results, ["dish", "cell", "seed"], overwrite)
+    write_sheet(xlsx_path, sheet, merged)
+    print(f"[成功] 已寫入 {xlsx_path} (分頁: {sheet})，更新 {filled} 筆出苗時間")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：覆土出苗自動判定")
+    parser.add_argument("crops_dir", nargs="?", default=None,
+                        help="time_series_crops 目錄 (預設: temp_data/exp2_soil_tray/time_series_crops)")
+    parser.add_argument("--dish", nargs="+", default=None, help="只處理指定的 Dish，例如 --dish Dish_A Dish_B")
+    parser.add_argument("--sheet", default="soil_emergence", help="寫入 data.xlsx 的分頁名稱 (預設 soil_emergence)")
+    parser.add_argument("--overwrite", action="store_true", help="覆蓋已填寫 (人工判定) 的出苗時間")
+    parser.add_argument("--dry-run", action="store_true", help="只顯示結果，不寫入 data.xlsx")
+    parser.add_argument("--workers", type=int, default=None, help="行程數 (預設為 CPU 核心數，1 為單行程)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_emergence_detector(args.crops_dir, args.dish, args.sheet, args.overwrite, args.dry_run, args.workers)
@@ -0,0 +1,294 @@
+import os
+import re
+import sys
+import sqlite3
+import argparse
+from datetime import datetime
+
+# ==========================================================
+# [ 影像型錄 (Frame Catalog) ]
+# 每個實驗目錄 (例如 temp_data/exp1_dish/) 一個 SQLite 型錄 frame_catalog.sqlite，記錄：
+#   整盤影像 extracted_dishes/{YYYYMMDD_HHMMSS}_{Dish}.jpg          -> (dish, series='', ts)
+#   切割圖   time_series_crops/{Dish}/{seed_XX|cell_XX}/{ts}.jpg     -> (dish, series, ts)
+# 以 (dish, series, ts) 為主鍵 (B-tree)，查詢某 Dish / 某序列 / 某時間範圍不需要掃描目錄。
+#
+# 寫入端 (擷取、切割) 透過 DirectoryRecorder 把新檔案增量記入型錄。
+# 型錄另外記錄每個目錄同步時的修改時間 (mtime)：查詢前只 stat 一次目錄，
+# 與紀錄相同就直接查表；不同 (例如從別台電腦複製進來、或舊資料) 才重新掃描該目錄一次。
+# 封存檔 (_tiles/) 有自己的時間索引，不在型錄內 (見 tile_archive.py)。
+# ==========================================================
+CATALOG_NAME = "frame_catalog.sqlite"
+IMAGE_DIRNAME = "extracted_dishes"
+CROPS_DIRNAME = "time_series_crops"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frames (
+    dish   TEXT NOT NULL,
+    series TEXT NOT NULL,   -- seed_XX / cell_XX；整盤影像為 ''
+    ts     TEXT NOT NULL,   -- YYYYMMDD_HHMMSS
+    dir    TEXT NOT NULL,   -- 所在目錄 (相對實驗目錄)
+    name   TEXT NOT NULL,   -- 檔名
+    PRIMARY KEY (dish, series, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS frames_dir ON frames (dir);
+CREATE TABLE IF NOT EXISTS dirs (
+    dir      TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+def parse_dish_image_name(name):
+    """YYYYMMDD_HHMMSS_DishLabel.jpg -> (dish_label, timestamp)；格式不符回傳 None"""
+    stem, ext = os.path.splitext(name)
+    parts = stem.split('_')
+    if ext.lower() != ".jpg" or len(parts) < 3 or len(parts[0]) != 8 or len(parts[1]) != 6:
+        return None
+    return "_".join(parts[2:]), f"{parts[0]}_{parts[1]}"
+
+def time_bound(text, end=False):
+    """
+    將時間範圍的端點轉成 YYYYMMDD_HHMMSS，可接受:
+      20260224_080000 / 20260224_0800 / 20260224 / 2026-02-24 08:00[:00] / 2026-02-24T08:00
+    只給到日期或分鐘時，起點補 0、終點補到該日 / 該分鐘的最後一秒 (範圍含端點)。
+    """
+    digits = re.sub(r"[^0-9]", "", text or "")
+    if len(digits) not in (8, 10, 12, 14):
+        raise ValueError(f"無法辨識的時間: {text} (格式: YYYYMMDD_HHMMSS 或 YYYY-MM-DD HH:MM)")
+    digits += ("235959" if end else "000000")[len(digits) - 8:]
+    try:
+        datetime.strptime(digits, "%Y%m%d%H%M%S")
+    except ValueError:
+        raise ValueError(f"不存在的時間: {text}")
+    return f"{digits[:8]}_{digits[8:]}"
+
+def start_arg(text):
+    """argparse type：時間範圍起點"""
+    try:
+        return time_bound(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def end_arg(text):
+    """argparse type：時間範圍終點 (含)"""
+    try:
+        return time_bound(text, end=True)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def _dir_mtime(directory):
+    try:
+        return os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+class FrameCatalog:
+    def __init__(self, exp_dir):
+        self.exp_dir = os.path.abspath(exp_dir)
+        self.path = os.path.join(self.exp_dir, CATALOG_NAME)
+        os.makedirs(self.exp_dir, exist_ok=True)
+        # 擷取程式與產生器可能同時開啟同一個型錄：WAL 模式讓讀取不必等待寫入
+        self.conn = sqlite3.connect(self.path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _rel(self, directory):
+        return os.path.relpath(os.path.abspath(directory), self.exp_dir)
+
+    # ------------------------------------------------------
+    # 目錄同步
+    # ------------------------------------------------------
+    def is_synced(self, directory):
+        """型錄中的紀錄是否與目錄現況一致 (目錄不存在且沒有紀錄也算一致)"""
+        row = self.conn.execute("SELECT mtime_ns FROM dirs WHERE dir = ?", (self._rel(directory),)).fetchone()
+        mtime = _dir_mtime(directory)
+        if row is None:
+            return mtime is None
+        return row[0] == mtime
+
+    def sync(self, directory, dish=None, series=None):
+        """
+        重新掃描一個目錄並取代型錄中該目錄的紀錄。
+        dish/series 皆指定時為切割圖目錄 (檔名即時間)，否則為整盤影像目錄 (由檔名解析 Dish)。
+        """
+        rel = self._rel(directory)
+        mtime = _dir_mtime(directory)  # 先取時間再掃描：掃描中新增的檔案會讓下次查詢再掃一次
+        rows = []
+        if mtime is not None:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if not entry.is_file():
+                        continue
+                    if series is not None:
+                        stem, ext = os.path.splitext(entry.name)
+                        if ext.lower() == ".jpg":
+                            rows.append((dish, series, stem, rel, entry.name))
+                    else:
+                        parsed = parse_dish_image_name(entry.name)
+                        if parsed:
+                            rows.append((parsed[0], "", parsed[1], rel, entry.name))
+        with self.conn:
+            self.conn.execute("DELETE FROM frames WHERE dir = ?", (rel,))
+            self.conn.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?)", rows)
+            if mtime is None:
+                self.conn.execute("DELETE FROM dirs WHERE dir = ?", (rel,))
+            else:
+                self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (rel, mtime))
+        return len(rows)
+
+    def ensure_synced(self, directory, dish=None, series=None):
+        if not self.is_synced(directory):
+            self.sync(directory, dish, series)
+
+    def record(self, directory, rows, synced):
+        """
+        寫入端記錄新檔案 rows = [(dish, series, ts, 檔名)]。
+        synced: 寫入前該目錄是否已與型錄一致；是的話一併更新目錄的修改時間，下次查詢不必重新掃描
+        """
+        rel = self._rel(directory)
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?)",
+                                  [(dish, series, ts, rel, name) for dish, series, ts, name in rows])
+            mtime = _dir_mtime(directory)
+            if synced and mtime is not None:
+                self.conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (rel, mtime))
+
+    # ------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------
+    def dish_images(self, image_dir, dish, start=None, end=None):
+        """某 Dish 的整盤影像 [(timestamp, 路徑)]，依時間排序；start/end 為含端點的時間範圍"""
+        self.ensure_synced(image_dir)
+        return self._query(image_dir, dish, "", start, end)
+
+    def count_dish_images(self, image_dir, dish):
+        self.ensure_synced(image_dir)
+        return self.conn.execute("SELECT COUNT(*) FROM frames WHERE dish = ? AND series = ''", (dish,)).fetchone()[0]
+
+    def series_images(self, dish_dir, series, start=None, end=None):
+        """某種子 / 穴孔的切割圖 [(timestamp, 路徑)]，依時間排序"""
+        series_dir = os.path.join(dish_dir, series)
+        dish = os.path.basename(os.path.normpath(dish_dir))
+        self.ensure_synced(series_dir, dish, series)
+        return self._query(series_dir, dish, series, start, end)
+
+    def _query(self, directory, dish, series, start, end):
+        # 只用主鍵 (dish, series, ts) 查詢：B-tree 直接定位到範圍起點並依序讀出，不需要另外排序
+        sql = "SELECT ts, name FROM frames WHERE dish = ? AND series = ?"
+        args = [dish, series]
+        if start:
+            sql += " AND ts >= ?"
+            args.append(start)
+        if end:
+            sql += " AND ts <= ?"
+            args.append(end)
+        sql += " ORDER BY ts"
+        return [(ts, os.path.join(directory, name)) for ts, name in self.conn.execute(sql, args)]
+
+class DirectoryRecorder:
+    """
+    一個輸出目錄的寫入端：寫檔前先確認目錄與型錄一致，檔案確定寫完後 (commit) 再一併記入。
+    commit 時只記錄確實存在的檔案 (背景存檔失敗的不會被記入)。
+    """
+    def __init__(self, catalog, directory, dish=None, series=None):
+        self.catalog = catalog
+        self.directory = directory
+        self.dish = dish
+        self.series = series
+        self.synced = catalog.is_synced(directory)
+        self.pending = []
+
+    def add(self, timestamp, name, dish=None):
+        self.pending.append((dish or self.dish, self.series or "", timestamp, name))
+
+    def commit(self):
+        if not self.pending:
+            return
+        rows = [r for r in self.pending if os.path.exists(os.path.join(self.directory, r[3]))]
+        self.catalog.record(self.directory, rows, self.synced)
+        self.pending = []
+
+# ==========================================================
+# [ 依資料目錄取得型錄 ]
+# 依專案的目錄慣例：實驗目錄/extracted_dishes (整盤影像)、實驗目錄/time_series_crops/<Dish> (切割圖)。
+# 同一行程內每個實驗目錄只開一個連線。
+# ==========================================================
+_CATALOGS = {}
+
+def open_catalog(exp_dir):
+    exp_dir = os.path.abspath(exp_dir)
+    catalog = _CATALOGS.get(exp_dir)
+    if catalog is None:
+        catalog = FrameCatalog(exp_dir)
+        _CATALOGS[exp_dir] = catalog
+    return catalog
+
+def for_image_dir(image_dir):
+    """整盤影像目錄 (extracted_dishes) 所屬實驗的型錄"""
+    return open_catalog(os.path.dirname(os.path.abspath(image_dir)))
+
+def for_dish_dir(dish_dir):
+    """切割圖 Dish 目錄 (time_series_crops/<Dish>) 所屬實驗的型錄"""
+    return open_catalog(os.path.dirname(os.path.dirname(os.path.abspath(dish_dir))))
+
+# ==========================================================
+# [ 命令列：建立 / 檢查型錄 ]
+# python3 scripts/frame_catalog.py [實驗目錄 ...] [--rebuild]
+# ==========================================================
+def sync_experiment(exp_dir, rebuild=False):
+    if rebuild:
+        for suffix in ("", "-wal", "-shm"):
+            path = os.path.join(exp_dir, CATALOG_NAME + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+    catalog = open_catalog(exp_dir)
+    image_dir = os.path.join(exp_dir, IMAGE_DIRNAME)
+    rescanned = 0
+    if not catalog.is_synced(image_dir):
+        catalog.sync(image_dir)
+        rescanned += 1
+    crops_dir = os.path.join(exp_dir, CROPS_DIRNAME)
+    if os.path.isdir(crops_dir):
+        for dish in sorted(os.listdir(crops_dir)):
+            dish_dir = os.path.join(crops_dir, dish)
+            if dish.startswith("_") or not os.path.isdir(dish_dir):
+                continue
+            for series in sorted(os.listdir(dish_dir)):
+                series_dir = os.path.join(dish_dir, series)
+                if series.startswith("_") or not os.path.isdir(series_dir):
+                    continue
+                if not catalog.is_synced(series_dir):
+                    catalog.sync(series_dir, dish, series)
+                    rescanned += 1
+
+    print(f"\n[系統] {catalog.path} (重新掃描 {rescanned} 個目錄)")
+    rows = catalog.conn.execute(
+        "SELECT dish, series = '', COUNT(DISTINCT series), COUNT(*), MIN(ts), MAX(ts) "
+        "FROM frames GROUP BY dish, series = '' ORDER BY dish, series = '' DESC").fetchall()
+    for dish, is_dish, n_series, n, first, last in rows:
+        kind = "整盤影像" if is_dish else f"切割圖 ({n_series} 個序列)"
+        print(f"  > {dish} {kind}: {n} 張 | {first} ~ {last}")
+
+def run_catalog_tool():
+    parser = argparse.ArgumentParser(description="建立 / 更新影像型錄 (frame_catalog.sqlite) 並列出內容")
+    parser.add_argument("exp_dirs", nargs="*",
+                        help="實驗目錄 (預設: temp_data 底下所有含 extracted_dishes 或 time_series_crops 的目錄)")
+    parser.add_argument("--rebuild", action="store_true", help="刪除既有型錄後重新掃描")
+    args = parser.parse_args()
+
+    exp_dirs = args.exp_dirs
+    if not exp_dirs:
+        temp_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "temp_data")
+        exp_dirs = [os.path.join(temp_dir, d) for d in sorted(os.listdir(temp_dir))
+                    if os.path.isdir(os.path.join(temp_dir, d, IMAGE_DIRNAME))
+                    or os.path.isdir(os.path.join(temp_dir, d, CROPS_DIRNAME))] if os.path.isdir(temp_dir) else []
+    if not exp_dirs:
+        print("[錯誤] 找不到任何實驗目錄")
+        sys.exit(1)
+    for exp_dir in exp_dirs:
+        sync_experiment(exp_dir, args.rebuild)
+
+if __name__ == "__main__":
+    run_catalog_tool()
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+import os
+import argparse
+
+import tile_archive
+
+# ==========================================================
+# [ 發芽自動判定 ]
+# 讀取 time_series_crops/<dish>/seed_XX 序列 (JPEG 或封存檔皆可)，
+# 以 NumPy 整批計算每張影像的特徵：
+#   area       : 前景 (與紙巾背景亮度差 > fg_delta) 像素數
+#   elongation : 前景二階矩長短軸比 (胚根伸出時明顯變長)
+#   change     : 與基準影像 (前幾張的中位數) 差異 > diff_delta 的像素比例
+# 連續 persist 張同時滿足「change 夠大」且「面積變大或變長」即判定發芽，
+# 發芽時間取該段的第一張，寫入 temp_data/data.xlsx 的 germination 分頁。
+# ==========================================================
+CONFIG = {
+    "fg_delta": 30,         # 前景門檻：與背景中位數的灰階差
+    "diff_delta": 25,       # 變化門檻：與基準影像的灰階差
+    "baseline_frames": 5,   # 取前幾張作為基準
+    "change_min": 0.01,     # 變化像素比例下限 (64x64 磁磚約 40 像素)
+    "area_ratio": 1.25,     # 面積成長倍數
+    "elong_delta": 0.5,     # 長短軸比增加量
+    "persist": 3,           # 需連續幾張成立 (排除單張雜訊 / 光線閃爍)
+    "chunk": 256,           # 每批處理幾張，控制記憶體用量
+}
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+MAP_DIR = os.path.join(SCRIPT_DIR, "1_setSeedsPosition", "temp_data", "layouts_bw")
+
+# ==========================================================
+# [ 特徵計算 (向量化) ]
+# ==========================================================
+def normalized_gray(stack):
+    """(n, h, w, 3) uint8 -> 扣除每張背景亮度後的灰階 (n, h, w) float32，抵銷日夜光線變化"""
+    gray = stack.astype(np.float32).mean(axis=3)
+    n = gray.shape[0]
+    border = np.concatenate([gray[:, :2, :].reshape(n, -1), gray[:, -2:, :].reshape(n, -1),
+                             gray[:, :, :2].reshape(n, -1), gray[:, :, -2:].reshape(n, -1)], axis=1)
+    return gray - np.median(border, axis=1)[:, None, None]
+
+def shape_features(mask):
+    """前景遮罩 (n, h, w) -> (面積, 長短軸比)，以二階中心矩一次算完整批"""
+    n, h, w = mask.shape
+    m = mask.astype(np.float32)
+    area = m.sum(axis=(1, 2))
+    safe = np.maximum(area, 1.0)
+    ys = np.arange(h, dtype=np.float32)
+    xs = np.arange(w, dtype=np.float32)
+    row_sum = m.sum(axis=2)   # (n, h)
+    col_sum = m.sum(axis=1)   # (n, w)
+    mx = col_sum @ xs / safe
+    my = row_sum @ ys / safe
+    sxx = col_sum @ (xs * xs) / safe - mx * mx
+    syy = row_sum @ (ys * ys) / safe - my * my
+    sxy = np.einsum('nhw,h,w->n', m, ys, xs) / safe - mx * my
+    half_tr = (sxx + syy) / 2
+    disc = np.sqrt(np.maximum(half_tr * half_tr - (sxx * syy - sxy * sxy), 0))
+    l1 = half_tr + disc
+    l2 = np.maximum(half_tr - disc, 1e-3)
+    elongation = np.where(area > 0, np.sqrt(np.maximum(l1, 0) / l2), 1.0)
+    return area, elongation
+
+def series_features(refs, params):
+    """分批讀取並計算一整段序列的特徵，回傳 (可用的索引, area, elongation, change)"""
+    baseline = None
+    tile_shape = (None, None)
+    idx_all, area_all, elong_all, change_all = [], [], [], []
+    for start in range(0, len(refs), params["chunk"]):
+        stack, ok = tile_archive.read_stack(refs[start:start + params["chunk"]], *tile_shape)
+        if not ok:
+            continue
+        tile_shape = stack.shape[1:3]
+        norm = normalized_gray(stack)
+        if baseline is None:
+            baseline = np.median(norm[:params["baseline_frames"]], axis=0)
+        area, elong = shape_features(np.abs(norm) > params["fg_delta"])
+        change = (np.abs(norm - baseline) > params["diff_delta"]).mean(axis=(1, 2))
+        idx_all.append(np.array(ok) + start)
+        area_all.append(area)
+        elong_all.append(elong)
+        change_all.append(change)
+    if not idx_all:
+        return np.zeros(0, dtype=int), np.zeros(0), np.zeros(0), np.zeros(0)
+    return (np.concatenate(idx_all), np.concatenate(area_all),
+            np.concatenate(elong_all), np.concatenate(change_all))
+
+def detect_event(area, elong, change, params):
+    """回傳發芽的影像索引 (特徵陣列中的位置)，未發芽回傳 None"""
+    k = params["baseline_frames"]
+    persist = params["persist"]
+    if len(area) < k + persist:
+        return None
+    base_area = max(np.median(area[:k]), 1.0)
+    base_elong = np.median(elong[:k])
+    cond = (change >= params["change_min"]) & (
+        (area >= base_area * params["area_ratio"]) | (elong >= base_elong + params["elong_delta"]))
+    cond[:k] = False
+    runs = np.convolve(cond.astype(np.int32), np.ones(persist, dtype=np.int32), mode='valid')
+    hits = np.flatnonzero(runs == persist)
+    return int(hits[0]) if len(hits) else None
+
+# ==========================================================
+# [ data.xlsx 讀寫 ]
+# ==========================================================
+def ts_to_date_time(timestamp):
+    """YYYYMMDD_HHMMSS -> (MMDD, HHMM) 數值，與 data.xlsx 既有欄位格式相同"""
+    return int(timestamp[4:8]), int(timestamp[9:13])
+
+def load_treatment_map(dish_label):
+    """讀取 map_dish_X.csv，回傳 {種子編號: Treated/Untreated}"""
+    path = os.path.join(MAP_DIR, f"map_dish_{dish_label.split('_')[-1]}.csv")
+    if not os.path.exists(path):
+        return {}
+    df = pd.read_csv(path)
+    return dict(zip(df["Seed_ID"].astype(int), df["Treatment"]))
+
+def read_sheet(xlsx_path, sheet):
+    if not os.path.exists(xlsx_path):
+        return None
+    try:
+        return pd.read_excel(xlsx_path, sheet_name=sheet)
+    except ValueError:
+        return None
+
+def write_sheet(xlsx_path, sheet, df):
+    """只替換指定分頁，保留 data.xlsx 內其他分頁 (與 generate_soil_mock_data 相同寫法)"""
+    if not os.path.exists(xlsx_path):
+        os.makedirs(os.path.dirname(xlsx_path), exist_ok=True)
+        with pd.ExcelWriter(xlsx_path) as writer:
+            df.to_excel(writer, sheet_name=sheet, index=False)
+    else:
+        with pd.ExcelWriter(xlsx_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+            df.to_excel(writer, sheet_name=sheet, index=False)
+
+def merge_results(existing, results, key_cols, overwrite=False):
+    """
+    將偵測結果併入既有分頁 (依 key_cols 對應)：
+    既有列保留 treatment 等人工欄位；germination 欄位預設只填空白處，overwrite=True 才覆蓋。
+    """
+    new_df = pd.DataFrame(results)
+    if existing is None or existing.empty:
+        return new_df, len(new_df)
+
+    merged = existing.copy()
+    key_of = lambda row: tuple(row[c] for c in key_cols)
+    pos = {key_of(row): i for i, row in merged.iterrows()}
+    filled = 0
+    extra = []
+    for rec in results:
+        i = pos.get(tuple(rec[c] for c in key_cols))
+        if i is None:
+            extra.append(rec)
+            continue
+        if pd.isna(merged.at[i, "start_date"]):
+            merged.at[i, "start_date"] = rec["start_date"]
+            merged.at[i, "start_time"] = rec["start_time"]
+        if rec["germination_date"] is None:
+            continue
+        if overwrite or pd.isna(merged.at[i, "germination_date"]):
+            merged.at[i, "germination_date"] = rec["germination_date"]
+            merged.at[i, "germination_time"] = rec["germination_time"]
+            filled += 1
+    if extra:
+        merged = pd.concat([merged, pd.DataFrame(extra)], ignore_index=True)
+        filled += sum(1 for rec in extra if rec["germination_date"] is not None)
+    return merged, filled
+
+# ==========================================================
+# [ 主流程 ]
+# ==========================================================
+def detect_dish(dish_dir, params):
+    """回傳該 Dish 每顆種子的 (seed 名稱, 第一張時間, 發芽時間或 None)"""
+    out = []
+    for series_name in tile_archive.list_series(dish_dir):
+        if not series_name.startswith("seed_"):
+            continue
+        frames = tile_archive.list_frames(dish_dir, series_name)
+        if not frames:
+            continue
+        refs = [ref for _, ref in frames]
+        idx, area, elong, change = series_features(refs, params)
+        hit = detect_event(area, elong, change, params)
+        germ_ts = frames[idx[hit]][0] if hit is not None else None
+        out.append((series_name, frames[0][0], germ_ts))
+        print(f"  > {series_name}: {len(idx)} 張 | 發芽: {germ_ts or '-'}")
+    return out
+
+def run_germination_detector(crops_dir=None, dish_labels=None, sheet="germination", overwrite=False, dry_run=False):
+    crops_dir = crops_dir or os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "time_series_crops")
+    xlsx_path = os.path.join(PROJECT_ROOT, "temp_data", "data.xlsx")
+    if not os.path.isdir(crops_dir):
+        print(f"[錯誤] 找不到目錄: {crops_dir}")
+        return
+
+    dish_labels = dish_labels or sorted(d for d in os.listdir(crops_dir)
+                                        if os.path.isdir(os.path.join(crops_dir, d)) and not d.startswith("_"))
+    existing = read_sheet(xlsx_path, sheet)
+    results = []
+    for dish_label in dish_labels:
+        print(f"\n[處理] {dish_label}")
+        treatments = load_treatment_map(dish_label)
+        for series_name, first_ts, germ_ts in detect_dish(os.path.join(crops_dir, dish_label), CONFIG):
+            seed_no = int(series_name.split("_")[1])
+            start_date, start_time = ts_to_date_time(first_ts)
+            germ_date, germ_time = ts_to_date_time(germ_ts) if germ_ts else (None, None)
+            results.append({
+                "dish": dish_label,
+                "seed_id": f"{dish_label}_{seed_no:02d}",
+                "treatment": treatments.get(seed_no, ""),
+                "start_date": start_date,
+                "start_time": start_time,
+                "germination_date": germ_date,
+                "germination_time": germ_time,
+            })
+
+    if not results:
+        print("[錯誤] 沒有找到任何種子序列。")
+        return
+    n_germ = sum(1 for r in results if r["germination_date"] is not None)
+    print(f"\n[系統] 共 {len(results)} 顆種子，判定發芽 {n_germ} 顆")
+    if dry_run:
+        print("[系統] --dry-run：不寫入 data.xlsx")
+        return
+
+    merged, filled = merge_results(existing, results, ["dish", "seed_id"], overwrite)
+    write_sheet(xlsx_path, sheet, merged)
+    print(f"[成功] 已寫入 {xlsx_path} (分頁: {sheet})，更新 {filled} 筆發芽時間")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：種子發芽自動判定")
+    parser.add_argument("crops_dir", nargs="?", default=None,
+                        help="time_series_crops 目錄 (預設: temp_data/exp1_dish/time_series_crops)")
+    parser.add_argument("--dish", nargs="+", default=None, help="只處理指定的 Dish，例如 --dish Dish_A Dish_B")
+    parser.add_argument("--sheet", default="germination", help="寫入 data.xlsx 的分頁名稱 (預設 germination)")
+    parser.add_argument("--overwrite", action="store_true", help="覆蓋已填寫 (人工判定) 的發芽時間")
+    parser.add_argument("--dry-run", action="store_true", help="只顯示結果，不寫入 data.xlsx")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_germination_detector(args.crops_dir, args.dish, args.sheet, args.overwrite, args.dry_run)
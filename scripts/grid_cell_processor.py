@@ -4,6 +4,10 @@ import os
 import glob
 import json
 import sys
+import argparse
+
+import crop_engine
+import frame_catalog
 
 # ==========================================================
 # [ 預設參數設定 ]
@@ -44,19 +48,66 @@ def save_config(dish_label, current_params, project_root):
         json.dump(current_params, f, indent=4)
     print(f"\n[系統] 參數檔已更新: {config_path}")
 
-def run_grid_processor(image_name, dish_label=None):
-    # 解析檔名取得基準時間與 Dish 標籤
-    name_no_ext = os.path.splitext(image_name)[0]
+def parse_image_name(image_name):
+    """由 YYYYMMDD_HHMMSS_DishLabel.jpg 解析出 (dish_label, 基準時間)"""
+    name_no_ext = os.path.splitext(os.path.basename(image_name))[0]
     parts = name_no_ext.split('_')
-    
-    if dish_label is None:
-        if len(parts) >= 3:
-            dish_label = "_".join(parts[2:]) # e.g. "Dish_A"
-        else:
-            dish_label = "Unknown"
-    
-    # 紀錄基準時間點 (格式: YYYYMMDD_HHMMSS)
+    dish_label = "_".join(parts[2:]) if len(parts) >= 3 else "Unknown" # e.g. "Dish_A"
     start_timestamp = f"{parts[0]}_{parts[1]}" if len(parts) >= 2 else "00000000_000000"
+    return dish_label, start_timestamp
+
+def compute_grid_cells(w, h, params):
+    """依邊界與間距計算 rows x cols 個穴孔的 (編號, x1, y1, x2, y2)，GUI 與批次模式共用"""
+    cols = params["cols"]
+    rows = params["rows"]
+    work_w = w - params["margin_left"] - params["margin_right"]
+    work_h = h - params["margin_top"] - params["margin_bottom"]
+
+    cells = []
+    if work_w > 0 and work_h > 0:
+        # 計算單一小方格的寬高 (扣掉間距)
+        cell_w = (work_w - (cols - 1) * params["gap_x"]) // cols
+        cell_h = (work_h - (rows - 1) * params["gap_y"]) // rows
+
+        if cell_w > 0 and cell_h > 0:
+            cell_idx = 1
+            for r in range(rows):
+                for c in range(cols):
+                    # 計算單一格的真實座標
+                    x1 = params["margin_left"] + c * (cell_w + params["gap_x"])
+                    y1 = params["margin_top"] + r * (cell_h + params["gap_y"])
+                    cells.append((cell_idx, x1, y1, x1 + cell_w, y1 + cell_h))
+                    cell_idx += 1
+    return cells
+
+def cell_regions(final_cells):
+    """網格 -> [(cell_XX, 切割框)]，批次切割與擷取時直接切割共用"""
+    return [(f"cell_{c_idx:02d}", (x1, y1, x2, y2)) for (c_idx, x1, y1, x2, y2) in final_cells]
+
+def plan_dish_crop(dish_label, final_cells, config, start_timestamp, project_root, storage="jpg"):
+    """依鎖定的網格，規劃該 Dish 於基準時間之後需要切割的影像 (增量 / 局部重切)"""
+    # 自動批次處理路徑
+    input_dir = os.path.join(project_root, "temp_data", "exp2_soil_tray", "extracted_dishes")
+    output_base = os.path.join(project_root, "temp_data", "exp2_soil_tray", "time_series_crops", dish_label)
+
+    # 只過濾該 Dish，且時間在基準點之後的檔案
+    frames, n_all = crop_engine.list_dish_frames(input_dir, dish_label, start_timestamp)
+    print(f"[系統] 發現 {n_all} 個該 Dish 的檔案，其中 {len(frames)} 個在基準時間之後。")
+
+    regions = cell_regions(final_cells)
+    return crop_engine.plan_crop_jobs(dish_label, frames, regions, config, output_base, storage)
+
+def batch_crop_dish(dish_label, final_cells, config, start_timestamp, project_root, workers=None, storage="jpg"):
+    """依鎖定的網格切割該 Dish 於基準時間之後的所有影像 (已切過且網格未變的影像會略過)"""
+    plan = plan_dish_crop(dish_label, final_cells, config, start_timestamp, project_root, storage)
+    crop_engine.run_crop_plans([plan], workers)
+    return plan["output_base"]
+
+def run_grid_processor(image_name, dish_label=None, workers=None, storage="jpg"):
+    # 解析檔名取得基準時間 (格式: YYYYMMDD_HHMMSS) 與 Dish 標籤
+    parsed_label, start_timestamp = parse_image_name(image_name)
+    if dish_label is None:
+        dish_label = parsed_label
 
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     image_path = os.path.join(project_root, "temp_data", "exp2_soil_tray", "extracted_dishes", image_name)
@@ -118,33 +169,13 @@ def run_grid_processor(image_name, dish_label=None):
         cv2.addWeighted(overlay, 0.5, display_img, 0.5, 0, display_img)
 
         # 計算內部工作區與網格座標
-        work_w = w - m_left - m_right
-        work_h = h - m_top - m_bot
-        
-        cells = []
-        if work_w > 0 and work_h > 0:
-            # 計算單一小方格的寬高 (扣掉間距)
-            cell_w = (work_w - (cols - 1) * params["gap_x"]) // cols
-            cell_h = (work_h - (rows - 1) * params["gap_y"]) // rows
-            
-            if cell_w > 0 and cell_h > 0:
-                cell_idx = 1
-                for r in range(rows):
-                    for c in range(cols):
-                        # 計算單一格的真實座標
-                        x1 = m_left + c * (cell_w + params["gap_x"])
-                        y1 = m_top + r * (cell_h + params["gap_y"])
-                        x2 = x1 + cell_w
-                        y2 = y1 + cell_h
-                        
-                        cells.append((cell_idx, x1, y1, x2, y2))
-                        
-                        # 畫出綠色網格
-                        cv2.rectangle(display_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                        # 標註穴孔編號 (cell_01 ~ cell_12)
-                        cv2.putText(display_img, f"C{cell_idx:02d}", (x1 + 5, y1 + 25), 
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-                        cell_idx += 1
+        cells = compute_grid_cells(w, h, params)
+        for (cell_idx, x1, y1, x2, y2) in cells:
+            # 畫出綠色網格
+            cv2.rectangle(display_img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            # 標註穴孔編號 (cell_01 ~ cell_12)
+            cv2.putText(display_img, f"C{cell_idx:02d}", (x1 + 5, y1 + 25), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
                         
         final_cells = cells
 
@@ -157,42 +188,13 @@ def run_grid_processor(image_name, dish_label=None):
         elif key == ord('s'):
             if len(final_cells) == cols * rows:
                 print(f"\n[系統] 偵測到 {len(final_cells)} 個有效穴孔。正在鎖定座標並執行批次切割...")
-                save_config(dish_label, params, project_root)
-                
-                # 自動批次處理路徑
-                input_dir = os.path.join(project_root, "temp_data", "exp2_soil_tray", "extracted_dishes")
-                output_base = os.path.join(project_root, "temp_data", "exp2_soil_tray", "time_series_crops", dish_label)
-                
-                # 只過濾該 Dish，且時間在基準點之後的檔案
-                all_images = sorted(glob.glob(os.path.join(input_dir, f"*{dish_label}.jpg")))
-                images_to_process = []
-                for img_path in all_images:
-                    base_name = os.path.basename(img_path)
-                    parts_current = base_name.split('_')
-                    if len(parts_current) >= 2:
-                        current_timestamp = f"{parts_current[0]}_{parts_current[1]}"
-                        if current_timestamp >= start_timestamp:
-                            images_to_process.append(img_path)
-
-                print(f"[系統] 發現 {len(all_images)} 個該 Dish 的檔案，其中 {len(images_to_process)} 個在基準時間之後。")
-
-                # 開始批次裁切
-                for img_path in images_to_process:
-                    base_name = os.path.basename(img_path)
-                    parts_current = base_name.split('_')
-                    if len(parts_current) >= 2:
-                        timestamp = f"{parts_current[0]}_{parts_current[1]}"
-                        batch_img = cv2.imread(img_path)
-                        
-                        if batch_img is not None:
-                            for (c_idx, x1, y1, x2, y2) in final_cells:
-                                cell_dir = os.path.join(output_base, f"cell_{c_idx:02d}")
-                                os.makedirs(cell_dir, exist_ok=True)
-                                crop = batch_img[y1:y2, x1:x2]
-                                cv2.imwrite(os.path.join(cell_dir, f"{timestamp}.jpg"), crop)
-                                
-                        print(f"  > 處理完畢: {base_name}")
+                # 基準影像與尺寸一併寫入，讓無視窗批次模式可以直接重建網格
+                config = dict(params)
+                config["base_image"] = image_name
+                config["image_size"] = [w, h]
+                save_config(dish_label, config, project_root)
                 
+                output_base = batch_crop_dish(dish_label, final_cells, config, start_timestamp, project_root, workers, storage)
                 print(f"\n[成功] 所有穴孔 (cell_01~cell_12) 最新縮時序列已存於: {output_base}")
                 break
             else:
@@ -200,13 +202,99 @@ def run_grid_processor(image_name, dish_label=None):
 
     cv2.destroyAllWindows()
 
+# ==========================================================
+# [ 無視窗批次模式 (Headless / Cron) ]
+# ==========================================================
+def load_saved_configs(project_root, dish_labels=None):
+    """讀取 scripts/configs/grid_{dish}.json，回傳 {dish_label: config}"""
+    config_dir = os.path.join(project_root, "scripts", "configs")
+    if dish_labels:
+        paths = [os.path.join(config_dir, f"grid_{d}.json") for d in dish_labels]
+    else:
+        paths = sorted(glob.glob(os.path.join(config_dir, "grid_*.json")))
+
+    configs = {}
+    for path in paths:
+        dish_label = os.path.splitext(os.path.basename(path))[0][len("grid_"):]
+        if not os.path.exists(path):
+            print(f"[跳過] 找不到設定檔: {path}")
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            configs[dish_label] = json.load(f)
+    return configs
+
+def resolve_image_size(dish_label, config, project_root):
+    """舊版設定檔沒有記錄影像尺寸時，改讀該 Dish 的第一張影像取得"""
+    if config.get("image_size"):
+        return tuple(config["image_size"])
+    input_dir = os.path.join(project_root, "temp_data", "exp2_soil_tray", "extracted_dishes")
+    candidates = frame_catalog.for_image_dir(input_dir).dish_images(input_dir, dish_label)
+    for _, path in candidates[:5]:
+        img = cv2.imread(path)
+        if img is not None:
+            h, w = img.shape[:2]
+            return w, h
+    return None
+
+def run_headless_batch(dish_labels=None, workers=None, storage="jpg"):
+    """
+    不開任何視窗，直接依已存的 grid_{dish}.json 切割所有 Dish (適用於 Pi 或 cron)。
+    所有 Dish 的影像會合併成同一批工作，一起分散到各核心。
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    configs = load_saved_configs(project_root, dish_labels)
+    if not configs:
+        print("[錯誤] 沒有可用的 configs/grid_{dish}.json，請先以 GUI 模式完成一次網格鎖定。")
+        return
+
+    plans = []
+    for dish_label, config in configs.items():
+        print(f"\n[處理] {dish_label} (無視窗批次模式)")
+        size = resolve_image_size(dish_label, config, project_root)
+        if size is None:
+            print(f"[跳過] {dish_label}: 找不到任何影像可用來計算網格。")
+            continue
+
+        params = dict(CONFIG)
+        params.update(config)
+        final_cells = compute_grid_cells(size[0], size[1], params)
+        if len(final_cells) != params["cols"] * params["rows"]:
+            print(f"[跳過] {dish_label}: 設定檔的 Margin/Gap 無法算出有效網格。")
+            continue
+
+        start_timestamp = "00000000_000000"
+        if config.get("base_image"):
+            _, start_timestamp = parse_image_name(config["base_image"])
+        plans.append(plan_dish_crop(dish_label, final_cells, config, start_timestamp, project_root, storage))
+
+    crop_engine.run_crop_plans(plans, workers)
+    for plan in plans:
+        print(f"[成功] {plan['dish']}: {plan['n_regions']} 個穴孔縮時序列已存於: {plan['output_base']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：覆土育苗盆 (4x3) 網格切割系統")
+    parser.add_argument("image_name", nargs="?", default=None,
+                        help="基準影像檔名，例如 20260301_080000_Dish_A.jpg (GUI 模式)")
+    parser.add_argument("--headless", action="store_true",
+                        help="不開視窗，依已存的 configs/grid_{dish}.json 批次切割")
+    parser.add_argument("--dish", nargs="+", default=None,
+                        help="無視窗模式下只處理指定的 Dish，例如 --dish Dish_A Dish_B")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="批次切割使用的行程數 (預設為 CPU 核心數，1 為單行程)")
+    parser.add_argument("--storage", choices=crop_engine.STORAGE_CHOICES, default="jpg",
+                        help="切割結果儲存格式：jpg (每張一檔) / archive (每 Dish 一個封存檔) / both")
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    target_image = None
+    args = parse_args()
+    if args.headless:
+        run_headless_batch(args.dish, args.workers, args.storage)
+        sys.exit(0)
+
+    target_image = args.image_name
     
     # 支援透過命令列直接指定檔名
-    if len(sys.argv) > 1:
-        target_image = sys.argv[1]
-    else:
+    if not target_image:
         # 自動搜尋 exp2 的 extracted_dishes 當中可用的第一張圖作為預設值
         project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         default_dir = os.path.join(project_root, "temp_data", "exp2_soil_tray", "extracted_dishes")
@@ -217,7 +305,8 @@ if __name__ == "__main__":
                 print(f"[提示] 自動取用找到的第一張圖: {target_image}")
     
     if target_image:
-        run_grid_processor(target_image)
+        run_grid_processor(target_image, workers=args.workers, storage=args.storage)
     else:
         print("[錯誤] 未傳入指定圖片，且 temp_data/exp2_soil_tray/extracted_dishes 裡面沒有任何 jpg 照片。")
         print(">> 用法指示: python scripts/grid_cell_processor.py <檔名>")
+        print(">> 無視窗批次: python scripts/grid_cell_processor.py --headless [--dish Dish_A ...]")
@@ -0,0 +1,156 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import tile_archive
+
+# ==========================================================
+# [ 關鍵影格挑選 ]
+# 生命週期大圖大部分的格子都是一動也不動的休眠種子。這裡依照影像變化量挑出 target 張：
+#   1. 分批讀取磁磚 (tile_archive.read_stack，封存檔以 memmap 整批取出)，
+#      轉灰階、縮成 size x size (區塊平均降低雜訊)，並扣除每張的亮度中位數抵銷日夜光線變化；
+#      縮小後每張只佔 size*size*4 bytes，上萬張也只要十幾 MB
+#   2. 變化量 = 最近 window 張的平均影像 與 再之前 window 張的平均影像 的平均灰階差，
+#      再扣掉整段的中位數 (感光雜訊的底線)。胚根一次只長一兩個像素，逐張相減會被雜訊淹沒，
+#      以前後兩段平均相比，緩慢的生長會累積起來，雜訊則被平均掉
+#   3. 權重 = uniform_share 平均分給每一張 + 其餘依變化量分配，
+#      在累積權重上取等距分位點 → 胚根伸出等事件附近密集、靜止期稀疏，第一張與最後一張一定保留
+# ==========================================================
+CONFIG = {
+    "size": 16,            # 比較前先縮成 size x size
+    "window": 8,           # 前後各取幾張平均後比較
+    "uniform_share": 0.3,  # 平均分布在整段時間的比例 (靜止期也保有代表影格)
+    "chunk": 512,          # 每批讀取幾張，控制記憶體用量
+}
+CACHE_NAME = ".keyframes.json"
+
+def small_gray(stack, size):
+    """(n, h, w, 3) uint8 -> 區塊平均縮小後、扣除亮度中位數的灰階 (n, size, size) float32"""
+    n, h, w = stack.shape[:3]
+    sh, sw = min(size, h), min(size, w)
+    bh, bw = h // sh, w // sw
+    gray = stack[:, :sh * bh, :sw * bw].astype(np.float32).mean(axis=3)
+    gray = gray.reshape(n, sh, bh, sw, bw).mean(axis=(2, 4))
+    return gray - np.median(gray.reshape(n, -1), axis=1)[:, None, None]
+
+def read_small(refs, params=CONFIG):
+    """整段序列的縮小灰階 (n, size, size)；讀取失敗的影像沿用前一張 (不會被當成變化)"""
+    small = None
+    valid = np.zeros(len(refs), dtype=bool)
+    tile_shape = (None, None)
+    for start in range(0, len(refs), params["chunk"]):
+        stack, ok = tile_archive.read_stack(refs[start:start + params["chunk"]], *tile_shape)
+        if not ok:
+            continue
+        tile_shape = stack.shape[1:3]
+        part = small_gray(stack, params["size"])
+        if small is None:
+            small = np.zeros((len(refs),) + part.shape[1:], dtype=np.float32)
+        idx = np.array(ok) + start
+        small[idx] = part
+        valid[idx] = True
+    if small is None:
+        return np.zeros((len(refs), 1, 1), dtype=np.float32)
+    # 向前補值：每張取最近一張成功讀取的影像 (開頭缺的取第一張成功的)
+    last = np.maximum.accumulate(np.where(valid, np.arange(len(refs)), -1))
+    last[last < 0] = np.flatnonzero(valid)[0]
+    return small[last]
+
+def frame_changes(refs, params=CONFIG):
+    """每張影像處的變化量 (n,)，已扣除雜訊底線 (>= 0)"""
+    small = read_small(refs, params)
+    n, k = len(small), params["window"]
+    changes = np.zeros(n, dtype=np.float32)
+    if n <= k:
+        return changes
+    # 以累積和一次算出每個位置前 k 張的平均
+    csum = np.cumsum(np.concatenate([np.zeros((1,) + small.shape[1:], dtype=np.float64), small]), axis=0)
+    mean = (csum[k:] - csum[:-k]) / k   # mean[j] = small[j:j + k] 的平均
+    changes[2 * k - 1:] = np.abs(mean[k:] - mean[:-k]).mean(axis=(1, 2))
+    changes[2 * k - 1:] -= np.median(changes[2 * k - 1:])
+    return np.maximum(changes, 0)
+
+def pick_indices(changes, target, params=CONFIG):
+    """依變化量在累積權重上取分位點，回傳遞增且不重複的索引 (最多 target 個，含頭尾)"""
+    n = len(changes)
+    if n <= target:
+        return np.arange(n)
+    target = max(target, 2)
+    u = params["uniform_share"]
+    total = changes.sum()
+    weight = np.full(n, 1.0 / n)
+    if total > 0:
+        weight = u / n + (1 - u) * changes / total
+    cum = np.cumsum(weight)
+    quantiles = (np.arange(target - 2) + 0.5) / (target - 2) * cum[-1] if target > 2 else np.zeros(0)
+    picks = np.searchsorted(cum, quantiles)
+    return np.unique(np.concatenate([[0, n - 1], np.minimum(picks, n - 1)]))
+
+def select_keyframes(frames, target, params=CONFIG):
+    """frames: [(timestamp, ref)] (依時間排序)，回傳挑出的子序列"""
+    if len(frames) <= target:
+        return frames
+    changes = frame_changes([ref for _, ref in frames], params)
+    return [frames[i] for i in pick_indices(changes, target, params)]
+
+# ==========================================================
+# [ 批次挑選與快取 ]
+# 挑選需要讀取整段序列，結果依輸入指紋 (目標張數 + 參數 + 每張影像的大小/修改時間) 快取在
+# 輸出目錄的 .keyframes.json，序列沒變時不必重新讀取。
+# ==========================================================
+def _signature(target, params, frames):
+    payload = {
+        "target": target,
+        "params": params,
+        "inputs": [tile_archive.ref_signature(ts, ref) for ts, ref in frames],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _select_job(args):
+    frames, target, params = args
+    return [ts for ts, _ in select_keyframes(frames, target, params)]
+
+def select_many(series, target, cache_dir, workers=None, params=CONFIG):
+    """
+    series: {名稱: [(timestamp, ref)]}，回傳 {名稱: 挑出的子序列}
+    沒有快取的序列以多行程平行計算
+    """
+    cache_path = os.path.join(cache_dir, CACHE_NAME)
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            print(f"[警告] 無法讀取 {cache_path}，將重新挑選關鍵影格。")
+
+    signatures = {name: _signature(target, params, frames) for name, frames in series.items()}
+    pending = [name for name in series
+               if len(series[name]) > target and cache.get(name, {}).get("signature") != signatures[name]]
+    if pending:
+        print(f"[系統] 計算 {len(pending)} 個序列的影像變化量，挑選關鍵影格 (每個 {target} 張)...")
+        tasks = [(series[name], target, params) for name in pending]
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(tasks) <= 1:
+            results = list(map(_select_job, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(_select_job, tasks))
+        for name, timestamps in zip(pending, results):
+            cache[name] = {"signature": signatures[name], "timestamps": timestamps}
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+
+    selected = {}
+    for name, frames in series.items():
+        if len(frames) <= target:
+            selected[name] = frames
+        else:
+            keep = set(cache[name]["timestamps"])
+            selected[name] = [(ts, ref) for ts, ref in frames if ts in keep]
+    return selected
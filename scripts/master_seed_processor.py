@@ -4,6 +4,10 @@ import os
 import glob
 import json
 import sys
+import argparse
+
+import crop_engine
+import frame_catalog
 
 CONFIG = {
     "threshold": 137,
@@ -38,16 +42,82 @@ def save_config(dish_label, current_params, project_root):
         json.dump(current_params, f, indent=4)
     print(f"\n[系統] 參數檔已更新: {config_path}")
 
-def run_master_processor(image_name, dish_label=None):
-    # 如果沒有傳入 label，從檔名解析 (假設格式: YYYYMMDD_HHMMSS_DishLabel.jpg)
-    name_no_ext = os.path.splitext(image_name)[0]
+def parse_image_name(image_name):
+    """由 YYYYMMDD_HHMMSS_DishLabel.jpg 解析出 (dish_label, 基準時間)"""
+    name_no_ext = os.path.splitext(os.path.basename(image_name))[0]
     parts = name_no_ext.split('_')
-    
-    if dish_label is None:
-        dish_label = "_".join(parts[2:]) if len(parts) >= 3 else "Unknown"
-    
-    # 紀錄基準時間點 (格式: YYYYMMDD_HHMMSS)
+    dish_label = "_".join(parts[2:]) if len(parts) >= 3 else "Unknown"
     start_timestamp = f"{parts[0]}_{parts[1]}" if len(parts) >= 2 else "00000000_000000"
+    return dish_label, start_timestamp
+
+def detect_seed_centers(img, params):
+    """
+    依參數偵測種子並回傳 (Z 字型排序後的中心點, 外框清單)。
+    GUI 調校與無視窗批次模式共用同一套偵測邏輯。
+    """
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, params["threshold"], 255, cv2.THRESH_BINARY_INV)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    h, w = img.shape[:2]
+
+    current_centers = []
+    boxes = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        bx, by, bw, bh = cv2.boundingRect(cnt)
+        cx, cy = bx + bw//2, by + bh//2
+
+        if params["margin_left"] < cx < (w - params["margin_right"]) and \
+           params["margin_top"] < cy < (h - params["margin_bottom"]):
+            if params["min_area"] < area < params["max_area"]:
+                current_centers.append((cx, cy))
+                boxes.append((bx, by, bw, bh))
+
+    # 重新排序 Z 字型
+    sorted_centers = []
+    if current_centers:
+        current_centers.sort(key=lambda p: p[1])
+        row = []; last_y = current_centers[0][1]
+        for p in current_centers:
+            if p[1] - last_y < 55: row.append(p)
+            else:
+                row.sort(key=lambda p: p[0]); sorted_centers.extend(row)
+                row = [p]; last_y = p[1]
+        row.sort(key=lambda p: p[0]); sorted_centers.extend(row)
+    return sorted_centers, boxes
+
+def seed_regions(master_centers, crop_size):
+    """種子中心 -> [(seed_XX, 切割框)]，批次切割與擷取時直接切割共用"""
+    return [(f"seed_{i+1:02d}", crop_engine.seed_box(cx, cy, crop_size))
+            for i, (cx, cy) in enumerate(master_centers)]
+
+def plan_dish_crop(dish_label, master_centers, config, start_timestamp, project_root, storage="jpg"):
+    """依鎖定的種子座標，規劃該 Dish 於基準時間之後需要切割的影像 (增量 / 局部重切)"""
+    input_dir = os.path.join(project_root, "temp_data", "exp1_dish", "extracted_dishes")
+    output_base = os.path.join(project_root, "temp_data", "exp1_dish", "time_series_crops", dish_label)
+
+    # 只過濾該 Dish，且時間在基準點之後的檔案
+    frames, n_all = crop_engine.list_dish_frames(input_dir, dish_label, start_timestamp)
+    print(f"[系統] 發現 {n_all} 個該 Dish 的檔案，其中 {len(frames)} 個在基準時間之後。")
+
+    regions = seed_regions(master_centers, config["crop_size"])
+    return crop_engine.plan_crop_jobs(dish_label, frames, regions, config, output_base, storage)
+
+def batch_crop_dish(dish_label, master_centers, config, start_timestamp, project_root, workers=None, storage="jpg"):
+    """
+    依鎖定的種子座標批次切割該 Dish 於基準時間之後的所有影像。
+    已處理的時間點記錄在 crop_manifest.json，重跑時只切新影像或座標有變的種子。
+    """
+    plan = plan_dish_crop(dish_label, master_centers, config, start_timestamp, project_root, storage)
+    crop_engine.run_crop_plans([plan], workers)
+    return plan["output_base"]
+
+def run_master_processor(image_name, dish_label=None, workers=None, storage="jpg"):
+    # 如果沒有傳入 label，從檔名解析 (假設格式: YYYYMMDD_HHMMSS_DishLabel.jpg)
+    # 同時紀錄基準時間點 (格式: YYYYMMDD_HHMMSS)
+    parsed_label, start_timestamp = parse_image_name(image_name)
+    if dish_label is None:
+        dish_label = parsed_label
 
     project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     image_path = os.path.join(project_root, "temp_data", "exp1_dish", "extracted_dishes", image_name)
@@ -88,11 +158,6 @@ def run_master_processor(image_name, dish_label=None):
             "crop_size": CONFIG["crop_size"]
         }
 
-        # 影像預處理
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, params["threshold"], 255, cv2.THRESH_BINARY_INV)
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
         display_img = img.copy()
         h, w = img.shape[:2]
         
@@ -104,30 +169,11 @@ def run_master_processor(image_name, dish_label=None):
         cv2.rectangle(overlay, (w-params["margin_right"], params["margin_top"]), (w, h-params["margin_bottom"]), (40, 40, 40), -1)
         cv2.addWeighted(overlay, 0.5, display_img, 0.5, 0, display_img)
 
-        current_centers = []
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            bx, by, bw, bh = cv2.boundingRect(cnt)
-            cx, cy = bx + bw//2, by + bh//2
-
-            if params["margin_left"] < cx < (w - params["margin_right"]) and \
-               params["margin_top"] < cy < (h - params["margin_bottom"]):
-                if params["min_area"] < area < params["max_area"]:
-                    current_centers.append((cx, cy))
-                    cv2.rectangle(display_img, (bx, by), (bx + bw, by + bh), (0, 255, 0), 2)
-
-        # 重新排序 Z 字型
-        if current_centers:
-            current_centers.sort(key=lambda p: p[1])
-            sorted_centers = []
-            row = []; last_y = current_centers[0][1]
-            for p in current_centers:
-                if p[1] - last_y < 55: row.append(p)
-                else:
-                    row.sort(key=lambda p: p[0]); sorted_centers.extend(row)
-                    row = [p]; last_y = p[1]
-            row.sort(key=lambda p: p[0]); sorted_centers.extend(row)
-            
+        sorted_centers, boxes = detect_seed_centers(img, params)
+        for bx, by, bw, bh in boxes:
+            cv2.rectangle(display_img, (bx, by), (bx + bw, by + bh), (0, 255, 0), 2)
+
+        if sorted_centers:
             for i, pt in enumerate(sorted_centers):
                 cv2.putText(display_img, str(i+1), (pt[0]-10, pt[1]-15), 
                             cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 2)
@@ -142,38 +188,13 @@ def run_master_processor(image_name, dish_label=None):
         elif key == ord('s'):
             if len(master_centers) > 0:
                 print(f"\n[系統] 偵測到 {len(master_centers)} 個種子。正在鎖定座標並執行批次切割...")
-                save_config(dish_label, params, project_root)
-                
-                # 自動批次處理邏輯
-                input_dir = os.path.join(project_root, "temp_data", "exp1_dish", "extracted_dishes")
-                output_base = os.path.join(project_root, "temp_data", "exp1_dish", "time_series_crops", dish_label)
-                
-                # 只過濾該 Dish，且時間在基準點之後的檔案
-                all_images = sorted(glob.glob(os.path.join(input_dir, f"*{dish_label}.jpg")))
-                images_to_process = []
-                for img_path in all_images:
-                    base_name = os.path.basename(img_path)
-                    parts_current = base_name.split('_')
-                    current_timestamp = f"{parts_current[0]}_{parts_current[1]}"
-                    if current_timestamp >= start_timestamp:
-                        images_to_process.append(img_path)
-
-                print(f"[系統] 發現 {len(all_images)} 個該 Dish 的檔案，其中 {len(images_to_process)} 個在基準時間之後。")
-
-                for img_path in images_to_process:
-                    base_name = os.path.basename(img_path)
-                    parts_current = base_name.split('_')
-                    timestamp = f"{parts_current[0]}_{parts_current[1]}"
-                    batch_img = cv2.imread(img_path)
-                    
-                    for i, (cx, cy) in enumerate(master_centers):
-                        seed_dir = os.path.join(output_base, f"seed_{i+1:02d}")
-                        os.makedirs(seed_dir, exist_ok=True)
-                        s = params["crop_size"]
-                        crop = batch_img[max(0,cy-s):cy+s, max(0,cx-s):cx+s]
-                        cv2.imwrite(os.path.join(seed_dir, f"{timestamp}.jpg"), crop)
-                    print(f"  > 處理完畢: {base_name}")
+                # 種子座標與基準影像一併寫入設定檔，作為增量切割的設定指紋來源
+                config = dict(params)
+                config["base_image"] = image_name
+                config["seed_centers"] = [[int(cx), int(cy)] for cx, cy in master_centers]
+                save_config(dish_label, config, project_root)
                 
+                output_base = batch_crop_dish(dish_label, master_centers, config, start_timestamp, project_root, workers, storage)
                 print(f"\n[成功] 所有種子縮時序列已存於: {output_base}")
                 break
             else:
@@ -181,14 +202,106 @@ def run_master_processor(image_name, dish_label=None):
 
     cv2.destroyAllWindows()
 
+# ==========================================================
+# [ 無視窗批次模式 (Headless / Cron) ]
+# ==========================================================
+def load_saved_configs(project_root, dish_labels=None):
+    """讀取 scripts/config_{dish}.json，回傳 {dish_label: config}"""
+    scripts_dir = os.path.join(project_root, "scripts")
+    if dish_labels:
+        paths = [os.path.join(scripts_dir, f"config_{d}.json") for d in dish_labels]
+    else:
+        paths = sorted(glob.glob(os.path.join(scripts_dir, "config_*.json")))
+
+    configs = {}
+    for path in paths:
+        dish_label = os.path.splitext(os.path.basename(path))[0][len("config_"):]
+        if not os.path.exists(path):
+            print(f"[跳過] 找不到設定檔: {path}")
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            configs[dish_label] = json.load(f)
+    return configs
+
+def resolve_seed_centers(dish_label, config, project_root):
+    """
+    優先使用設定檔中鎖定的 seed_centers；舊版設定檔沒有座標時，
+    以 base_image (沒有記錄時改用該 Dish 最早的一張影像) 搭配已存的參數重新偵測一次。
+    """
+    if config.get("seed_centers"):
+        return [(int(cx), int(cy)) for cx, cy in config["seed_centers"]]
+
+    input_dir = os.path.join(project_root, "temp_data", "exp1_dish", "extracted_dishes")
+    if config.get("base_image"):
+        candidates = [os.path.join(input_dir, config["base_image"])]
+    else:
+        candidates = [path for _, path in frame_catalog.for_image_dir(input_dir).dish_images(input_dir, dish_label)[:5]]
+
+    for image_path in candidates:
+        img = cv2.imread(image_path)
+        if img is None:
+            continue
+        centers, _ = detect_seed_centers(img, config)
+        if not config.get("base_image"):
+            print(f"  > 設定檔沒有鎖定的座標，以最早的影像 {os.path.basename(image_path)} 偵測到 {len(centers)} 個種子")
+        return centers
+    print(f"[跳過] {dish_label}: 找不到基準影像 ({config.get('base_image') or '該 Dish 沒有任何影像'})")
+    return []
+
+def run_headless_batch(dish_labels=None, workers=None, storage="jpg"):
+    """
+    不開任何視窗，直接依已存的 config_{dish}.json 切割所有 Dish (適用於 Pi 或 cron)。
+    所有 Dish 的影像會合併成同一批工作，一起分散到各核心。
+    """
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    configs = load_saved_configs(project_root, dish_labels)
+    if not configs:
+        print("[錯誤] 沒有可用的 config_{dish}.json，請先以 GUI 模式完成一次座標鎖定。")
+        return
+
+    plans = []
+    for dish_label, config in configs.items():
+        print(f"\n[處理] {dish_label} (無視窗批次模式)")
+        centers = resolve_seed_centers(dish_label, config, project_root)
+        if not centers:
+            continue
+        start_timestamp = "00000000_000000"
+        if config.get("base_image"):
+            _, start_timestamp = parse_image_name(config["base_image"])
+        plans.append(plan_dish_crop(dish_label, centers, config, start_timestamp, project_root, storage))
+
+    crop_engine.run_crop_plans(plans, workers)
+    for plan in plans:
+        print(f"[成功] {plan['dish']}: {plan['n_regions']} 顆種子縮時序列已存於: {plan['output_base']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：種子 Master 影像處理系統")
+    parser.add_argument("image_name", nargs="?", default=None,
+                        help="基準影像檔名，例如 20260222_191223_Dish_A.jpg (GUI 模式)")
+    parser.add_argument("--headless", action="store_true",
+                        help="不開視窗，依已存的 config_{dish}.json 批次切割")
+    parser.add_argument("--dish", nargs="+", default=None,
+                        help="無視窗模式下只處理指定的 Dish，例如 --dish Dish_A Dish_B")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="批次切割使用的行程數 (預設為 CPU 核心數，1 為單行程)")
+    parser.add_argument("--storage", choices=crop_engine.STORAGE_CHOICES, default="jpg",
+                        help="切割結果儲存格式：jpg (每張一檔) / archive (每 Dish 一個封存檔) / both")
+    return parser.parse_args()
+
 if __name__ == "__main__":
     # 用法: python scripts/master_seed_processor.py [image_name]
+    #       python scripts/master_seed_processor.py --headless [--dish Dish_A ...]
     # 如果不帶參數，則使用預設的範例圖
-    if len(sys.argv) > 1:
-        target_image = sys.argv[1]
+    args = parse_args()
+    if args.headless:
+        run_headless_batch(args.dish, args.workers, args.storage)
+        sys.exit(0)
+
+    if args.image_name:
+        target_image = args.image_name
     else:
         target_image = "20260222_191223_Dish_A.jpg"
         print(f"[提示] 未提供影像檔名，使用預設值: {target_image}")
         print(">> 用法範例: python scripts/master_seed_processor.py 20260222_191223_Dish_A.jpg")
 
-    run_master_processor(target_image)
+    run_master_processor(target_image, workers=args.workers, storage=args.storage)
@@ -0,0 +1,266 @@
+import os
+import time
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import tile_archive
+
+# ==========================================================
+# [ 共用大圖渲染引擎 ]
+# daily_seed_montage_generator / daily_cell_montage_generator / seed_lifecycle_montage 共用：
+# 先列出所有 (dish, 種子/穴孔, 日期) 工作，再以多行程 (Process Pool) 平行渲染。
+# 每個工作只寫自己的輸出檔，結果依工作清單順序回報，輸出內容與行程數無關。
+#
+# 建置快取 (BuildCache)：每張大圖記錄一個輸入指紋 =
+#   產生器原始碼 + 非影像參數 + 每張輸入影像的 (時間, 大小/修改時間 或 封存檔寫入次數)
+# 指紋相同且輸出檔仍存在就跳過，每天重跑時只會重畫當天 (或重切過) 的大圖。
+#
+# 排版後端 (--backend)：
+#   pil   : 逐格 canvas.paste (預設)
+#   numpy : 磁磚整批讀成 (n, h, w, 3) 陣列，畫布的格子區以一次 reshape/transpose
+#           視為 (rows, cols, 格高, 格寬, 3)，花式索引一次寫入所有磁磚，最後只編碼一次。
+#   兩者輸出逐位元相同 (python3 scripts/montage_engine.py 可比較速度並驗證)。
+# ==========================================================
+PROGRESS_EVERY = 20  # 每完成幾張印一次進度
+CACHE_NAME = ".build_cache.json"
+BACKENDS = ("pil", "numpy")
+
+def default_workers():
+    return os.cpu_count() or 1
+
+# ==========================================================
+# [ 建置快取 ]
+# ==========================================================
+def code_signature(module_file):
+    """產生器原始碼的指紋：改了排版程式碼後舊大圖會自動重畫"""
+    with open(module_file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+def input_signature(code_sig, params, frames):
+    """
+    params: 除影像外會影響輸出的參數 (Dish、種子、日期、篩選範圍...)
+    frames: [(timestamp, ref)]
+    """
+    payload = {
+        "code": code_sig,
+        "params": params,
+        "inputs": [tile_archive.ref_signature(ts, ref) for ts, ref in frames],
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+class BuildCache:
+    def __init__(self, output_root):
+        self.output_root = output_root
+        self.path = os.path.join(output_root, CACHE_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError):
+                print(f"[警告] 無法讀取 {self.path}，將重新產生所有大圖。")
+
+    def _key(self, output_path):
+        return os.path.relpath(output_path, self.output_root)
+
+    def is_fresh(self, output_path, signature):
+        return self.entries.get(self._key(output_path)) == signature and os.path.exists(output_path)
+
+    def record(self, output_path, signature):
+        self.entries[self._key(output_path)] = signature
+
+    def save(self):
+        os.makedirs(self.output_root, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+# ==========================================================
+# [ NumPy 排版 ]
+# ==========================================================
+def grid_view(canvas, origin, rows, cols, stride):
+    """
+    canvas (H, W, 3) 中由 origin=(x, y) 開始、rows x cols 個 stride=(格寬, 格高) 格子的視圖，
+    形狀 (rows, cols, 格高, 格寬, 3)；寫入視圖即寫入畫布。
+    """
+    x0, y0 = origin
+    sw, sh = stride
+    block = canvas[y0:y0 + rows * sh, x0:x0 + cols * sw]
+    return block.reshape(rows, sh, cols, sw, 3).transpose(0, 2, 1, 3, 4)
+
+def paste_tiles(grid, slot_indices, refs, size, resample=None):
+    """
+    將 refs 縮成 size 後一次寫入 grid 的第 slot_indices 格左上角，回傳讀取失敗的格子索引
+    (與 PIL 版相同，失敗的格子保持原樣)。
+    """
+    cols = grid.shape[1]
+    w, h = size
+    stack, ok = tile_archive.read_thumbnail_stack(refs, size, resample)
+    slot_indices = np.asarray(slot_indices, dtype=int)
+    r, c = np.divmod(slot_indices[ok], cols)
+    grid[r, c, :h, :w] = stack[ok]
+    failed = np.ones(len(slot_indices), dtype=bool)
+    failed[ok] = False
+    return slot_indices[failed]
+
+def draw_frames(grid, slot_indices, size, color):
+    """等同 ImageDraw.rectangle([x, y, x + w, y + h], outline=color, width=1)，一次畫完所有格子"""
+    if len(slot_indices) == 0:
+        return
+    w, h = size
+    r, c = np.divmod(np.asarray(slot_indices, dtype=int), grid.shape[1])
+    grid[r, c, 0, :w + 1] = color
+    grid[r, c, h, :w + 1] = color
+    grid[r, c, :h + 1, 0] = color
+    grid[r, c, :h + 1, w] = color
+
+def fill_boxes(grid, slot_indices, size, color):
+    """等同 ImageDraw.rectangle([x, y, x + w, y + h], fill=color)"""
+    if len(slot_indices) == 0:
+        return
+    w, h = size
+    r, c = np.divmod(np.asarray(slot_indices, dtype=int), grid.shape[1])
+    grid[r, c, :h + 1, :w + 1] = color
+
+# ==========================================================
+# [ 執行 ]
+# ==========================================================
+def _run_job(job):
+    render, args = job
+    return render(*args)
+
+def run_jobs(render, jobs, workers=None, label="大圖", cache=None, targets=None, force=False):
+    """
+    render : 模組層級的渲染函式 (需可被 pickle)，回傳輸出路徑或 None (沒有產生檔案)
+    jobs   : [render 的參數 tuple]，依序排好 (決定回報順序)
+    cache  : BuildCache；搭配 targets = [(輸出路徑, 輸入指紋)] (與 jobs 一一對應) 略過未變動的大圖
+    force  : 忽略快取全部重畫
+    回傳成功產生的輸出路徑清單
+    """
+    workers = workers or default_workers()
+    if cache is not None and targets is not None:
+        pending = [(args, target) for args, target in zip(jobs, targets)
+                   if force or not cache.is_fresh(*target)]
+        skipped = len(jobs) - len(pending)
+        if skipped:
+            print(f"[系統] {skipped} 張{label}的輸入沒有變動，略過。")
+    else:
+        pending = [(args, None) for args in jobs]
+
+    total = len(pending)
+    if total == 0:
+        print("[系統] 沒有需要產生的大圖。")
+        return []
+    print(f"[系統] 共 {total} 張{label}待產生，使用 {workers} 個行程。")
+
+    tasks = [(render, args) for args, _ in pending]
+    if workers <= 1 or total <= 1:
+        results = map(_run_job, tasks)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        chunksize = max(1, min(8, total // (workers * 4)))
+        results = executor.map(_run_job, tasks, chunksize=chunksize)
+
+    outputs = []
+    t0 = time.perf_counter()
+    try:
+        for i, ((_, target), path) in enumerate(zip(pending, results), start=1):
+            if path:
+                outputs.append(path)
+                print(f"  > 已生成{label}: {path}")
+                if target is not None:
+                    cache.record(*target)
+            if i % PROGRESS_EVERY == 0 or i == total:
+                elapsed = time.perf_counter() - t0
+                eta = elapsed / i * (total - i)
+                print(f"[進度] {i}/{total} ({i * 100 // total}%) | 已用 {elapsed:.0f}s | 預估剩餘 {eta:.0f}s")
+                if cache is not None:
+                    cache.save()
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        # 中斷時也保留已完成的部分，下次只補畫剩下的
+        if cache is not None:
+            cache.save()
+    return outputs
+
+# ==========================================================
+# [ 效能測試 ]
+# python3 scripts/montage_engine.py [--repeat N]
+# 以實際資料各取一張 每日種子 / 每日穴孔 / 生命週期 大圖，比較 pil 與 numpy 後端並確認輸出相同。
+# 每次計時前清空縮圖快取，時間包含解碼、排版與 JPEG 編碼；輸出寫到暫存目錄，不動到正式大圖。
+# ==========================================================
+def _sample_jobs():
+    import daily_seed_montage_generator as seed_gen
+    import daily_cell_montage_generator as cell_gen
+    import seed_lifecycle_montage as life_gen
+
+    def first_series(input_dir, prefix):
+        if not os.path.isdir(input_dir):
+            return None, None, []
+        for dish in sorted(os.listdir(input_dir)):
+            dish_path = os.path.join(input_dir, dish)
+            if dish.startswith("_") or not os.path.isdir(dish_path):
+                continue
+            for series in tile_archive.list_series(dish_path):
+                frames = tile_archive.list_frames(dish_path, series)
+                if series.startswith(prefix) and frames:
+                    return dish, series, frames
+        return None, None, []
+
+    cases = []
+    dish, seed, frames = first_series(seed_gen.INPUT_BASE_DIR, "seed_")
+    if frames:
+        date = frames[0][0][:8]
+        day = [(ts, ref) for ts, ref in frames if ts.startswith(date)]
+        cases.append(("每日種子", len(day), seed_gen, seed_gen.create_daily_montage, (dish, seed, date, day)))
+        page, sheet, cols = life_gen.paginate(frames)[0]
+        cases.append(("生命週期", len(sheet), life_gen, life_gen.create_lifecycle_montage, (dish, seed, sheet, page, cols)))
+    dish, cell, frames = first_series(cell_gen.INPUT_BASE_DIR, "cell_")
+    if frames:
+        date, am_pm = frames[0][0][:8], ("AM" if frames[0][0][9:11] < "12" else "PM")
+        half = [(ts, ref) for ts, ref in frames
+                if ts.startswith(date) and (ts[9:11] < "12") == (am_pm == "AM")]
+        cases.append(("每日穴孔", len(half), cell_gen, cell_gen.create_half_daily_cell_montage,
+                      (dish, cell, date, am_pm, half, False)))
+    return cases
+
+def run_benchmark():
+    import argparse
+    import tempfile
+    import filecmp
+
+    parser = argparse.ArgumentParser(description="大圖排版後端效能測試 (pil vs numpy)")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    cases = _sample_jobs()
+    if not cases:
+        print("[錯誤] 找不到任何切割好的種子或穴孔序列")
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, n_tiles, module, render, job_args in cases:
+            module.OUTPUT_BASE_DIR = os.path.join(tmp, module.__name__)
+            times, outputs = {}, {}
+            for backend in BACKENDS:
+                total = 0.0
+                for _ in range(args.repeat):
+                    tile_archive.clear_thumbnail_cache()
+                    t0 = time.perf_counter()
+                    path = render(*job_args, backend=backend)
+                    total += time.perf_counter() - t0
+                times[backend] = total / args.repeat * 1000
+                outputs[backend] = path + f".{backend}"
+                os.replace(path, outputs[backend])
+            same = filecmp.cmp(outputs["pil"], outputs["numpy"], shallow=False)
+            print(f"  > {label} ({n_tiles} 張): "
+                  f"pil {times['pil']:.1f} ms | numpy {times['numpy']:.1f} ms "
+                  f"(加速 {times['pil'] / times['numpy']:.2f}x) | 輸出{'相同' if same else '不同'}")
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -1,6 +1,8 @@
 import os
 import glob
-from PIL import Image
+import argparse
+
+import pdf_writer
 
 # ==========================================================
 # [ 設定參數 ]
@@ -9,7 +11,7 @@ PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INPUT_BASE_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "daily_montages")
 OUTPUT_PDF_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "reports_pdf")
 
-def generate_dish_pdf(dish_name):
+def generate_dish_pdf(dish_name, rebuild=False):
     dish_path = os.path.join(INPUT_BASE_DIR, dish_name)
     if not os.path.exists(dish_path):
         print(f"[跳過] 找不到 Dish 目錄: {dish_path}")
@@ -18,7 +20,7 @@ def generate_dish_pdf(dish_name):
     # 取得所有種子目錄並排序 (seed_01, seed_02...)
     seeds = sorted([s for s in os.listdir(dish_path) if os.path.isdir(os.path.join(dish_path, s))])
     
-    all_pages = []
+    montage_paths = []
     
     print(f"\n[處理] 正在編譯 {dish_name} 的 PDF 報告...")
     
@@ -26,36 +28,25 @@ def generate_dish_pdf(dish_name):
         seed_path = os.path.join(dish_path, seed)
         # 取得該種子的所有大圖並按日期排序
         montages = sorted(glob.glob(os.path.join(seed_path, "*_montage.jpg")))
-        
-        if not montages:
-            continue
-            
-        for img_path in montages:
-            try:
-                img = Image.open(img_path).convert('RGB')
-                all_pages.append(img)
-            except Exception as e:
-                print(f"  ! 無法開啟影像 {img_path}: {e}")
+        montage_paths.extend(montages)
 
-    if not all_pages:
+    # 逐頁寫入 PDF (一次只讀一張大圖，見 pdf_writer.py)；既有報告只附加新增 / 重畫過的大圖
+    output_filename = os.path.join(OUTPUT_PDF_DIR, f"{dish_name}_Germination_Report.pdf")
+    result = pdf_writer.update_report(output_filename, montage_paths, rebuild)
+    if result["pages"] == 0:
         print(f"  ! {dish_name} 沒有可用的影像。")
         return
-
-    # 儲存為 PDF
-    os.makedirs(OUTPUT_PDF_DIR, exist_ok=True)
-    output_filename = os.path.join(OUTPUT_PDF_DIR, f"{dish_name}_Germination_Report.pdf")
-    
-    # 第一張作為主體，其餘用 append_images 傳入
-    all_pages[0].save(
-        output_filename, 
-        save_all=True, 
-        append_images=all_pages[1:], 
-        quality=85
-    )
     
-    print(f"  > [成功] PDF 已生成: {output_filename} (共 {len(all_pages)} 頁)")
+    if result["mode"] == "unchanged":
+        print(f"  > [跳過] 報告已是最新: {output_filename} (共 {result['pages']} 頁)")
+    elif result["mode"] == "append":
+        print(f"  > [成功] PDF 已更新: {output_filename} (新增 {result['added']} 頁，共 {result['pages']} 頁)")
+    else:
+        print(f"  > [成功] PDF 已生成: {output_filename} (共 {result['pages']} 頁)")
+    if result["reencoded"]:
+        print(f"  > 其中 {result['reencoded']} 頁不是可直接嵌入的 JPEG，已重新壓縮")
 
-def run_pdf_generator():
+def run_pdf_generator(rebuild=False):
     print("="*60)
     print("      咸豐草實驗：Dish 成長紀錄 PDF 合成器")
     print("="*60)
@@ -68,8 +59,14 @@ def run_pdf_generator():
     dishes = sorted([d for d in os.listdir(INPUT_BASE_DIR) if os.path.isdir(os.path.join(INPUT_BASE_DIR, d))])
     
     for dish in dishes:
-        generate_dish_pdf(dish)
+        generate_dish_pdf(dish, rebuild)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：Dish 成長紀錄 PDF 合成器")
+    parser.add_argument("--rebuild", action="store_true", help="忽略既有報告，整份重新產生")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    run_pdf_generator()
+    args = parse_args()
+    run_pdf_generator(args.rebuild)
     print("\n[系統] 所有 PDF 報告處理完畢。")
@@ -6,6 +6,8 @@ import time
 import json
 import sys
 
+import dish_warp
+
 # ==========================================================
 # [ 腳本路徑與設定讀取 ]
 # ==========================================================
@@ -51,9 +53,8 @@ def run_multi_dish_monitor():
     parameters = aruco.DetectorParameters()
     detector = aruco.ArucoDetector(aruco_dict, parameters)
 
-    # 輸出規格 (從設定檔讀取)
-    W, H = cfg_data["dish_width"], cfg_data["dish_height"]
-    dst_pts = np.array([[0,0], [W-1,0], [W-1,H-1], [0,H-1]], dtype=np.float32)
+    # 每盤的 Homography 快取 (Marker 穩定時沿用，被遮住時備援)
+    warp_cache = dish_warp.HomographyCache(cfg_data)
 
     # 盤子配置
     dish_configs = cfg_data["dishes"]
@@ -73,38 +74,41 @@ def run_multi_dish_monitor():
         
         ready_to_save = {}
 
+        # 建立 ID 中心座標索引
+        marker_centers = dish_warp.marker_centers_from(corners, ids)
+
+        # 先校正再畫標記與框線，存下來的盤子影像不會帶到框線
+        overlays = []
+        missing_notes = []
+        warped_all = warp_cache.warp_all(frame, marker_centers)
+        for name, cfg in dish_configs.items():
+            target_ids = cfg['ids']
+            color = cfg['color']
+
+            warped, state, entry = warped_all[name]
+            if warped is not None:
+                ready_to_save[name] = warped
+                overlays.append((entry["src"], color, f"{name} {state}", 3 if state == "OK" else 1))
+            elif any(tid in marker_centers for tid in target_ids):
+                # 顯示缺漏提示
+                missing = [tid for tid in target_ids if tid not in marker_centers]
+                first_found = next(tid for tid in target_ids if tid in marker_centers)
+                missing_notes.append((f"{name} Missing:{missing}", marker_centers[first_found]))
+
+        # 繪製偵測到的標記 (選配)
         if ids is not None:
-            # 建立 ID 中心座標索引
-            marker_centers = {int(mid[0]): np.mean(c[0], axis=0) for c, mid in zip(corners, ids)}
-            
-            # 繪製偵測到的標記 (選配)
             aruco.drawDetectedMarkers(frame, corners, ids)
 
-            for name, cfg in dish_configs.items():
-                target_ids = cfg['ids']
-                color = cfg['color']
-                
-                if all(tid in marker_centers for tid in target_ids):
-                    src_pts = np.array([marker_centers[tid] for tid in target_ids], dtype=np.float32)
-                    
-                    # 繪製盤子邊框
-                    pts_display = src_pts.astype(np.int32).reshape((-1, 1, 2))
-                    cv2.polylines(frame, [pts_display], True, color, 3)
-                    cv2.putText(frame, f"{name} OK", (int(src_pts[0][0]), int(src_pts[0][1]-15)), 
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-                    
-                    # 執行透視校正
-                    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-                    warped = cv2.warpPerspective(frame, M, (W, H))
-                    ready_to_save[name] = warped
-                else:
-                    # 顯示缺漏提示
-                    missing = [tid for tid in target_ids if tid not in marker_centers]
-                    if any(tid in marker_centers for tid in target_ids):
-                        first_found = next(tid for tid in target_ids if tid in marker_centers)
-                        fx, fy = marker_centers[first_found]
-                        cv2.putText(frame, f"{name} Missing:{missing}", (int(fx), int(fy+30)),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+        for text, (fx, fy) in missing_notes:
+            cv2.putText(frame, text, (int(fx), int(fy+30)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 1)
+
+        # 繪製盤子邊框
+        for src_pts, color, label, thickness in overlays:
+            pts_display = src_pts.astype(np.int32).reshape((-1, 1, 2))
+            cv2.polylines(frame, [pts_display], True, color, thickness)
+            cv2.putText(frame, label, (int(src_pts[0][0]), int(src_pts[0][1]-15)), 
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
 
         # 顯示縮放後的預覽畫面
         preview = cv2.resize(frame, (1024, 768))
@@ -0,0 +1,142 @@
+import os
+import csv
+from collections import deque
+import numpy as np
+
+import tile_archive
+import germination_detector
+import emergence_detector
+
+# ==========================================================
+# [ 擷取迴圈內即時判定 (auto_timelapse_monitor --online-detect) ]
+# 每次擷取後直接從校正後的盤子影像切出各種子 / 穴孔，更新一小份滾動狀態：
+#   種子 (GerminationTracker)：前 baseline_frames 張累加成基準，之後只保留
+#                              「連續成立張數」與該段的起始時間
+#   穴孔 (EmergenceTracker)  ：最近 persist 張的幼苗數，取最小值即為穩定株數
+# 每顆種子 / 每個穴孔每張影像只做固定量的計算，不需要回頭掃描歷史影像。
+# 判定門檻與離線版 germination_detector / emergence_detector 共用同一份 CONFIG。
+# 事件寫入 analysis_results/online_events.csv。
+# ==========================================================
+EVENTS_NAME = "online_events.csv"
+EVENT_FIELDS = ["timestamp", "dish", "series", "event", "value"]
+
+def _stack_tiles(dish_img, regions):
+    return np.stack([tile_archive.extract_tile(dish_img, box) for _, box in regions])
+
+class GerminationTracker:
+    def __init__(self, dish_label, regions, params=None):
+        self.dish = dish_label
+        self.regions = list(regions)
+        self.names = [name for name, _ in self.regions]
+        self.params = params or germination_detector.CONFIG
+        n = len(self.regions)
+        self.n_seen = 0
+        self.base_sum = None              # 基準影像累加 (n, h, w)
+        self.base_area = np.zeros(n)
+        self.base_elong = np.zeros(n)
+        self.run = np.zeros(n, dtype=np.int32)
+        self.run_start = [None] * n
+        self.done = np.zeros(n, dtype=bool)
+
+    def mark_done(self, series_name):
+        if series_name in self.names:
+            self.done[self.names.index(series_name)] = True
+
+    def update(self, timestamp, dish_img):
+        """回傳本張影像新產生的事件 [(series, event, value)]"""
+        p = self.params
+        norm = germination_detector.normalized_gray(_stack_tiles(dish_img, self.regions))
+        area, elong = germination_detector.shape_features(np.abs(norm) > p["fg_delta"])
+
+        # 基準期：只累加，不判定 (離線版取中位數，這裡以平均數近似)
+        k = p["baseline_frames"]
+        if self.n_seen < k:
+            self.base_sum = norm if self.base_sum is None else self.base_sum + norm
+            self.base_area += area
+            self.base_elong += elong
+            self.n_seen += 1
+            return []
+
+        baseline = self.base_sum / k
+        base_area = np.maximum(self.base_area / k, 1.0)
+        base_elong = self.base_elong / k
+        change = (np.abs(norm - baseline) > p["diff_delta"]).mean(axis=(1, 2))
+        cond = (change >= p["change_min"]) & (
+            (area >= base_area * p["area_ratio"]) | (elong >= base_elong + p["elong_delta"]))
+
+        events = []
+        for i in np.flatnonzero(cond & (self.run == 0)):
+            self.run_start[i] = timestamp
+        self.run = np.where(cond, self.run + 1, 0)
+        for i in np.flatnonzero((self.run >= p["persist"]) & ~self.done):
+            self.done[i] = True
+            events.append((self.names[i], "germination", self.run_start[i]))
+        return events
+
+class EmergenceTracker:
+    def __init__(self, dish_label, regions, params=None):
+        self.dish = dish_label
+        self.regions = list(regions)
+        self.names = [name for name, _ in self.regions]
+        self.params = params or emergence_detector.CONFIG
+        self.window = deque(maxlen=self.params["persist"])  # [(timestamp, 各穴孔幼苗數)]
+        self.emitted = np.zeros(len(self.regions), dtype=np.int32)
+
+    def mark_done(self, series_name, count):
+        if series_name in self.names:
+            i = self.names.index(series_name)
+            self.emitted[i] = max(self.emitted[i], count)
+
+    def update(self, timestamp, dish_img):
+        p = self.params
+        masks = emergence_detector.green_masks(_stack_tiles(dish_img, self.regions), p)
+        self.window.append((timestamp, emergence_detector.count_blobs(masks, p["min_blob_area"])))
+        if len(self.window) < self.window.maxlen:
+            return []
+
+        stable = np.min([c for _, c in self.window], axis=0)
+        start_ts = self.window[0][0]
+        events = []
+        for i in np.flatnonzero(stable > self.emitted):
+            for k in range(self.emitted[i] + 1, min(stable[i], p["seeds_per_cell"]) + 1):
+                events.append((self.names[i], f"emergence_{k}", start_ts))
+            self.emitted[i] = stable[i]
+        return events
+
+# ==========================================================
+# [ 事件紀錄 ]
+# ==========================================================
+class EventLog:
+    def __init__(self, analysis_dir):
+        os.makedirs(analysis_dir, exist_ok=True)
+        self.path = os.path.join(analysis_dir, EVENTS_NAME)
+        self.previous = []
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8', newline='') as f:
+                self.previous = list(csv.DictReader(f))
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, 'a', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(EVENT_FIELDS)
+            self.file.flush()
+
+    def restore(self, trackers):
+        """程式重啟時，已記錄過的事件不再重複發出"""
+        for row in self.previous:
+            tracker = trackers.get(row["dish"])
+            if tracker is None:
+                continue
+            if row["event"] == "germination" and isinstance(tracker, GerminationTracker):
+                tracker.mark_done(row["series"])
+            elif row["event"].startswith("emergence_") and isinstance(tracker, EmergenceTracker):
+                tracker.mark_done(row["series"], int(row["event"].split("_")[1]))
+
+    def write(self, timestamp, dish_label, events):
+        for series_name, event, value in events:
+            self.writer.writerow([timestamp, dish_label, series_name, event, value])
+        if events:
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
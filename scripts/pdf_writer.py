@@ -0,0 +1,335 @@
+import os
+import io
+import json
+from PIL import Image
+
+# ==========================================================
+# [ 串流式 PDF 寫入 ]
+# montages_to_pdf / cell_montages_to_pdf 共用。
+# 原本先把所有大圖解碼成 PIL 影像放進 all_pages 再一次存檔，30 顆種子 x 14 天 = 420 張
+# 全尺寸畫布同時留在記憶體，Pi 上會記憶體不足。這裡改為每加入一頁就立刻把該頁的
+# 影像 / 內容 / 頁面物件寫進檔案，只記住每個物件的位移；頁面樹 (Pages) 與 xref 在最後補上。
+# 記憶體用量固定為「一頁」，與頁數無關。
+#
+# 每頁是一張大圖，頁面大小 = 影像像素 (72 dpi，與 PIL 存 PDF 的預設相同)。
+# 大圖本身就是 JPEG，直接把檔案位元組當作 DCTDecode 影像串流嵌入 (不解碼、不重新壓縮)，
+# 只讀 JPEG 標頭取得尺寸與色版數；PDF 內的影像與大圖檔逐位元相同，產生報告幾乎只剩檔案 I/O。
+# 不是一般 JPEG (PNG、算術編碼、CMYK 等) 時才退回解碼後以 JPEG_QUALITY 重新壓縮。
+# ==========================================================
+JPEG_QUALITY = 85
+
+# 可直接嵌入的 SOF 類型：baseline / extended / progressive (Huffman 編碼)
+_SOF_PASSTHROUGH = {0xC0, 0xC1, 0xC2}
+_SOF_OTHER = {0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_COLOR_SPACES = {1: "DeviceGray", 3: "DeviceRGB"}
+
+def _pdf_number(value):
+    return str(int(value)) if float(value).is_integer() else f"{value:.4f}"
+
+def jpeg_info(data):
+    """
+    只解析 JPEG 標頭，回傳 (寬, 高, 色版數)。
+    不是可直接嵌入 PDF 的 JPEG (非 JPEG、不完整、算術編碼、非 8 bit、色版數不支援) 回傳 None。
+    """
+    if data[:2] != b"\xff\xd8" or not data.rstrip(b"\x00").endswith(b"\xff\xd9"):
+        return None  # 不是 JPEG，或檔案不完整 (寫到一半)
+    i, n = 2, len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:          # 填充位元組
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:   # 沒有長度欄位的標記
+            i += 2
+            continue
+        if marker in (0xD9, 0xDA):  # 影像結束 / 掃描開始之前都沒有遇到 SOF
+            return None
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        if marker in _SOF_PASSTHROUGH:
+            if i + 10 > n or data[i + 4] != 8:
+                return None
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            components = data[i + 9]
+            if width == 0 or height == 0 or components not in _COLOR_SPACES:
+                return None
+            return width, height, components
+        if marker in _SOF_OTHER:
+            return None
+        i += 2 + length
+    return None
+
+class StreamingPDFWriter:
+    """
+    with StreamingPDFWriter(path) as pdf:
+        pdf.add_image_page(img_path)
+    先寫入 path + ".tmp"，close() 成功後才換成正式檔名，中途失敗不會留下半個 PDF。
+    """
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(self.tmp_path, 'wb')
+        self.offsets = {}          # 物件編號 -> 檔案位移 (本次寫入的物件)
+        self.page_ids = []
+        self.reencoded = 0         # 無法直接嵌入、重新壓縮的頁數
+        self.next_id = self.PAGES_ID + 1
+        self.prev_xref = None      # 增量更新時，上一版 xref 的位置
+        self.base_size = 0
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    @classmethod
+    def open_append(cls, path, next_id, prev_xref):
+        """
+        以 PDF 增量更新 (incremental update) 開啟本類別寫出的既有 PDF：
+        新物件接在檔尾，close() 時補上新的頁面樹與只列出新物件的 xref (以 /Prev 串接舊的)。
+        原有內容一個位元組都不動，中途失敗會截回原本的長度。
+        """
+        self = cls.__new__(cls)
+        self.path = path
+        self.tmp_path = None
+        self.file = open(path, 'r+b')
+        self.file.seek(0, os.SEEK_END)
+        self.base_size = self.file.tell()
+        self.offsets = {}
+        self.page_ids = []
+        self.reencoded = 0
+        self.next_id = next_id
+        self.prev_xref = prev_xref
+        return self
+
+    # ------------------------------------------------------
+    # 物件寫入
+    # ------------------------------------------------------
+    def _alloc(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+
+    def _write_object(self, obj_id, body):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n".encode("ascii") + body + b"\nendobj\n")
+
+    def _write_stream(self, obj_id, header, data):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n<< {header} /Length {len(data)} >>\nstream\n".encode("ascii"))
+        self.file.write(data)
+        self.file.write(b"\nendstream\nendobj\n")
+
+    # ------------------------------------------------------
+    # 頁面
+    # ------------------------------------------------------
+    def _encode_page_image(self, img_path):
+        """解碼單張大圖並重新壓成 JPEG，回傳 (JPEG bytes, 寬, 高)"""
+        with Image.open(img_path) as img:
+            rgb = img.convert('RGB')
+            buf = io.BytesIO()
+            rgb.save(buf, format='JPEG', quality=JPEG_QUALITY)
+            return buf.getvalue(), rgb.width, rgb.height
+
+    def add_jpeg_page(self, jpeg_data, width, height, color_space="DeviceRGB"):
+        """以一段 JPEG 資料 (DCTDecode) 新增一頁，回傳頁面物件編號"""
+        image_id, content_id, page_id = self._alloc(), self._alloc(), self._alloc()
+        self._write_stream(image_id,
+                           f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                           f"/ColorSpace /{color_space} /BitsPerComponent 8 /Filter /DCTDecode",
+                           jpeg_data)
+        w, h = _pdf_number(width), _pdf_number(height)
+        self._write_stream(content_id, "", f"q {w} 0 0 {h} 0 0 cm /Im0 Do Q".encode("ascii"))
+        self._write_object(page_id,
+                           f"<< /Type /Page /Parent {self.PAGES_ID} 0 R /MediaBox [0 0 {w} {h}] "
+                           f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> "
+                           f"/Contents {content_id} 0 R >>".encode("ascii"))
+        self.page_ids.append(page_id)
+        return page_id
+
+    def add_image_page(self, img_path):
+        """以一張大圖新增一頁 (回傳頁面物件編號)：JPEG 直接嵌入原始位元組，其他格式解碼後重新壓縮"""
+        with open(img_path, 'rb') as f:
+            data = f.read()
+        info = jpeg_info(data)
+        if info is not None:
+            width, height, components = info
+            return self.add_jpeg_page(data, width, height, _COLOR_SPACES[components])
+        data, width, height = self._encode_page_image(img_path)
+        self.reencoded += 1
+        return self.add_jpeg_page(data, width, height)
+
+    # ------------------------------------------------------
+    # 結尾：頁面樹、目錄、xref
+    # ------------------------------------------------------
+    def close(self, kids=None):
+        """
+        寫出頁面樹與 xref，回傳本次 xref 的位置 (下次增量更新的 /Prev)。
+        kids: 頁面物件編號的最終順序，預設為加入順序；增量更新時需包含舊頁面。
+        """
+        if self.file is None:
+            return None
+        kids = self.page_ids if kids is None else kids
+        kids_str = " ".join(f"{pid} 0 R" for pid in kids)
+        self._write_object(self.PAGES_ID, f"<< /Type /Pages /Kids [{kids_str}] /Count {len(kids)} >>".encode("ascii"))
+        if self.prev_xref is None:
+            self._write_object(self.CATALOG_ID, f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>".encode("ascii"))
+
+        # xref：只列出本次寫入的物件，依連續編號分段；完整寫入時第 0 號為固定的空項目
+        xref_pos = self.file.tell()
+        ids = sorted(self.offsets)
+        lines = ["xref\n"]
+        if self.prev_xref is None:
+            lines.append("0 1\n0000000000 65535 f \n")
+        start = 0
+        for k in range(1, len(ids) + 1):
+            if k == len(ids) or ids[k] != ids[k - 1] + 1:
+                lines.append(f"{ids[start]} {k - start}\n")
+                lines.extend(f"{self.offsets[obj_id]:010d} 00000 n \n" for obj_id in ids[start:k])
+                start = k
+        prev = f" /Prev {self.prev_xref}" if self.prev_xref is not None else ""
+        lines.append(f"trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R{prev} >>\n"
+                     f"startxref\n{xref_pos}\n%%EOF\n")
+        self.file.write("".join(lines).encode("ascii"))
+        self.file.close()
+        self.file = None
+        if self.tmp_path is not None:
+            os.replace(self.tmp_path, self.path)
+        return xref_pos
+
+    def abort(self):
+        """放棄這次寫入：新檔直接刪除，增量更新則截回原本的長度"""
+        if self.file is None:
+            return
+        if self.tmp_path is None:
+            self.file.truncate(self.base_size)
+            self.file.close()
+        else:
+            self.file.close()
+            os.remove(self.tmp_path)
+        self.file = None
+
+    @property
+    def page_count(self):
+        return len(self.page_ids)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+# ==========================================================
+# [ 增量報告 ]
+# 每份報告旁邊有一個 <報告>_pages.json，記錄每張大圖的 (大小, 修改時間) 與對應的頁面物件。
+# 重跑時只把新增或重畫過的大圖以增量更新附加到 PDF 尾端，再寫一份新的頁面樹決定頁序
+# (新的一天仍會排在該種子 / 穴孔的位置，而不是整份報告最後)；成本只與新資料量有關。
+# 重畫或移除的大圖，舊頁面會留在檔案裡但不再被引用；這類頁面累積超過
+# ORPHAN_RATIO 或使用 --rebuild 時整份重新產生。
+# PDF 長度與紀錄不符 (被其他程式改過、上次寫到一半) 時也會整份重建。
+# ==========================================================
+STATE_VERSION = 1
+ORPHAN_RATIO = 0.25
+
+def _state_path(pdf_path):
+    return os.path.splitext(pdf_path)[0] + "_pages.json"
+
+def _file_signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+def _load_state(pdf_path):
+    path = _state_path(pdf_path)
+    if not os.path.exists(path) or not os.path.exists(pdf_path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != STATE_VERSION or state.get("pdf_size") != os.path.getsize(pdf_path):
+        return None
+    return state
+
+def _save_state(pdf_path, state):
+    state["version"] = STATE_VERSION
+    state["pdf_size"] = os.path.getsize(pdf_path)
+    path = _state_path(pdf_path)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _remove_report(pdf_path):
+    """沒有任何可用頁面時移除既有的報告與頁面紀錄，不留下 0 頁或過期的 PDF"""
+    for path in (pdf_path, _state_path(pdf_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+def _add_pages(pdf, montage_paths, keys, pages):
+    """逐張加入頁面並記錄到 pages；無法讀取的大圖印出警告後略過"""
+    for img_path, key in zip(montage_paths, keys):
+        try:
+            page_id = pdf.add_image_page(img_path)
+        except Exception as e:
+            print(f"  ! 無法開啟影像 {img_path}: {e}")
+            pages.pop(key, None)
+            continue
+        pages[key] = {"sig": _file_signature(img_path), "page": page_id}
+
+def update_report(pdf_path, montage_paths, rebuild=False):
+    """
+    讓 pdf_path 的內容等於 montage_paths (已依報告順序排好)。
+    回傳 {"mode": "rebuild" | "append" | "unchanged", "pages": 總頁數, "added": 本次寫入頁數,
+          "reencoded": 重新壓縮頁數}；沒有任何可用影像時 pages 為 0，不產生檔案並移除既有的報告。
+    """
+    base_dir = os.path.dirname(pdf_path)
+    keys = [os.path.relpath(p, base_dir) for p in montage_paths]
+    state = None if rebuild else _load_state(pdf_path)
+
+    if state is not None:
+        pages = state["pages"]
+        wanted = set(keys)
+        todo = [(p, k) for p, k in zip(montage_paths, keys)
+                if k not in pages or pages[k]["sig"] != _file_signature(p)]
+        removed = [k for k in pages if k not in wanted]
+        orphans = state.get("orphans", 0) + len(removed) + sum(1 for _, k in todo if k in pages)
+        if orphans > ORPHAN_RATIO * max(len(keys), 1):
+            state = None  # 廢棄頁面太多，整份重建順便壓縮檔案
+
+    if state is None:
+        pages = {}
+        with StreamingPDFWriter(pdf_path) as pdf:
+            _add_pages(pdf, montage_paths, keys, pages)
+            kids = [pages[k]["page"] for k in keys if k in pages]
+            if not kids:
+                pdf.abort()
+                _remove_report(pdf_path)
+                return {"mode": "rebuild", "pages": 0, "added": 0, "reencoded": pdf.reencoded}
+            xref = pdf.close(kids)
+        _save_state(pdf_path, {"next_id": pdf.next_id, "startxref": xref, "orphans": 0, "pages": pages})
+        return {"mode": "rebuild", "pages": len(kids), "added": len(kids), "reencoded": pdf.reencoded}
+
+    if not todo and not removed:
+        return {"mode": "unchanged", "pages": len(pages), "added": 0, "reencoded": 0}
+
+    for k in removed:
+        del pages[k]
+    pdf = StreamingPDFWriter.open_append(pdf_path, state["next_id"], state["startxref"])
+    try:
+        _add_pages(pdf, [p for p, _ in todo], [k for _, k in todo], pages)
+        kids = [pages[k]["page"] for k in keys if k in pages]
+        if not kids:
+            pdf.abort()
+            _remove_report(pdf_path)
+            return {"mode": "append", "pages": 0, "added": 0, "reencoded": pdf.reencoded}
+        xref = pdf.close(kids)
+    except BaseException:
+        pdf.abort()
+        raise
+    _save_state(pdf_path, {"next_id": pdf.next_id, "startxref": xref, "orphans": orphans, "pages": pages})
+    return {"mode": "append", "pages": len(kids), "added": pdf.page_count, "reencoded": pdf.reencoded}
@@ -1,8 +1,18 @@
 import os
+import re
 import glob
+import argparse
 from datetime import datetime
 from PIL import Image, ImageDraw, ImageFont
 import math
+import functools
+import numpy as np
+
+import tile_archive
+import frame_catalog
+import montage_engine
+import tile_pyramid
+import keyframe_selector
 
 # ==========================================================
 # [ 篩選與路徑設定 ]
@@ -17,6 +27,11 @@ import math
 # }
 # 範例 2: 全部提取
 # FILTER_CONFIG = { "start": None, "end": None }
+#
+# 也可以在命令列指定 (優先於此處設定)，並限定 Dish / 種子:
+#   python3 scripts/seed_lifecycle_montage.py --dish Dish_B --seed seed_07 \
+#       --start "2026-02-24 08:00" --end "2026-02-26 20:00"
+# 時間範圍以索引查詢 (型錄主鍵 / 封存檔排序時間索引 + 二分搜尋)，只讀出範圍內的照片
 # ----------------------------------------------------------
 FILTER_CONFIG = {
     "start": None,  # 請依範例修改，例如 "20260224_000000"
@@ -26,72 +41,160 @@ FILTER_CONFIG = {
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INPUT_BASE_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "time_series_crops")
 OUTPUT_BASE_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "lifecycle_montages")
+# --pyramid：圖磚金字塔與瀏覽器 (與每日大圖共用)；分頁的大圖由上而下接成同一個金字塔
+PYRAMID_DIR = os.path.join(PROJECT_ROOT, "temp_data", "exp1_dish", "pyramids")
 
 # 字型路徑 (Linux 普通路徑)
 FONT_PATHS = ["/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"]
 
+@functools.lru_cache(maxsize=None)
 def get_font(size):
     for path in FONT_PATHS:
         if os.path.exists(path): return ImageFont.truetype(path, size)
     return ImageFont.load_default()
 
-def create_lifecycle_montage(dish, seed, filtered_images):
+# ==========================================================
+# [ 版面 ]
+# 拍攝間隔縮短後一粒種子可能有上萬張照片，全部放在一張圖上會超過 45,000 px 高、
+# 吃掉數 GB 記憶體。因此每張大圖最多 MAX_ROWS_PER_SHEET 列，超過就分成
+# {seed}_lifecycle_p01.jpg, _p02.jpg ... 多張，每張畫布大小固定，記憶體用量與照片數無關。
+# 張數只有一張時檔名與版面維持原樣 ({seed}_lifecycle.jpg)。
+# ==========================================================
+CELL_W, CELL_H = 64, 64
+PADDING_X, PADDING_Y = 6, 12 # 垂直間距加大以容納日期文字
+TEXT_HEIGHT = 20
+HEADER_HEIGHT = 100
+MARGIN_X, MARGIN_Y = 40, 40
+MAX_ROWS_PER_SHEET = 40
+BG_COLOR = (20, 20, 20)
+
+def layout_cols(n):
+    """計算最佳佈局 (目標寬度約為 18~24 欄，呈現橫式)"""
+    cols = 20 if n > 20 else n
+    if n > 100: cols = 24
+    if n > 300: cols = 30
+    return cols
+
+def paginate(frames):
     """
-    將單一粒種子的照片序列合成為一張橫式生命週期大圖
+    依總張數決定欄數，再每 cols x MAX_ROWS_PER_SHEET 張切成一頁。
+    回傳 [(page, 該頁照片, cols)]；只有一頁時 page 為 None。
+    每頁只依自己的照片排版，之後新增的照片只會影響最後一頁 (前面的頁可由建置快取略過)。
+    """
+    cols = layout_cols(len(frames))
+    per_sheet = cols * MAX_ROWS_PER_SHEET
+    if len(frames) <= per_sheet:
+        return [(None, frames, cols)]
+    return [(i // per_sheet + 1, frames[i:i + per_sheet], cols)
+            for i in range(0, len(frames), per_sheet)]
+
+@functools.lru_cache(maxsize=None)
+def layout_template(canvas_w, canvas_h):
+    """同一尺寸的大圖共用的空白底圖 (每種 cols x rows 只建立一次)"""
+    return Image.new('RGB', (canvas_w, canvas_h), BG_COLOR)
+
+@functools.lru_cache(maxsize=4096)
+def label_mask(label):
+    """
+    預先畫好的標籤字形遮罩，回傳 (遮罩, 相對文字原點的偏移)。
+    同一個 HH:MM / 日期標籤只交給 FreeType 畫一次，之後以遮罩貼上顏色，結果與 draw.text 相同
+    (日期標籤比一格寬，會蓋到下一格的範圍，所以不能直接貼不透明的小圖)。
+    """
+    font = get_font(12)
+    left, top, right, bottom = font.getbbox(label)
+    ox, oy = min(left, 0), min(top, 0)
+    mask = Image.new('L', (right - ox, bottom - oy), 0)
+    ImageDraw.Draw(mask).text((-ox, -oy), label, font=font, fill=255)
+    return mask, (ox, oy)
+
+def montage_path(dish, seed, page=None):
+    suffix = "" if page is None else f"_p{page:02d}"
+    return os.path.join(OUTPUT_BASE_DIR, dish, f"{seed}_lifecycle{suffix}.jpg")
+
+def stale_sheets(dish, seed, keep):
+    """這粒種子在輸出目錄中、不屬於本次分頁結果的舊大圖 (照片變少或篩選範圍改變時留下的)"""
+    name_re = re.compile(re.escape(seed) + r"_lifecycle(_p\d+)?\.jpg")
+    existing = glob.glob(os.path.join(OUTPUT_BASE_DIR, dish, f"{seed}_lifecycle*.jpg"))
+    return sorted(p for p in existing if name_re.fullmatch(os.path.basename(p)) and p not in keep)
+
+def create_lifecycle_montage(dish, seed, filtered_images, page=None, cols=None, backend="pil", total=None,
+                             time_range=None):
+    """
+    將單一粒種子的照片序列合成為一張橫式生命週期大圖 (分頁時為其中一頁，見 paginate)
+    filtered_images: [(timestamp, ref)]，ref 為 JPEG 路徑或封存檔位置 (見 tile_archive.py)
+    page           : 頁碼 (1 起算)，None 表示不分頁
+    cols           : 欄數 (分頁時各頁共用)，None 表示依張數計算
+    backend        : "pil" 逐格貼上 / "numpy" 整批寫入 (見 montage_engine.py)，輸出相同
+    total          : 挑選關鍵影格前的張數 (--keyframes)，標題會註明 "Keyframes: n / total"
+    time_range     : 標題顯示的篩選範圍 {"start", "end"}，None 表示 FILTER_CONFIG
     """
     n = len(filtered_images)
     if n == 0: return
 
     # 佈局參數
-    cell_w, cell_h = 64, 64
-    padding_x, padding_y = 6, 12 # 垂直間距加大以容納日期文字
-    text_height = 20
-    header_height = 100
-    margin_x, margin_y = 40, 40
-    
-    cw = cell_w + padding_x
-    ch = cell_h + padding_y + text_height
+    cell_w, cell_h = CELL_W, CELL_H
+    margin_x, margin_y = MARGIN_X, MARGIN_Y
+    header_height = HEADER_HEIGHT
     
-    # 計算最佳佈局 (目標寬度約為 18~24 欄，呈現橫式)
-    cols = 20 if n > 20 else n
-    if n > 100: cols = 24
-    if n > 300: cols = 30
+    cw = cell_w + PADDING_X
+    ch = cell_h + PADDING_Y + TEXT_HEIGHT
     
+    cols = cols or layout_cols(n)
     rows = math.ceil(n / cols)
     
     canvas_w = cols * cw + margin_x * 2
     canvas_h = rows * ch + margin_y * 2 + header_height
     
-    # 建立畫布
-    canvas = Image.new('RGB', (canvas_w, canvas_h), (20, 20, 20))
+    # 由共用底圖開始
+    canvas = layout_template(canvas_w, canvas_h).copy()
     draw = ImageDraw.Draw(canvas)
     
     # 標題
-    time_range_str = f"{FILTER_CONFIG['start'] or 'Full'} to {FILTER_CONFIG['end'] or 'Present'}"
     font_header = get_font(34)
-    draw.text((margin_x, margin_y), f"Seed Lifecycle: {dish} - {seed}", font=font_header, fill=(255, 255, 255))
-    draw.text((margin_x, margin_y + 45), f"Interval: {time_range_str} | Total Samples: {n}", font=get_font(20), fill=(200, 200, 200))
+    if total is None:
+        samples_str = f"Total Samples: {n}" if page is None else f"Samples: {n}"
+    else:
+        samples_str = f"Keyframes: {n} / {total}" if page is None else f"Keyframes: {n}"
+    if page is None:
+        time_range = time_range or FILTER_CONFIG
+        time_range_str = f"{time_range['start'] or 'Full'} to {time_range['end'] or 'Present'}"
+        draw.text((margin_x, margin_y), f"Seed Lifecycle: {dish} - {seed}", font=font_header, fill=(255, 255, 255))
+        draw.text((margin_x, margin_y + 45), f"Interval: {time_range_str} | {samples_str}", font=get_font(20), fill=(200, 200, 200))
+    else:
+        # 分頁時只標示本頁的範圍，新增照片不會改動前面各頁
+        time_range_str = f"{filtered_images[0][0]} to {filtered_images[-1][0]}"
+        draw.text((margin_x, margin_y), f"Seed Lifecycle: {dish} - {seed} (Sheet {page})", font=font_header, fill=(255, 255, 255))
+        draw.text((margin_x, margin_y + 45), f"Interval: {time_range_str} | {samples_str}", font=get_font(20), fill=(200, 200, 200))
+
+    # 繪製照片
+    if backend == "numpy":
+        arr = np.array(canvas)
+        grid = montage_engine.grid_view(arr, (margin_x, margin_y + header_height), rows, cols, (cw, ch))
+        failed = montage_engine.paste_tiles(grid, range(n), [ref for _, ref in filtered_images],
+                                            (cell_w, cell_h), Image.Resampling.BICUBIC)
+        montage_engine.fill_boxes(grid, failed, (cell_w, cell_h), (50, 0, 0))
+        canvas = Image.fromarray(arr)
+    else:
+        for i, (timestamp, img_path) in enumerate(filtered_images):
+            r, c = i // cols, i % cols
+            x = margin_x + c * cw
+            y = margin_y + header_height + r * ch
+            try:
+                canvas.paste(tile_archive.load_thumbnail(img_path, (cell_w, cell_h), Image.Resampling.BICUBIC), (x, y))
+            except:
+                draw.rectangle([x, y, x+cell_w, y+cell_h], fill=(50, 0, 0))
 
     last_date = ""
-    font_cell = get_font(12)
-    font_date_change = get_font(12)
 
-    for i, img_path in enumerate(filtered_images):
+    for i, (timestamp, img_path) in enumerate(filtered_images):
         r, c = i // cols, i % cols
         x = margin_x + c * cw
         y = margin_y + header_height + r * ch
         
         # 處理日期與時間
-        fname = os.path.basename(img_path) # YYYYMMDD_HHMMSS.jpg
+        fname = timestamp # YYYYMMDD_HHMMSS
         date_part = fname[4:8] # MMDD
         time_part = f"{fname[9:11]}:{fname[11:13]}" # HH:MM
-        
-        # 繪製照片
-        try:
-            with Image.open(img_path) as img:
-                canvas.paste(img.resize((cell_w, cell_h)), (x, y))
-        except:
-            draw.rectangle([x, y, x+cell_w, y+cell_h], fill=(50, 0, 0))
 
         # 繪製文字標籤 (若日期更換則顯示月日)
         label = time_part
@@ -101,42 +204,97 @@ def create_lifecycle_montage(dish, seed, filtered_images):
             fill_color = (0, 255, 255) # 日期更換點用青色標記
             last_date = date_part
         
-        draw.text((x + 2, y + cell_h + 4), label, font=font_cell, fill=fill_color)
+        mask, (ox, oy) = label_mask(label)
+        canvas.paste(fill_color, (x + 2 + ox, y + cell_h + 4 + oy), mask)
 
     # 儲存
-    output_dir = os.path.join(OUTPUT_BASE_DIR, dish)
-    os.makedirs(output_dir, exist_ok=True)
-    save_path = os.path.join(output_dir, f"{seed}_lifecycle.jpg")
+    save_path = montage_path(dish, seed, page)
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
     canvas.save(save_path, quality=85)
-    print(f"  > 已生成生命週期圖: {save_path}")
+    return save_path
 
-def run_lifecycle_generator():
+def run_lifecycle_generator(workers=None, force=False, backend="pil", pyramid=False, keyframes=None,
+                            dish_names=None, seed_names=None, start=None, end=None):
+    """
+    dish_names / seed_names: 只處理指定的 Dish / 種子 (None 表示全部)
+    start / end            : 時間範圍 (YYYYMMDD_HHMMSS，含端點)，None 時沿用 FILTER_CONFIG
+    """
     print("="*60)
     print("      咸豐草實驗：單一種子全生命週期大圖生成器")
     print("="*60)
     
+    time_range = {"start": start or FILTER_CONFIG["start"], "end": end or FILTER_CONFIG["end"]}
     dishes = sorted([d for d in os.listdir(INPUT_BASE_DIR) if os.path.isdir(os.path.join(INPUT_BASE_DIR, d))])
     
+    # 先收集每粒種子時間範圍內的照片 (以索引直接查詢範圍，不必列出整段序列再比對)
+    series = {}
     for dish in dishes:
-        if dish not in ["Dish_A", "Dish_B", "Dish_C", "Dish_D"]: continue
+        if dish not in (dish_names or ["Dish_A", "Dish_B", "Dish_C", "Dish_D"]): continue
         
         dish_path = os.path.join(INPUT_BASE_DIR, dish)
-        seeds = sorted([s for s in os.listdir(dish_path) if os.path.isdir(os.path.join(dish_path, s))])
+        seeds = tile_archive.list_series(dish_path)
+        if seed_names:
+            seeds = [s for s in seeds if s in seed_names]
         
         print(f"\n[處理] {dish}...")
         for seed in seeds:
-            all_imgs = sorted(glob.glob(os.path.join(dish_path, seed, "*.jpg")))
-            
-            # 過濾時間
-            filtered = []
-            for img_p in all_imgs:
-                ts = os.path.basename(img_p).split('.')[0] # YYYYMMDD_HHMMSS
-                if FILTER_CONFIG["start"] and ts < FILTER_CONFIG["start"]: continue
-                if FILTER_CONFIG["end"] and ts > FILTER_CONFIG["end"]: continue
-                filtered.append(img_p)
+            filtered = tile_archive.list_frames(dish_path, seed, time_range["start"], time_range["end"])
             
             if filtered:
-                create_lifecycle_montage(dish, seed, filtered)
+                series[(dish, seed)] = filtered
+
+    # --keyframes N：每粒種子只保留 N 張關鍵影格 (見 keyframe_selector.py)
+    selected = series
+    if keyframes:
+        named = keyframe_selector.select_many({f"{d}/{s}": f for (d, s), f in series.items()},
+                                              keyframes, OUTPUT_BASE_DIR, workers)
+        selected = {(d, s): named[f"{d}/{s}"] for d, s in series}
+
+    # 列出所有 (dish, seed, 頁) 工作，輸入沒變的略過，其餘交給多行程渲染
+    jobs, targets, groups = [], [], []
+    cache = montage_engine.BuildCache(OUTPUT_BASE_DIR)
+    code_sig = montage_engine.code_signature(__file__)
+    for (dish, seed), filtered in selected.items():
+        total = len(series[(dish, seed)]) if keyframes else None
+        # 照片太多時分成多頁，每頁是一個獨立工作 (只重畫有變動的頁)
+        sheets = paginate(filtered)
+        if len(sheets) > 1:
+            print(f"  > {seed}: {len(filtered)} 張照片，分成 {len(sheets)} 頁")
+        for page, sheet, cols in sheets:
+            jobs.append((dish, seed, sheet, page, cols, backend, total, time_range))
+            targets.append((montage_path(dish, seed, page),
+                            montage_engine.input_signature(code_sig, [dish, seed, time_range, page, cols, total], sheet)))
+        groups.append((f"lifecycle/{dish}/{seed}", [montage_path(dish, seed, page) for page, _, _ in sheets]))
+        for path in stale_sheets(dish, seed, [montage_path(dish, seed, page) for page, _, _ in sheets]):
+            os.remove(path)
+            print(f"  > 移除過期的大圖: {path}")
+
+    montage_engine.run_jobs(create_lifecycle_montage, jobs, workers, label="生命週期圖",
+                            cache=cache, targets=targets, force=force)
+
+    if pyramid:
+        tile_pyramid.build_pyramids(groups, PYRAMID_DIR, workers, force)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="咸豐草實驗：單一種子全生命週期大圖生成器")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="渲染使用的行程數 (預設為 CPU 核心數，1 為單行程)")
+    parser.add_argument("--force", action="store_true", help="忽略建置快取，全部重畫")
+    parser.add_argument("--backend", choices=montage_engine.BACKENDS, default="pil",
+                        help="排版方式：pil 逐格貼上 (預設) / numpy 整批寫入，輸出相同")
+    parser.add_argument("--keyframes", type=int, default=None, metavar="N",
+                        help="每粒種子只挑 N 張關鍵影格 (事件附近密集、靜止期稀疏)，預設全部")
+    parser.add_argument("--pyramid", action="store_true",
+                        help="另外產生可縮放瀏覽的圖磚金字塔與 viewer.html (見 tile_pyramid.py)")
+    parser.add_argument("--dish", nargs="+", default=None, help="只處理指定的 Dish，例如 Dish_B (預設 Dish_A~D)")
+    parser.add_argument("--seed", nargs="+", default=None, help="只處理指定的種子，例如 seed_07 (預設全部)")
+    parser.add_argument("--start", type=frame_catalog.start_arg, default=None,
+                        help="時間範圍起點，例如 20260224_080000 或 \"2026-02-24 08:00\" (預設 FILTER_CONFIG)")
+    parser.add_argument("--end", type=frame_catalog.end_arg, default=None,
+                        help="時間範圍終點 (含)，只給日期時包含當天整天 (預設 FILTER_CONFIG)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    run_lifecycle_generator()
+    args = parse_args()
+    run_lifecycle_generator(args.workers, args.force, args.backend, args.pyramid, args.keyframes,
+                            args.dish, args.seed, args.start, args.end)
@@ -5,6 +5,8 @@ import os
 import json
 import sys
 
+import dish_warp
+
 # ==========================================================
 # [ 腳本路徑與設定讀取 ]
 # ==========================================================
@@ -50,6 +52,9 @@ def run_calibrated_test():
     parameters = aruco.DetectorParameters()
     detector = aruco.ArucoDetector(aruco_dict, parameters)
 
+    # 每盤的 Homography 快取 (Marker 穩定時沿用，被遮住時備援)
+    warp_cache = dish_warp.HomographyCache(cfg_data)
+
     print("--- 單盤校正測試模式 (新版 OpenCV 語法) ---")
     print("本工具會顯示設定檔中『第一個』找到的完整盤子，並顯示校正結果。")
     print("按 's' 儲存校正影像，按 'q' 退出")
@@ -66,39 +71,34 @@ def run_calibrated_test():
         display_frame = frame.copy()
         warped_dish = None
         found_dish_name = ""
+        found_state = ""
 
+        # 建立 ID 中心索引
+        marker_centers = dish_warp.marker_centers_from(corners, ids)
         if ids is not None:
-            # 建立 ID 中心索引
-            marker_centers = {int(mid[0]): np.mean(c[0], axis=0) for c, mid in zip(corners, ids)}
             aruco.drawDetectedMarkers(display_frame, corners, ids)
 
-            for name, cfg in cfg_data["dishes"].items():
-                target_ids = cfg['ids']
-                color = cfg['color']
-                
-                if all(tid in marker_centers for tid in target_ids):
-                    src_pts = np.array([marker_centers[tid] for tid in target_ids], dtype=np.float32)
-                    
-                    # 取得該盤子應有的尺寸
-                    W = cfg.get("width", cfg_data["dish_width"])
-                    H = cfg.get("height", cfg_data["dish_height"])
-                    dst_pts = np.array([[0,0], [W-1,0], [W-1,H-1], [0,H-1]], dtype=np.float32)
-
-                    # 繪製框線
-                    pts_display = src_pts.astype(np.int32).reshape((-1, 1, 2))
-                    cv2.polylines(display_frame, [pts_display], True, color, 3)
-                    
-                    # 執行透視校正
-                    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-                    warped_dish = cv2.warpPerspective(frame, M, (W, H))
-                    found_dish_name = name
-                    
-                    # 僅顯示第一個找到的盤子
-                    break
+        for name, cfg in cfg_data["dishes"].items():
+            color = cfg['color']
+
+            # 執行透視校正 (盤子尺寸可在設定檔個別指定 width / height)
+            warped, state, entry = warp_cache.warp(frame, name, marker_centers)
+            if warped is None:
+                continue
+
+            # 繪製框線 (沿用快取時畫細線)
+            pts_display = entry["src"].astype(np.int32).reshape((-1, 1, 2))
+            cv2.polylines(display_frame, [pts_display], True, color, 3 if state == "OK" else 1)
+            warped_dish = warped
+            found_dish_name = name
+            found_state = state
+
+            # 僅顯示第一個找到的盤子
+            break
 
         if warped_dish is not None:
             cv2.imshow(f'Test View: {found_dish_name}', warped_dish)
-            cv2.putText(display_frame, f"Testing: {found_dish_name}", (30, 40), 
+            cv2.putText(display_frame, f"Testing: {found_dish_name} {found_state}", (30, 40), 
                         cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
         else:
             cv2.putText(display_frame, "Searching for dishes in config...", (30, 40), 
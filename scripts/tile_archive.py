@@ -0,0 +1,630 @@
+import os
+import sys
+import glob
+import json
+import bisect
+import argparse
+from collections import OrderedDict
+import numpy as np
+
+import frame_catalog
+
+# ==========================================================
+# [ 種子 / 穴孔切割封存檔 (Tile Archive) ]
+# 每個 Dish 一個封存目錄，取代 time_series_crops/<dish>/<seed>/<timestamp>.jpg 的大量小檔：
+#   time_series_crops/<dish>/_tiles/
+#       meta.json   : 磁磚尺寸與槽位名稱 (seed_01 ... / cell_01 ...)
+#       tiles.u8    : 未壓縮 BGR uint8，每列 = 同一時間點所有槽位 (n_slots, h, w, 3)
+#       valid.u8    : 每列每槽位 1 byte，標記該槽位是否真的寫入過
+#       index.csv   : 只增不改的「timestamp,row」紀錄 (同一時間點後寫覆蓋先寫)
+#       index.sorted: index.csv 依時間排序後的定寬二進位快照 (見 TimeIndex)，可直接 memmap
+# tiles.u8 可直接 np.memmap，讀取某顆種子的整段序列不需要掃描目錄。
+# ==========================================================
+ARCHIVE_DIRNAME = "_tiles"
+
+# ==========================================================
+# [ 時間索引 ]
+# 開啟封存檔時不再讀完整份 index.csv 建字典再排序 (20 萬筆約 0.7 秒)，而是 memmap 排序好的快照：
+#   index.sorted = header (magic | 已納入的 index.csv 位元組數 | 筆數 n | 最大列號)
+#                  + ts  (n x 15 bytes，YYYYMMDD_HHMMSS，依時間排序)
+#                  + row (n x int64) + ver (n x uint32，該時間點被寫入的次數)
+# 快照之後 index.csv 新增的尾段 (tail) 另外讀進記憶體。
+# 查詢時在快照上二分搜尋 (np.searchsorted 只碰到 log n 個分頁)，再合併尾段：O(log n + k)。
+# 尾段超過 COMPACT_MIN 筆 (開啟時) 或寫入端 close() 時重寫快照；
+# 快照只是衍生資料，遺失或與 index.csv 不符時會由 index.csv 重建。
+# ==========================================================
+INDEX_MAGIC = b"TSIDX001"
+INDEX_HEADER = np.dtype([("magic", "S8"), ("covered", "<u8"), ("n", "<u8"), ("max_row", "<i8")])
+TS_BYTES = 15
+COMPACT_MIN = 1024
+
+class TimeIndex:
+    def __init__(self, archive_dir):
+        self.csv_path = os.path.join(archive_dir, "index.csv")
+        self.path = os.path.join(archive_dir, "index.sorted")
+        self._open()
+        if len(self.tail) > COMPACT_MIN:
+            self.compact()
+
+    def _open(self):
+        csv_size = os.path.getsize(self.csv_path) if os.path.exists(self.csv_path) else 0
+        self.ts = np.zeros(0, dtype=f"S{TS_BYTES}")
+        self.row = np.zeros(0, dtype=np.int64)
+        self.ver = np.zeros(0, dtype=np.uint32)
+        self.max_row = -1
+        covered = 0
+        header = self._read_header()
+        if header is not None and header["covered"] <= csv_size:
+            n = int(header["n"])
+            ts_size = -(-n * TS_BYTES // 8) * 8  # 補齊到 8 的倍數，讓 row 陣列對齊
+            if os.path.getsize(self.path) == INDEX_HEADER.itemsize + ts_size + n * 12:
+                covered, self.max_row = int(header["covered"]), int(header["max_row"])
+                if n:
+                    offset = INDEX_HEADER.itemsize
+                    self.ts = np.memmap(self.path, dtype=f"S{TS_BYTES}", mode='r', offset=offset, shape=(n,))
+                    self.row = np.memmap(self.path, dtype="<i8", mode='r', offset=offset + ts_size, shape=(n,))
+                    self.ver = np.memmap(self.path, dtype="<u4", mode='r', offset=offset + ts_size + n * 8, shape=(n,))
+        self.covered = covered
+        self.tail = {}        # 快照之後的紀錄: ts -> [row, 寫入次數]
+        self._tail_keys = None
+        self.csv_bytes = covered
+        self._read_tail(covered, csv_size)
+
+    def _read_header(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < INDEX_HEADER.itemsize:
+            return None
+        header = np.fromfile(self.path, dtype=INDEX_HEADER, count=1)[0]
+        return header if header["magic"] == INDEX_MAGIC else None
+
+    def _read_tail(self, start, end):
+        if end <= start:
+            return
+        with open(self.csv_path, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        # 只處理完整的行：寫入端可能正寫到一半
+        data = data[:data.rfind(b"\n") + 1]
+        for line in data.decode("ascii").splitlines():
+            parts = line.strip().split(',')
+            if len(parts) >= 2:
+                self.add(parts[0], int(parts[1]), 0)
+        self.csv_bytes = start + len(data)
+
+    def add(self, timestamp, row, nbytes):
+        """記錄一筆新寫入 (nbytes: 這筆在 index.csv 佔的位元組數)"""
+        entry = self.tail.get(timestamp)
+        self.tail[timestamp] = [row, (entry[1] if entry else 0) + 1]
+        self.max_row = max(self.max_row, row)
+        self.csv_bytes += nbytes
+        self._tail_keys = None
+
+    def _find(self, timestamp):
+        """快照中該時間點的位置，沒有時回傳 None"""
+        key = timestamp.encode("ascii")
+        i = int(np.searchsorted(self.ts, key))
+        return i if i < len(self.ts) and self.ts[i] == key else None
+
+    def lookup(self, timestamp):
+        """時間點對應的列號，沒有時回傳 None"""
+        if timestamp in self.tail:
+            return self.tail[timestamp][0]
+        i = self._find(timestamp)
+        return None if i is None else int(self.row[i])
+
+    def version(self, timestamp):
+        """時間點被寫入 (commit) 的次數，重切覆寫同一列時會遞增，供大圖快取判斷內容是否變動"""
+        i = self._find(timestamp)
+        count = int(self.ver[i]) if i is not None else 0
+        return count + (self.tail[timestamp][1] if timestamp in self.tail else 0)
+
+    def range(self, start=None, end=None):
+        """時間範圍 [start, end] (含端點，None 表示不限) 內依時間排序的 (timestamps, rows ndarray)"""
+        lo = int(np.searchsorted(self.ts, start.encode("ascii"), 'left')) if start else 0
+        hi = int(np.searchsorted(self.ts, end.encode("ascii"), 'right')) if end else len(self.ts)
+        timestamps = self.ts[lo:hi].astype(f"U{TS_BYTES}").tolist() if hi > lo else []
+        rows = np.asarray(self.row[lo:hi]) if hi > lo else np.zeros(0, dtype=np.int64)
+        if not self.tail:
+            return timestamps, rows
+        if self._tail_keys is None:
+            self._tail_keys = sorted(self.tail)
+        t_lo = bisect.bisect_left(self._tail_keys, start) if start else 0
+        t_hi = bisect.bisect_right(self._tail_keys, end) if end else len(self._tail_keys)
+        if t_lo >= t_hi:
+            return timestamps, rows
+        merged = dict(zip(timestamps, rows.tolist()))
+        for ts in self._tail_keys[t_lo:t_hi]:
+            merged[ts] = self.tail[ts][0]
+        timestamps = sorted(merged)
+        return timestamps, np.array([merged[ts] for ts in timestamps], dtype=np.int64)
+
+    def compact(self):
+        """把尾段併入快照並重寫 index.sorted (先寫暫存檔再替換，讀取中的行程不受影響)"""
+        if not self.tail:
+            return
+        keys = sorted(self.tail)
+        t_ts = np.array(keys, dtype=f"S{TS_BYTES}")
+        t_row = np.array([self.tail[k][0] for k in keys], dtype=np.int64)
+        t_ver = np.array([self.tail[k][1] for k in keys], dtype=np.uint32)
+        ts, row, ver = np.array(self.ts), np.array(self.row), np.array(self.ver)
+        pos = np.searchsorted(ts, t_ts)
+        hit = pos < len(ts)
+        hit[hit] = ts[pos[hit]] == t_ts[hit]
+        row[pos[hit]] = t_row[hit]
+        ver[pos[hit]] += t_ver[hit]
+        new = ~hit
+        ts = np.insert(ts, pos[new], t_ts[new])
+        row = np.insert(row, pos[new], t_row[new])
+        ver = np.insert(ver, pos[new], t_ver[new])
+
+        header = np.array([(INDEX_MAGIC, self.csv_bytes, len(ts), self.max_row)], dtype=INDEX_HEADER)
+        ts_bytes = ts.tobytes()
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header.tobytes())
+                f.write(ts_bytes + b"\0" * (-len(ts_bytes) % 8))
+                f.write(row.astype("<i8").tobytes())
+                f.write(ver.astype("<u4").tobytes())
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # 唯讀的目錄：沿用記憶體中的尾段即可
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._open()
+
+    def __len__(self):
+        if not self.tail:
+            return len(self.ts)
+        return len(self.range()[0])
+
+class TileArchive:
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        with open(os.path.join(archive_dir, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.slots = meta["slots"]
+        self.tile_h = meta["tile_h"]
+        self.tile_w = meta["tile_w"]
+        self.slot_index = {name: i for i, name in enumerate(self.slots)}
+        self.tile_bytes = self.tile_h * self.tile_w * 3
+        self.record_bytes = self.tile_bytes * len(self.slots)
+        self.index = TimeIndex(archive_dir)
+        self._index_file = None
+        self._mm = None
+        self._valid_mm = None
+
+    # ------------------------------------------------------
+    # 建立 / 開啟
+    # ------------------------------------------------------
+    @classmethod
+    def create(cls, archive_dir, slots, tile_h, tile_w):
+        os.makedirs(archive_dir, exist_ok=True)
+        meta = {"slots": list(slots), "tile_h": int(tile_h), "tile_w": int(tile_w), "channels": 3, "order": "BGR"}
+        with open(os.path.join(archive_dir, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+        for name in ("tiles.u8", "valid.u8", "index.csv"):
+            open(os.path.join(archive_dir, name), 'ab').close()
+        return cls(archive_dir)
+
+    @classmethod
+    def open_for_regions(cls, archive_dir, slots, tile_h, tile_w):
+        """開啟既有封存檔並確認版面相符；不存在時建立新的"""
+        if not os.path.exists(os.path.join(archive_dir, "meta.json")):
+            return cls.create(archive_dir, slots, tile_h, tile_w)
+        archive = cls(archive_dir)
+        if (archive.tile_h, archive.tile_w) != (tile_h, tile_w) or not set(slots) <= set(archive.slots):
+            raise ValueError(
+                f"封存檔版面不符 ({archive_dir}): 既有 {archive.tile_w}x{archive.tile_h} / {len(archive.slots)} 槽位，"
+                f"目前 {tile_w}x{tile_h} / {len(slots)} 槽位。請改用 --storage jpg 或移除舊的 {ARCHIVE_DIRNAME} 目錄。")
+        return archive
+
+    @property
+    def data_path(self):
+        return os.path.join(self.archive_dir, "tiles.u8")
+
+    @property
+    def valid_path(self):
+        return os.path.join(self.archive_dir, "valid.u8")
+
+    # ------------------------------------------------------
+    # 寫入：主行程配置列號，工作行程以 pwrite 寫入各自的列
+    # ------------------------------------------------------
+    def reserve_rows(self, timestamps):
+        """為時間點配置列號 (已存在者沿用原列)，並預先擴充檔案大小"""
+        next_row = self.index.max_row + 1
+        assigned = {}
+        for ts in timestamps:
+            if ts in assigned:
+                continue
+            row = self.index.lookup(ts)
+            if row is not None:
+                assigned[ts] = row
+            else:
+                assigned[ts] = next_row
+                next_row += 1
+        n_rows = max(next_row, 0)
+        for path, size in ((self.data_path, n_rows * self.record_bytes), (self.valid_path, n_rows * len(self.slots))):
+            if os.path.getsize(path) < size:
+                with open(path, 'r+b') as f:
+                    f.truncate(size)
+        return assigned
+
+    def commit(self, timestamp, row):
+        """資料寫入完成後才記錄索引，確保中斷時不會留下指向半套資料的索引"""
+        if self._index_file is None:
+            self._index_file = open(os.path.join(self.archive_dir, "index.csv"), 'a', encoding='utf-8')
+        line = f"{timestamp},{row}\n"
+        self._index_file.write(line)
+        self.index.add(timestamp, row, len(line))
+
+    def flush(self):
+        if self._index_file is not None:
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+
+    def close(self):
+        """結束寫入；本次新增的紀錄併入排序快照，之後開啟不必再讀 index.csv 的尾段"""
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+            self.index.compact()
+
+    def write_location(self):
+        """傳給工作行程的可序列化寫入資訊"""
+        return (self.archive_dir, self.tile_h, self.tile_w, len(self.slots), dict(self.slot_index))
+
+    # ------------------------------------------------------
+    # 讀取
+    # ------------------------------------------------------
+    def timestamps(self):
+        return self.index.range()[0]
+
+    def version(self, timestamp):
+        return self.index.version(timestamp)
+
+    def series(self, slot, start=None, end=None):
+        """
+        回傳某槽位依時間排序的 [(timestamp, row)]，只包含實際寫入過的列。
+        start / end 為含端點的時間範圍 (YYYYMMDD_HHMMSS)，在時間索引上二分搜尋，
+        只檢查範圍內 k 列的 valid 旗標：O(log n + k)。
+        """
+        if slot not in self.slot_index:
+            return []
+        timestamps, rows = self.index.range(start, end)
+        if not timestamps:
+            return []
+        valid = self.valid_memmap()
+        inside = rows < valid.shape[0]
+        keep = np.zeros(len(rows), dtype=bool)
+        keep[inside] = valid[rows[inside], self.slot_index[slot]] != 0
+        if keep.all():
+            return list(zip(timestamps, rows.tolist()))
+        idx = np.flatnonzero(keep)
+        return list(zip([timestamps[i] for i in idx.tolist()], rows[idx].tolist()))
+
+    def valid_mask(self):
+        n_rows = os.path.getsize(self.valid_path) // max(1, len(self.slots))
+        if n_rows == 0:
+            return np.zeros((0, len(self.slots)), dtype=np.uint8)
+        return np.fromfile(self.valid_path, dtype=np.uint8, count=n_rows * len(self.slots)).reshape(n_rows, len(self.slots))
+
+    def valid_memmap(self):
+        """valid.u8 的唯讀 memmap (n_rows, n_slots)，只讀取被索引到的列"""
+        n_rows = os.path.getsize(self.valid_path) // max(1, len(self.slots))
+        if n_rows == 0:
+            return np.zeros((0, len(self.slots)), dtype=np.uint8)
+        if self._valid_mm is None or self._valid_mm.shape[0] != n_rows:
+            self._valid_mm = np.memmap(self.valid_path, dtype=np.uint8, mode='r', shape=(n_rows, len(self.slots)))
+        return self._valid_mm
+
+    def memmap(self):
+        """整個封存檔的唯讀 memmap，形狀 (n_rows, n_slots, h, w, 3)"""
+        n_rows = os.path.getsize(self.data_path) // self.record_bytes
+        if n_rows == 0:
+            return np.zeros((0, len(self.slots), self.tile_h, self.tile_w, 3), dtype=np.uint8)
+        # 檔案長度沒變就沿用同一個 memmap，避免每讀一張磁磚都重新映射
+        if self._mm is None or self._mm.shape[0] != n_rows:
+            self._mm = np.memmap(self.data_path, dtype=np.uint8, mode='r',
+                                 shape=(n_rows, len(self.slots), self.tile_h, self.tile_w, 3))
+        return self._mm
+
+def write_tiles(location, row, tiles):
+    """
+    工作行程使用：將 {槽位名稱: BGR 磁磚} 寫入指定列。
+    每個槽位的位置固定，多個行程同時寫入不同列不會互相干擾。
+    """
+    archive_dir, tile_h, tile_w, n_slots, slot_index = location
+    tile_bytes = tile_h * tile_w * 3
+    record_bytes = tile_bytes * n_slots
+    data_fd = os.open(os.path.join(archive_dir, "tiles.u8"), os.O_WRONLY)
+    valid_fd = os.open(os.path.join(archive_dir, "valid.u8"), os.O_WRONLY)
+    try:
+        for name, tile in tiles.items():
+            s = slot_index[name]
+            os.pwrite(data_fd, np.ascontiguousarray(tile, dtype=np.uint8).tobytes(), row * record_bytes + s * tile_bytes)
+            os.pwrite(valid_fd, b"\x01", row * n_slots + s)
+    finally:
+        os.close(data_fd)
+        os.close(valid_fd)
+
+def extract_tile(img, box):
+    """依切割框取出固定大小的磁磚；框超出影像邊界的部分補黑，確保每張磁磚尺寸一致"""
+    x1, y1, x2, y2 = box
+    tile = np.zeros((y2 - y1, x2 - x1, 3), dtype=np.uint8)
+    h, w = img.shape[:2]
+    sx1, sy1, sx2, sy2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+    if sx2 > sx1 and sy2 > sy1:
+        tile[sy1 - y1:sy2 - y1, sx1 - x1:sx2 - x1] = img[sy1:sy2, sx1:sx2]
+    return tile
+
+# ==========================================================
+# [ 讀取端：蒙太奇 / 生命週期產生器共用 ]
+# 影像來源 (ref) 可能是 JPEG 路徑 (str) 或封存檔中的 (封存目錄, 槽位, 列號)
+# ==========================================================
+_ARCHIVE_CACHE = {}
+
+def _get_archive(archive_dir):
+    archive = _ARCHIVE_CACHE.get(archive_dir)
+    if archive is None:
+        archive = TileArchive(archive_dir)
+        _ARCHIVE_CACHE[archive_dir] = archive
+    return archive
+
+def has_archive(dish_dir):
+    return os.path.exists(os.path.join(dish_dir, ARCHIVE_DIRNAME, "meta.json"))
+
+def list_series(dish_dir):
+    """列出 Dish 底下所有序列名稱 (seed_XX / cell_XX)，合併 JPEG 子目錄與封存檔槽位"""
+    names = set()
+    if os.path.isdir(dish_dir):
+        for name in os.listdir(dish_dir):
+            if not name.startswith("_") and os.path.isdir(os.path.join(dish_dir, name)):
+                names.add(name)
+    if has_archive(dish_dir):
+        names.update(_get_archive(os.path.join(dish_dir, ARCHIVE_DIRNAME)).slots)
+    return sorted(names)
+
+def list_frames(dish_dir, series_name, start=None, end=None):
+    """
+    回傳某序列依時間排序的 [(timestamp, ref)]。
+    同一時間點同時存在 JPEG 與封存檔時，以封存檔為準。
+    JPEG 由影像型錄查詢 (見 frame_catalog.py)，不必每次掃描目錄。
+    start / end: 含端點的時間範圍 (YYYYMMDD_HHMMSS，None 表示不限)；
+                 型錄走主鍵 B-tree、封存檔走排序後的時間索引，兩者都只讀出範圍內的 k 筆。
+    """
+    frames = dict(frame_catalog.for_dish_dir(dish_dir).series_images(dish_dir, series_name, start, end))
+    if has_archive(dish_dir):
+        archive_dir = os.path.join(dish_dir, ARCHIVE_DIRNAME)
+        archived = [(ts, (archive_dir, series_name, row))
+                    for ts, row in _get_archive(archive_dir).series(series_name, start, end)]
+        if not frames:
+            return archived  # 已依時間排序
+        frames.update(archived)
+    return sorted(frames.items())
+
+def read_tile(ref):
+    """以 BGR ndarray 讀回一張磁磚 (JPEG 路徑或封存檔位置皆可)"""
+    if isinstance(ref, str):
+        import cv2
+        return cv2.imread(ref)
+    archive_dir, series_name, row = ref
+    archive = _get_archive(archive_dir)
+    return np.asarray(archive.memmap()[row, archive.slot_index[series_name]])
+
+def ref_signature(timestamp, ref):
+    """
+    影像來源的內容指紋 (不讀取影像本身)：
+    JPEG 用檔案大小與修改時間；封存檔用列號與該時間點被寫入的次數。
+    """
+    if isinstance(ref, str):
+        try:
+            st = os.stat(ref)
+        except OSError:
+            return [timestamp, None]
+        return [timestamp, st.st_size, st.st_mtime_ns]
+    archive_dir, series_name, row = ref
+    return [timestamp, series_name, row, _get_archive(archive_dir).version(timestamp)]
+
+def read_stack(refs, tile_h=None, tile_w=None):
+    """
+    一次讀回多張磁磚，回傳 (n, h, w, 3) uint8 陣列與成功讀取的索引。
+    封存檔來源以 memmap 花式索引整批取出；JPEG 逐張解碼，尺寸不一時以左上對齊補黑。
+    未指定尺寸時以第一張成功讀取的磁磚為準。
+    """
+    import cv2
+
+    tiles = [None] * len(refs)
+    archive_rows = {}
+    for i, ref in enumerate(refs):
+        if isinstance(ref, str):
+            tiles[i] = cv2.imread(ref)
+        else:
+            archive_dir, series_name, row = ref
+            archive_rows.setdefault((archive_dir, series_name), []).append((i, row))
+    for (archive_dir, series_name), items in archive_rows.items():
+        archive = _get_archive(archive_dir)
+        idx = np.array([row for _, row in items])
+        block = np.asarray(archive.memmap()[idx, archive.slot_index[series_name]])
+        for (i, _), tile in zip(items, block):
+            tiles[i] = tile
+
+    ok = [i for i, t in enumerate(tiles) if t is not None]
+    if tile_h is None or tile_w is None:
+        if not ok:
+            return np.zeros((0, 0, 0, 3), dtype=np.uint8), []
+        tile_h, tile_w = tiles[ok[0]].shape[:2]
+    stack = np.zeros((len(ok), tile_h, tile_w, 3), dtype=np.uint8)
+    for k, i in enumerate(ok):
+        t = tiles[i]
+        h, w = min(tile_h, t.shape[0]), min(tile_w, t.shape[1])
+        stack[k, :h, :w] = t[:h, :w]
+    return stack, ok
+
+def open_tile(ref):
+    """以 PIL Image 開啟一張磁磚，供 PIL 排版的產生器使用"""
+    from PIL import Image
+    if isinstance(ref, str):
+        return Image.open(ref)
+    return Image.fromarray(read_tile(ref)[..., ::-1])
+
+# ==========================================================
+# [ 大圖縮圖讀取 ]
+# JPEG 以 draft 模式讓 libjpeg 在 DCT 階段直接縮小 (1/2、1/4、1/8)，只解出接近目標大小的像素；
+# 封存檔來源先以整數倍 reduce (區塊平均) 再做最後的內插。縮小不到一半時兩者都不會介入，
+# 輸出與直接 resize 完全相同。解碼結果放在行程內的 LRU 快取 (依位元組數上限淘汰)。
+# ==========================================================
+THUMB_CACHE_BYTES = 256 * 1024 * 1024
+_THUMB_CACHE = OrderedDict()
+_thumb_cache_bytes = 0
+
+def load_thumbnail(ref, size, resample=None):
+    """
+    讀取一張磁磚並縮成 size = (w, h) 的 RGB PIL Image。
+    回傳的影像可能被快取共用，呼叫端只能讀取 (paste 到畫布)，不要直接修改。
+    """
+    global _thumb_cache_bytes
+    from PIL import Image
+    resample = Image.Resampling.LANCZOS if resample is None else resample
+    key = (ref, tuple(size), resample)
+    img = _THUMB_CACHE.get(key)
+    if img is not None:
+        _THUMB_CACHE.move_to_end(key)
+        return img
+
+    if isinstance(ref, str):
+        img = Image.open(ref)
+        img.draft('RGB', tuple(size))  # 非 JPEG 時不作用
+        img.load()                     # 單張影像讀完即關閉檔案
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+    else:
+        img = open_tile(ref)
+        factor = min(img.width // size[0], img.height // size[1])
+        if factor >= 2:
+            img = img.reduce(factor)
+    if img.size != tuple(size):
+        img = img.resize(tuple(size), resample)
+
+    _THUMB_CACHE[key] = img
+    _thumb_cache_bytes += size[0] * size[1] * 3
+    while _thumb_cache_bytes > THUMB_CACHE_BYTES and _THUMB_CACHE:
+        _, old = _THUMB_CACHE.popitem(last=False)
+        _thumb_cache_bytes -= old.width * old.height * 3
+    return img
+
+def clear_thumbnail_cache():
+    """清空縮圖快取 (含位元組計數)，供效能測試量測未快取的讀取"""
+    global _thumb_cache_bytes
+    _THUMB_CACHE.clear()
+    _thumb_cache_bytes = 0
+
+def read_thumbnail_stack(refs, size, resample=None):
+    """
+    load_thumbnail 的整批版本 (NumPy 排版使用)，回傳 (n, h, w, 3) RGB uint8 陣列與成功讀取的索引。
+    封存檔中尺寸剛好等於 size 的磁磚以 memmap 花式索引整批取出，不經過 PIL；其餘逐張 load_thumbnail。
+    """
+    w, h = size
+    stack = np.zeros((len(refs), h, w, 3), dtype=np.uint8)
+    ok = np.zeros(len(refs), dtype=bool)
+    direct = {}
+    for i, ref in enumerate(refs):
+        if not isinstance(ref, str):
+            archive = _get_archive(ref[0])
+            if (archive.tile_h, archive.tile_w) == (h, w):
+                direct.setdefault(ref[0], []).append(i)
+                continue
+        try:
+            stack[i] = np.asarray(load_thumbnail(ref, size, resample))
+            ok[i] = True
+        except Exception:
+            pass
+    for archive_dir, items in direct.items():
+        archive = _get_archive(archive_dir)
+        mm = archive.memmap()
+        items = np.array(items)
+        rows = np.array([refs[i][2] for i in items])
+        slots = np.array([archive.slot_index[refs[i][1]] for i in items])
+        inside = rows < mm.shape[0]
+        stack[items[inside]] = mm[rows[inside], slots[inside]][..., ::-1]
+        ok[items[inside]] = True
+    return stack, np.flatnonzero(ok)
+
+# ==========================================================
+# [ 轉換既有的 JPEG 目錄 ]
+# ==========================================================
+def convert_dish_directory(dish_dir, remove_jpg=False):
+    """
+    將 time_series_crops/<dish>/<seed>/*.jpg 轉成單一封存檔。
+    尺寸較小的舊磁磚 (切割框貼邊被截掉的種子) 以左上對齊補黑。
+    """
+    import cv2
+
+    series_names = [s for s in list_series(dish_dir) if glob.glob(os.path.join(dish_dir, s, "*.jpg"))]
+    if not series_names:
+        print(f"[跳過] {dish_dir} 沒有可轉換的 JPEG。")
+        return None
+
+    # 以各序列第一張影像中最大的尺寸作為磁磚尺寸
+    tile_h = tile_w = 0
+    for s in series_names:
+        sample = sorted(glob.glob(os.path.join(dish_dir, s, "*.jpg")))[0]
+        img = cv2.imread(sample)
+        if img is not None:
+            tile_h, tile_w = max(tile_h, img.shape[0]), max(tile_w, img.shape[1])
+
+    archive = TileArchive.open_for_regions(os.path.join(dish_dir, ARCHIVE_DIRNAME), series_names, tile_h, tile_w)
+    per_ts = {}
+    for s in series_names:
+        for img_path in glob.glob(os.path.join(dish_dir, s, "*.jpg")):
+            ts = os.path.splitext(os.path.basename(img_path))[0]
+            per_ts.setdefault(ts, {})[s] = img_path
+
+    rows = archive.reserve_rows(sorted(per_ts))
+    location = archive.write_location()
+    print(f"[處理] {os.path.basename(dish_dir)}: {len(series_names)} 個序列 x {len(per_ts)} 個時間點")
+    for i, ts in enumerate(sorted(per_ts), start=1):
+        tiles = {}
+        for s, img_path in per_ts[ts].items():
+            img = cv2.imread(img_path)
+            if img is not None:
+                tiles[s] = extract_tile(img, (0, 0, tile_w, tile_h))
+        if tiles:
+            write_tiles(location, rows[ts], tiles)
+            archive.commit(ts, rows[ts])
+        if i % 500 == 0:
+            archive.flush()
+            print(f"  > 已轉換 {i}/{len(per_ts)}")
+    archive.flush()
+    archive.close()
+
+    if remove_jpg:
+        for paths in per_ts.values():
+            for img_path in paths.values():
+                os.remove(img_path)
+    print(f"  > [成功] 封存檔已建立: {archive.archive_dir}")
+    return archive.archive_dir
+
+def run_converter():
+    parser = argparse.ArgumentParser(description="將 time_series_crops 的 JPEG 序列轉為每個 Dish 一個封存檔")
+    parser.add_argument("crops_dir", nargs="?", default=None,
+                        help="time_series_crops 目錄或單一 Dish 目錄 (預設: temp_data/exp1_dish/time_series_crops)")
+    parser.add_argument("--remove-jpg", action="store_true", help="轉換成功後刪除原本的 JPEG")
+    args = parser.parse_args()
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    crops_dir = args.crops_dir or os.path.join(project_root, "temp_data", "exp1_dish", "time_series_crops")
+    if not os.path.isdir(crops_dir):
+        print(f"[錯誤] 找不到目錄: {crops_dir}")
+        sys.exit(1)
+
+    # 目錄底下直接有 seed_XX / cell_XX 子目錄時視為單一 Dish
+    subdirs = sorted(d for d in os.listdir(crops_dir) if os.path.isdir(os.path.join(crops_dir, d)) and not d.startswith("_"))
+    if any(d.startswith(("seed_", "cell_")) for d in subdirs):
+        convert_dish_directory(crops_dir, args.remove_jpg)
+    else:
+        for d in subdirs:
+            convert_dish_directory(os.path.join(crops_dir, d), args.remove_jpg)
+
+if __name__ == "__main__":
+    run_converter()
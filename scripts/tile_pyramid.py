@@ -0,0 +1,312 @@
+import os
+import math
+import json
+import glob
+import xml.etree.ElementTree as ET
+from PIL import Image
+
+import montage_engine
+
+# ==========================================================
+# [ 多解析度圖磚金字塔 (DeepZoom) ]
+# 大圖動輒數十 MB，瀏覽時要整張解碼。這裡把大圖切成 DeepZoom 格式的金字塔：
+#   {name}.dzi                      圖片尺寸等資訊 (XML，OpenSeadragon 等工具也能直接開)
+#   {name}_files/{層}/{欄}_{列}.jpg  每層 256px 的圖磚，第 0 層為 1x1，最高層為原尺寸
+# 同一目錄下的 viewer.html 只載入畫面上看得到的圖磚，開啟任何一張大圖都只需讀幾張小檔案。
+#
+# 一個金字塔可由多張大圖由上而下接成 (例如分頁的生命週期大圖)，
+# 建置時一次只開一張來源大圖、一條 256px 的橫帶，低層由上一層的圖磚兩兩合併縮小，
+# 記憶體用量與大圖尺寸無關。
+# ==========================================================
+TILE_SIZE = 256
+TILE_QUALITY = 85
+BG_COLOR = (20, 20, 20)
+DZI_NS = "http://schemas.microsoft.com/deepzoom/2008"
+MANIFEST_NAME = "manifest.js"
+VIEWER_NAME = "viewer.html"
+
+def max_level(width, height):
+    return max(0, math.ceil(math.log2(max(width, height))))
+
+def level_size(width, height, level, top):
+    scale = 2 ** (top - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+def _tile_path(files_dir, level, col, row):
+    return os.path.join(files_dir, str(level), f"{col}_{row}.jpg")
+
+def _source_bands(sources, width, height):
+    """
+    依序回傳 (y, 高 TILE_SIZE 的橫帶影像)，來源大圖由上而下接在一起；
+    一次只開啟一張來源，較窄的來源以背景色補齊。
+    """
+    offsets, y = [], 0
+    for path in sources:
+        with Image.open(path) as im:
+            offsets.append((y, im.size[1]))
+            y += im.size[1]
+    current, current_idx = None, -1
+    for y0 in range(0, height, TILE_SIZE):
+        y1 = min(y0 + TILE_SIZE, height)
+        band = Image.new('RGB', (width, y1 - y0), BG_COLOR)
+        for idx, (top, h) in enumerate(offsets):
+            if top + h <= y0 or top >= y1:
+                continue
+            if idx != current_idx:
+                if current is not None:
+                    current.close()
+                current = Image.open(sources[idx])
+                current.load()
+                if current.mode != 'RGB':
+                    current = current.convert('RGB')
+                current_idx = idx
+            crop = current.crop((0, max(y0, top) - top, current.size[0], min(y1, top + h) - top))
+            band.paste(crop, (0, max(y0, top) - y0))
+        yield y0, band
+    if current is not None:
+        current.close()
+
+def build_pyramid(sources, out_dir, name):
+    """
+    sources: 來源大圖路徑 (由上而下接成一張)
+    out_dir: 金字塔根目錄，輸出 {out_dir}/{name}.dzi 與 {name}_files/
+    回傳 .dzi 路徑
+    """
+    width, height = 0, 0
+    for path in sources:
+        with Image.open(path) as im:
+            width = max(width, im.size[0])
+            height += im.size[1]
+    if width == 0 or height == 0:
+        return None
+
+    dzi_path = os.path.join(out_dir, f"{name}.dzi")
+    files_dir = os.path.join(out_dir, f"{name}_files")
+    tmp_dir = files_dir + ".tmp"
+    for leftover in (tmp_dir, files_dir + ".old"):
+        if os.path.exists(leftover):
+            _remove_tree(leftover)
+    os.makedirs(tmp_dir)
+    top = max_level(width, height)
+
+    # 最高層：直接由來源大圖切出
+    os.makedirs(os.path.join(tmp_dir, str(top)), exist_ok=True)
+    for y0, band in _source_bands(sources, width, height):
+        row = y0 // TILE_SIZE
+        for x0 in range(0, width, TILE_SIZE):
+            tile = band.crop((x0, 0, min(x0 + TILE_SIZE, width), band.size[1]))
+            tile.save(_tile_path(tmp_dir, top, x0 // TILE_SIZE, row), quality=TILE_QUALITY)
+
+    # 其餘各層：由上一層相鄰 2x2 張圖磚合併後縮成一半
+    for level in range(top - 1, -1, -1):
+        os.makedirs(os.path.join(tmp_dir, str(level)), exist_ok=True)
+        w, h = level_size(width, height, level, top)
+        cw, ch = level_size(width, height, level + 1, top)
+        for row in range(math.ceil(h / TILE_SIZE)):
+            for col in range(math.ceil(w / TILE_SIZE)):
+                x0, y0 = col * 2 * TILE_SIZE, row * 2 * TILE_SIZE
+                merged = Image.new('RGB', (min(2 * TILE_SIZE, cw - x0), min(2 * TILE_SIZE, ch - y0)), BG_COLOR)
+                for dy in range(2):
+                    for dx in range(2):
+                        child = _tile_path(tmp_dir, level + 1, 2 * col + dx, 2 * row + dy)
+                        if os.path.exists(child):
+                            with Image.open(child) as im:
+                                merged.paste(im, (dx * TILE_SIZE, dy * TILE_SIZE))
+                size = (min(TILE_SIZE, w - col * TILE_SIZE), min(TILE_SIZE, h - row * TILE_SIZE))
+                merged.resize(size, Image.Resampling.LANCZOS).save(
+                    _tile_path(tmp_dir, level, col, row), quality=TILE_QUALITY)
+
+    # 完成後才換掉舊的金字塔，中斷時不會留下半套圖磚
+    if os.path.exists(files_dir):
+        old_dir = files_dir + ".old"
+        os.replace(files_dir, old_dir)
+        os.replace(tmp_dir, files_dir)
+        _remove_tree(old_dir)
+    else:
+        os.replace(tmp_dir, files_dir)
+    _write_dzi(dzi_path, width, height)
+    return dzi_path
+
+def _remove_tree(path):
+    for root, dirs, files in os.walk(path, topdown=False):
+        for f in files:
+            os.remove(os.path.join(root, f))
+        for d in dirs:
+            os.rmdir(os.path.join(root, d))
+    os.rmdir(path)
+
+def _write_dzi(dzi_path, width, height):
+    image = ET.Element("Image", {"xmlns": DZI_NS, "TileSize": str(TILE_SIZE), "Overlap": "0", "Format": "jpg"})
+    ET.SubElement(image, "Size", {"Width": str(width), "Height": str(height)})
+    tmp_path = dzi_path + ".tmp"
+    ET.ElementTree(image).write(tmp_path, encoding="utf-8", xml_declaration=True)
+    os.replace(tmp_path, dzi_path)
+
+# ==========================================================
+# [ 瀏覽器 ]
+# 瀏覽器以 file:// 開啟時不能讀取 .dzi (XML)，因此另外把所有金字塔的資訊寫成 manifest.js，
+# 由 viewer.html 以 <script> 載入。
+# ==========================================================
+def write_manifest(out_dir):
+    entries = []
+    for dzi_path in sorted(glob.glob(os.path.join(out_dir, "**", "*.dzi"), recursive=True)):
+        size = ET.parse(dzi_path).getroot().find(f"{{{DZI_NS}}}Size")
+        width, height = int(size.get("Width")), int(size.get("Height"))
+        entries.append({
+            "name": os.path.relpath(dzi_path, out_dir)[:-len(".dzi")].replace(os.sep, "/"),
+            "width": width,
+            "height": height,
+            "tile_size": TILE_SIZE,
+            "max_level": max_level(width, height),
+        })
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        f.write("window.PYRAMIDS = " + json.dumps(entries, ensure_ascii=False, indent=1) + ";\n")
+    with open(os.path.join(out_dir, VIEWER_NAME), 'w', encoding='utf-8') as f:
+        f.write(VIEWER_HTML)
+    return len(entries)
+
+def build_pyramids(groups, out_dir, workers=None, force=False):
+    """
+    groups: [(name, [來源大圖路徑])]，name 為相對 out_dir 的金字塔名稱 (例如 "lifecycle/Dish_A/seed_01")
+    來源沒有變動的金字塔略過 (建置快取與大圖共用 montage_engine.BuildCache)，最後更新 manifest.js 與 viewer.html
+    """
+    print(f"\n[系統] 產生圖磚金字塔: {out_dir}")
+    cache = montage_engine.BuildCache(out_dir)
+    code_sig = montage_engine.code_signature(__file__)
+    jobs, targets = [], []
+    for name, sources in groups:
+        sources = [p for p in sources if os.path.exists(p)]
+        if not sources:
+            continue
+        jobs.append((sources, out_dir, name))
+        targets.append((os.path.join(out_dir, f"{name}.dzi"),
+                        montage_engine.input_signature(code_sig, [name, TILE_SIZE],
+                                                       [(os.path.basename(p), p) for p in sources])))
+    montage_engine.run_jobs(build_pyramid, jobs, workers, label="圖磚金字塔",
+                            cache=cache, targets=targets, force=force)
+    count = write_manifest(out_dir)
+    print(f"[成功] 共 {count} 組金字塔，請以瀏覽器開啟: {os.path.join(out_dir, VIEWER_NAME)}")
+
+VIEWER_HTML = """<!DOCTYPE html>
+<html lang="zh-Hant">
+<head>
+<meta charset="utf-8">
+<title>Montage Viewer</title>
+<style>
+  html, body { margin: 0; height: 100%; background: #141414; color: #ddd; font: 13px sans-serif; }
+  #side { position: absolute; left: 0; top: 0; bottom: 0; width: 260px; display: flex; flex-direction: column; border-right: 1px solid #333; }
+  #filter { margin: 8px; padding: 4px; background: #222; color: #ddd; border: 1px solid #444; }
+  #list { flex: 1; overflow-y: auto; margin: 0; padding: 0; list-style: none; }
+  #list li { padding: 3px 8px; cursor: pointer; white-space: nowrap; }
+  #list li:hover { background: #2a2a2a; }
+  #list li.active { background: #0a5066; color: #fff; }
+  #view { position: absolute; left: 261px; right: 0; top: 0; bottom: 0; overflow: hidden; cursor: grab; }
+  #view img { position: absolute; user-select: none; -webkit-user-drag: none; }
+  #info { position: absolute; right: 8px; bottom: 8px; padding: 2px 6px; background: rgba(0,0,0,.6); pointer-events: none; }
+</style>
+</head>
+<body>
+<div id="side"><input id="filter" placeholder="篩選 (例如 Dish_A seed_01)"><ul id="list"></ul></div>
+<div id="view"><div id="info"></div></div>
+<script src="manifest.js"></script>
+<script>
+// 只載入目前畫面看得到的圖磚：依縮放比例選擇最接近的層，再計算可見範圍內的 (欄, 列)
+const view = document.getElementById("view"), info = document.getElementById("info");
+const list = document.getElementById("list"), filter = document.getElementById("filter");
+const pyramids = window.PYRAMIDS || [];
+let cur = null, scale = 1, ox = 0, oy = 0, tiles = new Map();
+
+function renderList() {
+  const words = filter.value.toLowerCase().split(/\\s+/).filter(Boolean);
+  list.innerHTML = "";
+  for (const p of pyramids) {
+    if (!words.every(w => p.name.toLowerCase().includes(w))) continue;
+    const li = document.createElement("li");
+    li.textContent = p.name;
+    li.className = cur && cur.name === p.name ? "active" : "";
+    li.onclick = () => { location.hash = encodeURIComponent(p.name); };
+    list.appendChild(li);
+  }
+}
+
+function show(name) {
+  cur = pyramids.find(p => p.name === name) || pyramids[0] || null;
+  for (const img of tiles.values()) img.remove();
+  tiles.clear();
+  if (cur) {
+    // 預設整張放進畫面
+    scale = Math.min(view.clientWidth / cur.width, view.clientHeight / cur.height, 1);
+    ox = (view.clientWidth - cur.width * scale) / 2;
+    oy = Math.max(0, (view.clientHeight - cur.height * scale) / 2);
+  }
+  renderList();
+  draw();
+}
+
+function drawLevel(level, wanted) {
+  const f = Math.pow(2, cur.max_level - level), ts = cur.tile_size;
+  const lw = Math.ceil(cur.width / f), lh = Math.ceil(cur.height / f);
+  const x0 = Math.max(0, -ox / scale / f), y0 = Math.max(0, -oy / scale / f);
+  const x1 = Math.min(lw, (view.clientWidth - ox) / scale / f), y1 = Math.min(lh, (view.clientHeight - oy) / scale / f);
+  for (let r = Math.floor(y0 / ts); r * ts < y1; r++) {
+    for (let c = Math.floor(x0 / ts); c * ts < x1; c++) {
+      const key = level + "/" + c + "_" + r;
+      let img = tiles.get(key);
+      if (!img) {
+        img = new Image();
+        img.src = cur.name + "_files/" + key + ".jpg";
+        img.style.zIndex = level;
+        tiles.set(key, img);
+        view.appendChild(img);
+      }
+      const w = Math.min(ts, lw - c * ts), h = Math.min(ts, lh - r * ts);
+      img.style.left = (ox + c * ts * f * scale) + "px";
+      img.style.top = (oy + r * ts * f * scale) + "px";
+      img.style.width = (w * f * scale) + "px";
+      img.style.height = (h * f * scale) + "px";
+      wanted.add(key);
+    }
+  }
+}
+
+function draw() {
+  if (!cur) { info.textContent = "找不到任何金字塔 (manifest.js)"; return; }
+  const level = Math.max(0, Math.min(cur.max_level, cur.max_level + Math.ceil(Math.log2(scale))));
+  const wanted = new Set();
+  // 先鋪一層低解析度底圖，高解析度圖磚載入前不會出現空白
+  drawLevel(Math.max(0, level - 3), wanted);
+  drawLevel(level, wanted);
+  for (const [key, img] of tiles) {
+    if (!wanted.has(key)) { img.remove(); tiles.delete(key); }
+  }
+  info.textContent = cur.name + " | " + cur.width + "x" + cur.height + " | " + Math.round(scale * 100) + "% | 第 " + level + " 層";
+}
+
+view.addEventListener("wheel", e => {
+  e.preventDefault();
+  const k = Math.exp(-e.deltaY * 0.0015), rect = view.getBoundingClientRect();
+  const mx = e.clientX - rect.left, my = e.clientY - rect.top;
+  const s = Math.min(4, Math.max(0.001, scale * k));
+  ox = mx - (mx - ox) * s / scale;
+  oy = my - (my - oy) * s / scale;
+  scale = s;
+  draw();
+}, { passive: false });
+
+let drag = null;
+view.addEventListener("mousedown", e => { drag = [e.clientX - ox, e.clientY - oy]; view.style.cursor = "grabbing"; });
+window.addEventListener("mouseup", () => { drag = null; view.style.cursor = "grab"; });
+window.addEventListener("mousemove", e => {
+  if (!drag) return;
+  ox = e.clientX - drag[0];
+  oy = e.clientY - drag[1];
+  draw();
+});
+window.addEventListener("resize", draw);
+window.addEventListener("hashchange", () => show(decodeURIComponent(location.hash.slice(1))));
+filter.addEventListener("input", renderList);
+show(decodeURIComponent(location.hash.slice(1)));
+</script>
+</body>
+</html>
+"""